@@ -1,50 +1,108 @@
-import asyncio
-import subprocess
+import hashlib
+import hmac
+import time
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from pathlib import Path
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends, Form
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends, Form, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 
-from config import load_secret, load_admin_key, load_sms_base_dir
+from config import (
+    current as current_config, load_sms_base_dir, load_spool_fsync, load_cache_limits,
+    load_state_dir, load_archive_settings, load_sms_roots, load_schedule_rate, load_webhooks,
+    load_retry_policy, load_workers, load_smsd_log,
+)
+from executors import run_admin, run_send
+from sms_archive import SpoolArchive, get_archive
+from sms_cache import ParsedSMS, SMSCache
+from sms_cluster import Cluster, ClusterError, get_cluster, lock_alone
+from sms_export import EXPORT_FORMATS, export_folder, parse_time
+from sms_index import FolderIndex, get_folder_index
+from sms_metrics import gauge
+from sms_paging import InvalidCursor, decode_cursor, encode_cursor, select_page, sort_key
+from sms_retry import RetryEngine, get_retry_engine
+from sms_scheduler import Scheduler, get_scheduler, parse_send_at
+from sms_parser import parse_sms, phone_of, read_sms_header, typed_fields
+from sms_search import MIN_QUERY_LENGTH, SearchIndex, get_search_index
+from sms_stats import StatsCollector, get_stats_collector, running_stats_collector
+from sms_status import FINAL_FOLDERS, TRACKED_FOLDERS, StatusTracker, get_status_tracker
+from sms_watcher import SpoolWatcher, get_watcher, subscribe
+from sms_webhooks import WebhookDispatcher, get_webhook_dispatcher
+from smsd_control import TAIL_LINES, restart as restart_service, tail, tail_command
+from spool_writer import get_spool_writer
 
 # --- Constants ---
 
-ADMIN_KEY = load_admin_key()
-JWT_SECRET = load_secret()
+# ADMIN_KEY and the JWT secret (SECRET_KEY) come from current_config() per
+# request, so a rotated key applies without a restart.
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRE_HOURS = 24
 
 SMS_BASE_DIR = load_sms_base_dir()
+SMS_ROOTS = load_sms_roots()
+SPOOL_FSYNC = load_spool_fsync()
+SMS_CACHE = SMSCache(*load_cache_limits())
+STATE_DIR = load_state_dir()
+WORKERS = load_workers()
+SMSD_LOG = load_smsd_log()
+ARCHIVE_AFTER, ARCHIVE_FOLDERS, ARCHIVE_INTERVAL = load_archive_settings()
+SCHEDULE_RATE, SCHEDULE_BURST = load_schedule_rate()
+WEBHOOKS, WEBHOOK_WORKERS, WEBHOOK_BATCH = load_webhooks()
+RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_REASONS, RETRY_RATE = load_retry_policy()
 ALLOWED_FOLDERS = ["checked", "failed", "incoming", "outgoing", "sent"]
 
 router = APIRouter(prefix="/admin")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 
 # --- Auth helpers ---
 
 def create_token() -> str:
     expire = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRE_HOURS)
-    return jwt.encode({"exp": expire, "sub": "admin"}, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return jwt.encode({"exp": expire, "sub": "admin"}, current_config().secret_key, algorithm=JWT_ALGORITHM)
+
+
+def _decode_token(token: str) -> dict:
+    """Claims of a token signed with any SECRET_KEY accepted right now; raises JWTError."""
+    secrets = current_config().secrets()
+    for secret in secrets[:-1]:
+        try:
+            return jwt.decode(token, secret, algorithms=[JWT_ALGORITHM])
+        except JWTError:
+            pass
+    return jwt.decode(token, secrets[-1], algorithms=[JWT_ALGORITHM])
 
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = _decode_token(credentials.credentials)
         return payload["sub"]
     except JWTError:
         raise HTTPException(status_code=401, detail="INVALID_TOKEN")
 
 
+def verify_metrics_access(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+) -> str:
+    """A scraper's METRICS_TOKEN or an admin token (main.py's /metrics)."""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="INVALID_TOKEN")
+    token = current_config().metrics_token
+    if token and hmac.compare_digest(credentials.credentials.encode(), token.encode()):
+        return "metrics"
+    return verify_token(credentials)
+
+
 # --- Auth endpoint ---
 
 @router.post("/login")
 def admin_login(admin_key: str = Form(...)):
-    if admin_key != ADMIN_KEY:
+    if admin_key != current_config().admin_key:
         raise HTTPException(status_code=403, detail="INVALID_ADMIN_KEY")
     return {"token": create_token()}
 
@@ -62,10 +120,11 @@ def _parse_sms_file(filepath: Path) -> dict:
         "modified_iso": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
     }
     try:
-        text = filepath.read_text(encoding="utf-8", errors="replace")
-        result["content"] = text
+        parsed = SMS_CACHE.get(filepath, stat)
+        result.update(content=parsed.content, headers=parsed.headers, body=parsed.body,
+                      phone=parsed.phone, **parsed.fields)
     except Exception:
-        result["content"] = ""
+        result.update(content="", headers={}, body="", phone="", **typed_fields({}))
     return result
 
 
@@ -74,215 +133,713 @@ def _validate_folder(folder: str):
         raise HTTPException(status_code=400, detail=f"Invalid folder. Allowed: {ALLOWED_FOLDERS}")
 
 
-def _extract_sms_info(f: Path) -> tuple[str, str]:
-    """Extract phone and message body from sms file in one read pass."""
-    phone = ""
-    body = ""
+def _file_entry(f: Path, stat=None) -> dict:
+    """Build file metadata dict with single stat call and a header-only read."""
+    if stat is None:
+        stat = f.stat()
     try:
-        text = f.read_text(encoding="utf-8", errors="replace")
-        lines = text.split("\n")
-        body_start = False
-        for line in lines:
-            if not body_start:
-                stripped = line.strip()
-                if not stripped:
-                    body_start = True
-                    continue
-                if stripped.startswith(("From:", "To:")):
-                    phone = stripped.split(":", 1)[1].strip()
-            else:
-                body += line + "\n"
-        body = body.strip()
-    except Exception:
-        pass
-    return phone, body
-
-
-def _file_entry(f: Path) -> dict:
-    """Build file metadata dict with single stat call."""
-    stat = f.stat()
-    phone, body = _extract_sms_info(f)
+        headers, preview = read_sms_header(f)
+    except OSError:
+        headers, preview = {}, ""
     return {
         "filename": f.name,
         "size": stat.st_size,
         "modified": stat.st_mtime,
         "modified_iso": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
-        "phone": phone,
-        "preview": body[:120],
+        "phone": phone_of(headers),
+        "preview": preview,
+        **typed_fields(headers),
+    }
+
+
+def _roots() -> list[tuple[str, str]]:
+    """(name, base dir) of every spool root; the first one is SMS_BASE_DIR."""
+    return [(SMS_ROOTS[0][0], SMS_BASE_DIR)] + [(name, path) for name, path, _, _ in SMS_ROOTS[1:]]
+
+
+def _root(name: Optional[str] = None) -> tuple[str, str]:
+    """The spool root called name, or the primary root when name is None."""
+    roots = _roots()
+    if name is None:
+        return roots[0]
+    for root in roots:
+        if root[0] == name:
+            return root
+    raise HTTPException(status_code=400, detail=f"Invalid root. Allowed: {[n for n, _ in roots]}")
+
+
+def _state_path(root: tuple[str, str], name: str, suffix: str = "") -> str:
+    """Per-root state location; the primary root keeps the plain name."""
+    if root[0] != SMS_ROOTS[0][0]:
+        name = f"{name}-{root[0]}"
+    return str(Path(STATE_DIR) / f"{name}{suffix}")
+
+
+def _folder_index(folder: str, base_dir: Optional[str] = None) -> FolderIndex:
+    return get_folder_index(Path(base_dir or SMS_BASE_DIR) / folder, _file_entry)
+
+
+def _load_search_doc(f: Path) -> tuple[dict[str, str], str]:
+    """Headers and full body for the search index (bypasses the LRU cache)."""
+    with open(f, "rb") as fh:
+        return parse_sms(fh.read().decode("utf-8", errors="replace"))
+
+
+def _search_index(root: Optional[tuple[str, str]] = None) -> SearchIndex:
+    return get_search_index(_state_path(root or _root(), "search", ".sqlite"), _load_search_doc)
+
+
+def _archive(root: Optional[tuple[str, str]] = None) -> SpoolArchive:
+    return get_archive(_state_path(root or _root(), "archive"))
+
+
+def start_compaction():
+    """Compact every root periodically when ARCHIVE_AFTER_DAYS is set (main.py, on the primary)."""
+    if ARCHIVE_AFTER <= 0:
+        return
+    for root in _roots():
+        _spool_watcher(root).start()
+        indexes = [_folder_index(f, root[1]) for f in ARCHIVE_FOLDERS if f in ALLOWED_FOLDERS]
+        _archive(root).start(indexes, ARCHIVE_AFTER, ARCHIVE_INTERVAL)
+
+
+def _archived_sms_file(folder: str, entry: dict, raw: bytes) -> dict:
+    """Detail view of an archived message, shaped like _parse_sms_file."""
+    parsed = ParsedSMS(raw.decode("utf-8", errors="replace"))
+    return {
+        "filename": entry["filename"],
+        "folder": folder,
+        "size": entry["size"],
+        "modified": entry["modified"],
+        "modified_iso": entry["modified_iso"],
+        "content": parsed.content,
+        "headers": parsed.headers,
+        "body": parsed.body,
+        "phone": parsed.phone,
+        **parsed.fields,
+        "archived": True,
     }
 
 
+# --- Conditional GET ---
+
+def _etag(*parts: str) -> str:
+    return '"' + hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()[:24] + '"'
+
+
+def _not_modified(request: Request, etag: Optional[str]) -> bool:
+    """Whether If-None-Match names etag (weak comparison: compression makes ETags weak)."""
+    header = request.headers.get("if-none-match")
+    if etag is None or not header:
+        return False
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def _cache_headers(etag: Optional[str]) -> dict[str, str]:
+    # Private (per admin), and revalidated on every use.
+    headers = {"Cache-Control": "private, no-cache"}
+    if etag is not None:
+        headers["ETag"] = etag
+    return headers
+
+
+def _listing_etag(folder: str, query: str) -> str:
+    """Validator of one listing URL from every root's folder version; reads no file."""
+    versions = []
+    for _, base_dir in _roots():
+        index = _folder_index(folder, base_dir)
+        index.refresh()
+        versions.append(index.version)
+    return _etag(folder, query, *versions)
+
+
+def _file_etag(folder: str, filename: str, roots: list[tuple[str, str]]) -> Optional[str]:
+    """Validator of a file's detail view from its indexed (mtime, size); None if not indexed."""
+    for name, base_dir in roots:
+        index = _folder_index(folder, base_dir)
+        if not index.loaded:
+            return None
+        index.refresh()
+        key = index.key(filename)
+        if key is not None:
+            return _etag(name, folder, filename, *map(str, key))
+    return None
+
+
 # --- SMS API endpoints ---
 
 @router.get("/api/sms/{folder}")
-def list_sms_files(
+async def list_sms_files(
+    request: Request,
     folder: str,
     sort_by: str = "modified",
     sort_order: str = "desc",
     search: Optional[str] = None,
     page: int = 1,
     per_page: int = 50,
+    modem: Optional[str] = None,
+    cursor: Optional[str] = None,
     _admin: str = Depends(verify_token),
 ):
-    """List SMS files in a folder with optional search, sort, and pagination."""
-    _validate_folder(folder)
-    folder_path = Path(SMS_BASE_DIR) / folder
+    """List SMS files in a folder with optional search, sort, and pagination.
 
-    if not folder_path.exists():
-        return {"files": [], "total": 0, "page": 1, "per_page": per_page, "pages": 0}
+    search matches filename, phone, headers and body (substring, case
+    insensitive) through the full-text index; queries shorter than three
+    characters fall back to matching the filename only.
 
-    files = []
-    for f in folder_path.iterdir():
-        if f.is_file() and not f.name.startswith("."):
-            if search and search.lower() not in f.name.lower():
-                continue
-            files.append(_file_entry(f))
+    sort_by accepts "modified", "name", "size" or any parsed status field
+    (sent, received, modem, message_id, ...); files lacking it sort last.
 
-    # Sort
-    reverse = sort_order == "desc"
-    if sort_by == "name":
-        files.sort(key=lambda x: x["filename"].lower(), reverse=reverse)
-    else:
-        files.sort(key=lambda x: x["modified"], reverse=reverse)
+    Pass the returned next_cursor back as cursor to fetch the following page;
+    unlike page numbers, cursor pages do not shift as files arrive or leave.
 
-    # Paginate
-    total = len(files)
+    Messages compacted into the archive are listed alongside live files and
+    carry "archived": true.
+
+    The ETag changes with the folder; a matching If-None-Match gets a 304.
+    """
+    _validate_folder(folder)
+    # Full-text results follow the search index, which may lag the folder.
+    full_text = search is not None and len(search) >= MIN_QUERY_LENGTH
+    etag = None if full_text else await run_admin(_listing_etag, folder, request.url.query)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    result = await run_admin(_list_folder, folder, sort_by, sort_order, search, page, per_page,
+                             modem, cursor)
+    return JSONResponse(result, headers=_cache_headers(etag))
+
+
+def _list_folder(folder: str, sort_by: str, sort_order: str, search: Optional[str],
+                 page: int, per_page: int, modem: Optional[str] = None,
+                 cursor: Optional[str] = None) -> dict:
+    # Sort + paginate: top-k selection, after the cursor key when given
+    reverse = sort_order == "desc"
+    key = sort_key(sort_by, reverse)
     per_page = max(1, min(per_page, 200))
     page = max(1, page)
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, sort_by, sort_order)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="INVALID_CURSOR")
+    offset = 0 if cursor else (page - 1) * per_page
+
+    # Each root contributes its own first offset + per_page + 1 rows; the
+    # page is then picked from their union.
+    total = 0
+    candidates = []
+    for root in _roots():
+        root_total, rows = _root_candidates(root, folder, sort_by, key, reverse, search, modem,
+                                            offset + per_page + 1, after)
+        total += root_total
+        candidates.extend({**row, "root": root[0]} for row in rows)
+
     pages = (total + per_page - 1) // per_page if total else 0
-    start = (page - 1) * per_page
-    files = files[start:start + per_page]
+    files = select_page(candidates, key, reverse, offset, per_page + 1)
+
+    next_cursor = None
+    if len(files) > per_page:
+        files = files[:per_page]
+        next_cursor = encode_cursor(sort_by, sort_order, key(files[-1]))
+
+    return {"files": files, "total": total, "page": page, "per_page": per_page, "pages": pages,
+            "next_cursor": next_cursor}
+
+
+def _root_candidates(root: tuple[str, str], folder: str, sort_by: str, key, reverse: bool,
+                     search: Optional[str], modem: Optional[str], limit: int,
+                     after: Optional[tuple]) -> tuple[int, list[dict]]:
+    """(match count, first limit matches after the cursor key) for one root's folder."""
+    if not (Path(root[1]) / folder).exists():
+        return 0, []
+
+    index = _folder_index(folder, root[1])
+    archive = _archive(root)
+    archived = archived_total = None
+    if search and len(search) >= MIN_QUERY_LENGTH:
+        names = on_primary("search", root[0], folder, search)
+        files = [f for f in map(index.get, names) if f is not None]
+        archived = archive.search(folder, search)
+    else:
+        index.refresh()
+        files = index.entries()
+        if search:
+            needle = search.lower()
+            files = [f for f in files if needle in f["filename"].lower()]
+            archived = list(archive.entries(folder, name_contains=needle))
+    if modem:
+        files = [f for f in files if f.get("modem") == modem]
+        if archived is not None:
+            archived = [f for f in archived if f.get("modem") == modem]
+
+    # A file archived moments before its unlink is still live; keep that copy.
+    if archived is None:
+        # Only live files no newer than the newest archived one can be both.
+        newest = archive.newest(folder)
+        maybe = [f["filename"] for f in files if newest is not None and f["modified"] <= newest]
+        doubled = archive.archived_names(folder, maybe)
+        archived_total = archive.count(folder, modem) - len(doubled)
+        # The page's candidates straight from the catalogue.
+        archived = archive.top(folder, sort_by, reverse, limit + len(doubled), after, modem)
+    archived = [f for f in archived if index.get(f["filename"]) is None]
+    if archived_total is None:
+        archived_total = len(archived)
+
+    return len(files) + archived_total, select_page(files + archived, key, reverse, 0, limit, after)
+
+
+async def _iterate_admin(chunks):
+    """Drive a blocking byte generator on the admin executor, chunk by chunk."""
+    try:
+        while True:
+            chunk = await run_admin(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
+
+
+# Registered before the {filename} route so "export" is not read as a file.
+@router.get("/api/sms/{folder}/export")
+async def export_sms_files(
+    folder: str,
+    fmt: str = Query("ndjson", alias="format"),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    phone: Optional[str] = None,
+    root: Optional[str] = None,
+    _admin: str = Depends(verify_token),
+):
+    """Stream every message in a folder as NDJSON, CSV or a .tar.gz of the raw files.
 
-    return {"files": files, "total": total, "page": page, "per_page": per_page, "pages": pages}
+    since/until (unix seconds or ISO 8601) bound the file mtime; phone keeps
+    messages whose From/To contains it. root selects the spool root (default:
+    the primary one).
+    """
+    _validate_folder(folder)
+    base_dir = _root(root)[1]
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Allowed: {list(EXPORT_FORMATS)}")
+    try:
+        since_ts, until_ts = parse_time(since), parse_time(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="INVALID_TIME")
+
+    media_type, ext = EXPORT_FORMATS[fmt]
+    chunks = export_folder(Path(base_dir) / folder, fmt, since_ts, until_ts, phone)
+    return StreamingResponse(
+        _iterate_admin(chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{folder}-export.{ext}"'},
+    )
 
 
 @router.get("/api/sms/{folder}/{filename}")
-def read_sms_file(
+async def read_sms_file(
+    request: Request,
     folder: str,
     filename: str,
+    root: Optional[str] = None,
     _admin: str = Depends(verify_token),
 ):
-    """Read a specific SMS file content."""
+    """Read a specific SMS file content; without root every spool root is tried in turn.
+
+    Live files carry an ETag; a matching If-None-Match gets a 304 without reading the file.
+    """
     _validate_folder(folder)
+    roots = [_root(root)] if root else _roots()
+    etag = await run_admin(_file_etag, folder, Path(filename).name, roots)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    result = await run_admin(_read_folder_file, folder, filename, roots)
+    return JSONResponse(result, headers=_cache_headers(etag))
 
+
+def _read_folder_file(folder: str, filename: str,
+                      roots: Optional[list[tuple[str, str]]] = None) -> dict:
     # Prevent path traversal
     safe_name = Path(filename).name
-    filepath = Path(SMS_BASE_DIR) / folder / safe_name
+    roots = roots or _roots()
+
+    for name, base_dir in roots:
+        filepath = Path(base_dir) / folder / safe_name
+        if filepath.is_file():
+            return {**_parse_sms_file(filepath), "root": name}
+    for root in roots:
+        found = _archive(root).read(folder, safe_name)
+        if found is not None:
+            return {**_archived_sms_file(folder, *found), "root": root[0]}
+    raise HTTPException(status_code=404, detail="FILE_NOT_FOUND")
+
+
+# --- Delivery statistics ---
+
+@router.get("/api/stats")
+async def sms_stats(root: Optional[str] = None, _admin: str = Depends(verify_token)):
+    """Per-folder counts, arrival histograms, failure rates, modems and top numbers."""
+    return await run_admin(_collect_stats, _root(root))
+
+
+def _collect_stats(root: Optional[tuple[str, str]] = None) -> dict:
+    return _stats_collector(root or _root()).snapshot()
+
+
+def _stats_collector(root: tuple[str, str]) -> StatsCollector:
+    # Counters follow the watcher's change stream; start it so they stay live.
+    _spool_watcher(root).start()
+    collector = get_stats_collector(root[1])
+    archive = _archive(root)
+    for folder in ALLOWED_FOLDERS:
+        archived = partial(archive.entries, folder) if folder in ARCHIVE_FOLDERS else None
+        collector.attach(_folder_index(folder, root[1]), archived)
+    return collector
+
+
+def start_stats_collectors():
+    """Start every root's collector, so root_failure_rate has data (main.py, at startup)."""
+    for root in _roots():
+        _stats_collector(root)
+
+
+def root_failure_rate(name: str) -> Optional[float]:
+    """Last-hour failure rate of one spool root, for placing outgoing messages.
+
+    None while that root's collector is not running: the send path never
+    starts watchers or scans folders itself.
+    """
+    base_dirs = dict(_roots())
+    collector = running_stats_collector(base_dirs[name]) if name in base_dirs else None
+    return collector.failure_rate("last_hour") if collector is not None else None
 
-    if not filepath.exists() or not filepath.is_file():
-        raise HTTPException(status_code=404, detail="FILE_NOT_FOUND")
 
-    return _parse_sms_file(filepath)
+# --- Delivery status ---
+
+def _status_tracker(root: tuple[str, str]) -> StatusTracker:
+    _spool_watcher(root).start()
+    tracker = get_status_tracker(root[1])
+    for folder in TRACKED_FOLDERS:
+        tracker.attach(_folder_index(folder, root[1]))
+    return tracker
+
+
+def delivery_status(filenames: list[str]) -> list[Optional[dict]]:
+    """Where each outgoing message file is now, across all roots; None if unknown."""
+    trackers = [(root, _status_tracker(root)) for root in _roots()]
+    results = []
+    for filename in filenames:
+        name = Path(filename).name
+        found = next(({**status, "root": root[0]} for root, tracker in trackers
+                      if (status := tracker.status(name)) is not None), None)
+        results.append(found or _archived_status(name))
+    return results
+
+
+def _archived_status(filename: str) -> Optional[dict]:
+    for root in _roots():
+        for folder in FINAL_FOLDERS:
+            entry = _archive(root).entry(folder, filename)
+            if entry is not None:
+                return {
+                    "file": filename, "state": folder, "final": True,
+                    "fail_reason": entry.get("fail_reason") if folder == "failed" else None,
+                    "modem": entry.get("modem"), "present": False, "archived": True,
+                    "history": [{"folder": folder, "at": entry["modified"]}], "root": root[0],
+                }
+    return None
+
+
+# --- Archive ---
+
+@router.post("/api/archive/compact")
+async def compact_archive(
+    older_than_days: Optional[float] = None,
+    _admin: str = Depends(verify_token),
+):
+    """Archive messages older than older_than_days (default ARCHIVE_AFTER_DAYS) right away."""
+    age = older_than_days * 86400 if older_than_days is not None else ARCHIVE_AFTER
+    if age < 0 or (older_than_days is None and age == 0):
+        raise HTTPException(status_code=400, detail="INVALID_AGE")
+    return await run_admin(on_primary, "compact", age)
+
+
+def _compact_folders(age: float) -> dict:
+    cutoff = time.time() - age
+    archived = dict.fromkeys((f for f in ARCHIVE_FOLDERS if f in ALLOWED_FOLDERS), 0)
+    for root in _roots():
+        archive = _archive(root)
+        for folder in archived:
+            archived[folder] += archive.compact(_folder_index(folder, root[1]), cutoff)
+    return {"status": "OK", "archived": archived}
+
+
+# --- Automatic retries ---
+
+def retry_engine() -> Optional[RetryEngine]:
+    """The engine re-queueing transient failures of every root, or None when disabled."""
+    if RETRY_MAX_ATTEMPTS <= 0:
+        return None
+    engine = get_retry_engine(str(Path(STATE_DIR) / "retries.sqlite"), _write_retries, RETRY_MAX_ATTEMPTS,
+                              RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_REASONS, RETRY_RATE)
+    for root in _roots():
+        _spool_watcher(root).start()
+        engine.attach(_folder_index("failed", root[1]), root[0])
+    return engine
+
+
+def _write_retries(name: str, messages: list[tuple[str, str, dict[str, str]]]) -> list[str]:
+    # Runs on the engine's thread: no HTTPException for a root gone from SMS_ROOTS.
+    base_dir = dict(_roots()).get(name)
+    if base_dir is None:
+        raise LookupError(f"unknown spool root {name!r}")
+    outgoing = Path(base_dir) / "outgoing"
+    outgoing.mkdir(parents=True, exist_ok=True)
+    return get_spool_writer(str(outgoing), SPOOL_FSYNC).write_many(
+        [(phone, message) for phone, message, _ in messages], headers=[h for _, _, h in messages])
+
+
+@router.get("/api/retries")
+async def retry_metrics(_admin: str = Depends(verify_token)):
+    """Automatic retry decisions by state and fail reason, deferrals and roots in outage."""
+    return await run_admin(on_primary, "retries")
+
+
+def _retry_metrics() -> dict:
+    engine = retry_engine()
+    if engine is None:
+        return {"enabled": False}
+    return {"enabled": True, **engine.metrics()}
 
 
 # --- Send test SMS ---
 
 @router.post("/api/send-test-sms")
-def send_test_sms(
+async def send_test_sms(
     phone: str = Form(...),
     message: str = Form(...),
+    root: Optional[str] = Form(None),
+    send_at: Optional[str] = Form(None),
     _admin: str = Depends(verify_token),
 ):
-    """Send a test SMS by writing to the outgoing spool directory."""
-    import time
-    ts = int(time.time())
-    filename = f"sms_{ts}_{phone}.sms"
-    outgoing = Path(SMS_BASE_DIR) / "outgoing"
+    """Send a test SMS by writing to the outgoing spool directory of a root (default: primary).
+
+    With send_at (unix seconds or ISO 8601) in the future it is scheduled instead.
+    """
+    name, base_dir = _root(root)
+    try:
+        when = parse_send_at(send_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="INVALID_SEND_AT")
+    if when is not None:
+        [schedule_id] = await run_send(on_primary, "schedule", [(phone, message, name, when)])
+        return {"status": "SCHEDULED", "id": schedule_id, "root": name,
+                "send_at": datetime.fromtimestamp(when, timezone.utc).isoformat()}
+    filename = await run_send(_write_test_sms, phone, message, base_dir)
+    return {"status": "OK", "file": filename, "root": name}
+
+
+def _write_test_sms(phone: str, message: str, base_dir: Optional[str] = None) -> str:
+    outgoing = Path(base_dir or SMS_BASE_DIR) / "outgoing"
     outgoing.mkdir(parents=True, exist_ok=True)
-    filepath = outgoing / filename
+    return get_spool_writer(str(outgoing), SPOOL_FSYNC).write(phone, message)
+
+
+# --- Scheduled sends ---
+
+def _scheduler() -> Scheduler:
+    # main.py wires the release callback into the same scheduler at startup.
+    return get_scheduler(str(Path(STATE_DIR) / "schedule.sqlite"), rate=SCHEDULE_RATE,
+                         burst=SCHEDULE_BURST)
+
+
+@router.get("/api/scheduled")
+async def list_scheduled(
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    _admin: str = Depends(verify_token),
+):
+    """Messages waiting for their send_at, earliest first."""
+    return await run_admin(on_primary, "scheduled", limit, offset)
+
+
+def _list_scheduled(limit: int, offset: int) -> dict:
+    scheduler = _scheduler()
+    return {"total": len(scheduler), "items": scheduler.pending(limit, offset)}
+
+
+@router.delete("/api/scheduled/{schedule_id}")
+async def cancel_scheduled(schedule_id: str, _admin: str = Depends(verify_token)):
+    if not await run_admin(on_primary, "cancel_scheduled", schedule_id):
+        raise HTTPException(status_code=404, detail="NOT_FOUND")
+    return {"status": "CANCELLED", "id": schedule_id}
+
+
+# --- Webhooks ---
+
+def webhook_dispatcher() -> Optional[WebhookDispatcher]:
+    """The outbox following every root's subscribed folders, or None without WEBHOOKS.
+
+    Events are signed with the current SECRET_KEY; main.py runs the delivery workers.
+    """
+    if not WEBHOOKS:
+        return None
+    secret = lambda: current_config().secret_key
+    dispatcher = get_webhook_dispatcher(str(Path(STATE_DIR) / "webhooks.sqlite"), WEBHOOKS, secret,
+                                        WEBHOOK_WORKERS, WEBHOOK_BATCH)
+    for root in _roots():
+        # Same change stream as the WebSocket: the watcher keeps these indexes live.
+        _spool_watcher(root).start()
+        for folder in dispatcher.folders & set(ALLOWED_FOLDERS):
+            dispatcher.attach(_folder_index(folder, root[1]), root[0])
+    return dispatcher
+
+
+@router.get("/api/webhooks")
+async def webhook_status(_admin: str = Depends(verify_token)):
+    """Configured webhooks and outbox progress."""
+    return await run_admin(on_primary, "webhooks")
+
+
+def _webhook_status() -> dict:
+    dispatcher = webhook_dispatcher()
+    if dispatcher is None:
+        return {"hooks": [], "pending": 0, "delivered": 0, "failures": 0}
+    return {
+        "hooks": [{"url": url, "folders": list(folders)} for url, folders in dispatcher.hooks],
+        "pending": len(dispatcher),
+        "delivered": dispatcher.delivered,
+        "failures": dispatcher.failures,
+    }
+
+
+# --- Workers ---
+
+def cluster() -> Optional[Cluster]:
+    """This worker's membership among WORKERS uvicorn workers, or None when it runs alone."""
+    if WORKERS <= 1:
+        return None
+    return get_cluster(STATE_DIR, lambda: [_spool_watcher(root) for root in _roots()], _PRIMARY_CALLS)
+
 
-    content = f"To: {phone}\n\n{message}\n"
-    filepath.write_text(content, encoding="utf-8")
+def lock_state_dir():
+    """Refuse to run alone beside other workers on STATE_DIR (main.py, at startup with WORKERS=1)."""
+    lock_alone(STATE_DIR)
+
+
+def is_primary() -> bool:
+    """Whether this worker runs the engines and owns the spool watchers."""
+    member = cluster()
+    return member is None or member.is_primary
+
+
+def on_primary(name: str, *args):
+    """Run one of _PRIMARY_CALLS in the worker that owns its state (blocking)."""
+    member = cluster()
+    if member is None:
+        return _PRIMARY_CALLS[name](*args)
+    try:
+        return member.call(name, *args)
+    except ClusterError:
+        raise HTTPException(status_code=503, detail="PRIMARY_UNAVAILABLE")
 
-    return {"status": "OK", "file": filename}
+
+def _search_names(name: str, folder: str, query: str) -> list[str]:
+    root = _root(name)
+    search_index = _search_index(root)
+    search_index.attach(_folder_index(folder, root[1]))
+    return search_index.search(folder, query)
+
+
+# Arguments and results cross the cluster socket as JSON.
+_PRIMARY_CALLS = {
+    "schedule": lambda items: _scheduler().schedule([tuple(item) for item in items]),
+    "cancel_scheduled": lambda schedule_id: _scheduler().cancel(schedule_id),
+    "scheduled": _list_scheduled,
+    "retries": _retry_metrics,
+    "webhooks": _webhook_status,
+    "compact": _compact_folders,
+    "search": _search_names,
+}
 
 
 # --- Restart smsd service ---
 
 @router.post("/api/restart-smsd")
-def restart_smsd(_admin: str = Depends(verify_token)):
-    """Restart smsd (smstools) service and stream output."""
-    def stream():
-        yield ">> Checking smsd status...\n"
-        try:
-            status = subprocess.run(
-                ["sudo", "systemctl", "status", "smstools"],
-                capture_output=True, text=True, timeout=10
-            )
-            yield status.stdout + status.stderr + "\n"
-        except Exception as e:
-            yield f"Error checking status: {e}\n"
-
-        yield ">> Restarting smsd...\n"
-        try:
-            restart = subprocess.run(
-                ["sudo", "systemctl", "restart", "smstools"],
-                capture_output=True, text=True, timeout=30
-            )
-            if restart.returncode == 0:
-                yield ">> smsd restarted successfully\n"
-            else:
-                yield f">> Restart failed (code {restart.returncode})\n"
-                yield restart.stderr + "\n"
-        except Exception as e:
-            yield f"Error restarting: {e}\n"
+async def restart_smsd(_admin: str = Depends(verify_token)):
+    """Restart smsd (smstools) service and stream output as it is produced."""
+    return StreamingResponse(restart_service(), media_type="text/plain")
 
-        yield "\n>> Verifying smsd status...\n"
-        try:
-            verify = subprocess.run(
-                ["sudo", "systemctl", "status", "smstools"],
-                capture_output=True, text=True, timeout=10
-            )
-            yield verify.stdout + verify.stderr
-        except Exception as e:
-            yield f"Error verifying: {e}\n"
 
-    return StreamingResponse(stream(), media_type="text/plain")
+@router.get("/api/smsd/log")
+async def smsd_log(
+    lines: int = Query(TAIL_LINES, ge=0, le=10000),
+    _admin: str = Depends(verify_token),
+):
+    """Live tail of the smsd log (SMSD_LOG, else the smstools journal) until the client disconnects."""
+    return StreamingResponse(tail(tail_command(SMSD_LOG, lines)), media_type="text/plain",
+                             headers={"Cache-Control": "no-cache"})
 
 
-# --- WebSocket for realtime updates ---
+# --- Metrics (read at scrape time) ---
 
-async def _watch_sms_dirs(websocket: WebSocket):
-    """Watch SMS directories and send new/removed file events via WebSocket."""
-    known_files: dict[str, set[str]] = {}
-    for folder in ALLOWED_FOLDERS:
-        folder_path = Path(SMS_BASE_DIR) / folder
-        if folder_path.exists():
-            known_files[folder] = {f.name for f in folder_path.iterdir() if f.is_file()}
-        else:
-            known_files[folder] = set()
+def _folder_counts() -> dict[tuple[str, str], int]:
+    # Only folders already loaded: a scrape must never trigger a scan.
+    counts = {}
+    for name, base_dir in _roots():
+        for folder in ALLOWED_FOLDERS:
+            index = _folder_index(folder, base_dir)
+            if index.loaded:
+                counts[(name, folder)] = len(index)
+    return counts
 
-    while True:
-        # Send heartbeat ping to keep connection alive through proxies
-        await websocket.send_json({"event": "heartbeat"})
-        await asyncio.sleep(2)
 
-        for folder in ALLOWED_FOLDERS:
-            folder_path = Path(SMS_BASE_DIR) / folder
-            if not folder_path.exists():
-                continue
+def _cache_stat(key: str):
+    return lambda: {(): SMS_CACHE.stats()[key]}
+
+
+gauge("sms_folder_files", "Files in each spool folder.", ("root", "folder"), _folder_counts)
+gauge("sms_cache_hits_total", "Parsed message cache hits.", collect=_cache_stat("hits"), kind="counter")
+gauge("sms_cache_misses_total", "Parsed message cache misses.", collect=_cache_stat("misses"), kind="counter")
+gauge("sms_cache_entries", "Parsed messages held in the cache.", collect=_cache_stat("entries"))
+WS_CLIENTS = gauge("sms_websocket_clients", "Connected dashboard WebSocket clients.")
 
-            current_files = {f.name for f in folder_path.iterdir() if f.is_file()}
-            new_files = current_files - known_files.get(folder, set())
-            removed_files = known_files.get(folder, set()) - current_files
 
-            for fname in new_files:
-                fpath = folder_path / fname
-                if fpath.exists():
-                    await websocket.send_json({
-                        "event": "new_file",
-                        "folder": folder,
-                        "file": _file_entry(fpath),
-                    })
+# --- WebSocket for realtime updates ---
+
+WS_HEARTBEAT_INTERVAL = 2
+
 
-            for fname in removed_files:
-                await websocket.send_json({
-                    "event": "removed_file",
-                    "folder": folder,
-                    "filename": fname,
-                })
+def _spool_watcher(root: Optional[tuple[str, str]] = None) -> SpoolWatcher:
+    name, base_dir = root or _root()
+    indexes = [_folder_index(folder, base_dir) for folder in ALLOWED_FOLDERS]
+    return get_watcher(base_dir, indexes, root=name)
 
-            known_files[folder] = current_files
+
+async def _watch_sms_dirs(websocket: WebSocket):
+    """Forward change events from every root's shared spool watcher to one client."""
+    watchers = [_spool_watcher(root) for root in _roots()]
+    for watcher in watchers:
+        await run_admin(watcher.start)
+    sub = subscribe(watchers)
+    WS_CLIENTS.inc()
+    try:
+        # Send heartbeat ping to keep connection alive through proxies
+        await websocket.send_json({"event": "heartbeat"})
+        while True:
+            event = await sub.get(WS_HEARTBEAT_INTERVAL)
+            if sub.overflowed:
+                # Client can't keep up; let it reconnect rather than buffer forever.
+                await websocket.close(code=1013, reason="SLOW_CONSUMER")
+                return
+            if event is None:
+                await websocket.send_json({"event": "heartbeat"})
+            else:
+                # "previous" is for in-process consumers only.
+                await websocket.send_json({k: v for k, v in event.items() if k != "previous"})
+    finally:
+        WS_CLIENTS.dec()
+        sub.close()
 
 
 @router.websocket("/ws")
@@ -290,7 +847,7 @@ async def sms_websocket(websocket: WebSocket):
     """WebSocket endpoint for realtime SMS file updates. Requires token as query param."""
     token = websocket.query_params.get("token", "")
     try:
-        jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        _decode_token(token)
     except JWTError:
         await websocket.close(code=4001, reason="INVALID_TOKEN")
         return
@@ -0,0 +1,278 @@
+"""Benchmarks for the gateway's hot paths, reported as JSON.
+
+Each scenario starts the real app under uvicorn in a subprocess, against a
+throwaway passkey.conf and a generated spool (see bench.spool_gen), and
+drives it over HTTP/WebSocket from this process:
+
+    send       /send-sms requests/s and p50/p99 latency at a given concurrency
+    listing    GET /admin/api/sms/sent latency per folder size: the first
+               (cold) request after startup, then p50/p99 of warm requests
+    websocket  delay from a file landing in sent/ to each of N dashboard
+               clients receiving its new_file event, and server CPU meanwhile
+
+    python -m bench.run --out results.json
+    python -m bench.run --scenarios listing --sizes 1000,10000,100000,1000000
+
+Compare two runs with any JSON diff; every latency is in milliseconds.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import websockets
+
+from bench.spool_gen import generate, make_message
+
+REPO = Path(__file__).resolve().parent.parent
+SECRET_KEY = "bench-secret"
+ADMIN_KEY = "bench-admin"
+SCENARIOS = ("send", "listing", "websocket")
+
+
+def _percentiles(samples: list[float]) -> dict:
+    """count, p50, p99, max in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p99_ms": pick(0.99),
+            "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a process (Linux /proc only)."""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Server:
+    """The app under uvicorn, configured for one scenario."""
+
+    def __init__(self, workdir: Path, base_dir: Path, extra_config: Optional[dict] = None):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        conf = workdir / "passkey.conf"
+        config = {"SECRET_KEY": SECRET_KEY, "ADMIN_KEY": ADMIN_KEY, "SMS_BASE_DIR": str(base_dir),
+                  "STATE_DIR": str(workdir / "state"), **(extra_config or {})}
+        conf.write_text("".join(f"{k}={v}\n" for k, v in config.items()))
+        self._env = {**os.environ, "PASSKEY_CONF": str(conf)}
+        self.proc: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning"],
+            cwd=REPO, env=self._env)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                httpx.get(f"{self.url}/metrics", timeout=1)
+                return self
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError("server did not start")
+
+    def __exit__(self, *exc):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+    def token(self) -> str:
+        return httpx.post(f"{self.url}/admin/login", data={"admin_key": ADMIN_KEY}).json()["token"]
+
+
+# --- scenarios ---
+
+async def _send(server: Server, requests: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for i in counter:
+            phone, msg = f"09{i:08d}", f"Benchmark message {i}"
+            sig = hashlib.md5(f"{phone}&{msg}&{SECRET_KEY}".encode()).hexdigest()
+            start = time.perf_counter()
+            resp = await client.post("/send-sms", data={"sdt": phone, "noidungtinnhan": msg, "hash": sig})
+            latencies.append(time.perf_counter() - start)
+            errors += resp.status_code != 200
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=server.url, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"requests": requests, "concurrency": concurrency, "errors": errors,
+            "requests_per_s": round(requests / elapsed, 1), **_percentiles(latencies)}
+
+
+def bench_send(workdir: Path, requests: int, concurrency: int) -> dict:
+    base = workdir / "spool-send"
+    generate(str(base), 0)
+    with Server(workdir, base) as server:
+        # Warm up imports, executors and the first spool write.
+        asyncio.run(_send(server, min(100, requests), concurrency))
+        return asyncio.run(_send(server, requests, concurrency))
+
+
+def bench_listing(workdir: Path, sizes: list[int], repeats: int) -> list[dict]:
+    base = workdir / "spool-listing"
+    results, have = [], 0
+    for size in sorted(sizes):
+        generate(str(base), size - have, mix={"sent": 1.0}, start=have)
+        have = size
+        with Server(workdir, base) as server:
+            headers = {"Authorization": f"Bearer {server.token()}"}
+            url = f"{server.url}/admin/api/sms/sent"
+            with httpx.Client(headers=headers, timeout=600) as client:
+                start = time.perf_counter()
+                client.get(url).raise_for_status()
+                cold = time.perf_counter() - start
+                warm = []
+                for page in range(repeats):
+                    start = time.perf_counter()
+                    client.get(url, params={"page": page % 5 + 1}).raise_for_status()
+                    warm.append(time.perf_counter() - start)
+        results.append({"files": size, "cold_ms": round(cold * 1000, 3), **_percentiles(warm)})
+    return results
+
+
+async def _websocket(server: Server, base: Path, clients: int, events: int) -> dict:
+    token = server.token()
+    written: dict[str, float] = {}
+    latencies: list[float] = []
+
+    async def listen(ws):
+        seen = 0
+        async for raw in ws:
+            event = json.loads(raw)
+            if event.get("event") == "new_file" and event["file"]["filename"] in written:
+                latencies.append(time.perf_counter() - written[event["file"]["filename"]])
+                seen += 1
+                if seen == events:
+                    return
+
+    uri = f"ws://127.0.0.1:{server.port}/admin/ws?token={token}"
+    sockets = [await websockets.connect(uri, max_queue=None) for _ in range(clients)]
+    try:
+        for ws in sockets:
+            await ws.recv()  # first heartbeat: subscribed
+        listeners = [asyncio.create_task(listen(ws)) for ws in sockets]
+        rng = random.Random(clients)
+        cpu_start, wall_start = _cpu_seconds(server.proc.pid), time.perf_counter()
+        for seq in range(events):
+            name, text = make_message(rng, "sent", time.time(), seq)
+            tmp = base / "sent" / f".{name}"
+            tmp.write_text(text)
+            written[name] = time.perf_counter()
+            os.rename(tmp, base / "sent" / name)
+            await asyncio.sleep(0.005)
+        try:
+            await asyncio.wait_for(asyncio.gather(*listeners), timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        cpu_end, wall = _cpu_seconds(server.proc.pid), time.perf_counter() - wall_start
+    finally:
+        for ws in sockets:
+            await ws.close()
+    cpu = round((cpu_end - cpu_start) / wall, 3) if cpu_start is not None and cpu_end is not None else None
+    return {"clients": clients, "events": events, "delivered": len(latencies),
+            "expected": clients * events, "server_cpu": cpu, **_percentiles(latencies)}
+
+
+def bench_websocket(workdir: Path, client_counts: list[int], events: int) -> list[dict]:
+    results = []
+    for clients in client_counts:
+        base = workdir / f"spool-ws-{clients}"
+        generate(str(base), 1000)
+        with Server(workdir, base) as server:
+            results.append(asyncio.run(_websocket(server, base, clients, events)))
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--send-requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--sizes", type=_ints, default=[1000, 10000, 100000])
+    parser.add_argument("--listing-repeats", type=int, default=50)
+    parser.add_argument("--ws-clients", type=_ints, default=[1, 10, 100])
+    parser.add_argument("--ws-events", type=int, default=200)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the generated spool directories")
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario {scenario!r}")
+    workdir = Path(tempfile.mkdtemp(prefix="sms-bench-"))
+    result = {
+        "meta": {"commit": _git_commit(), "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "args": vars(args)},
+    }
+    try:
+        if "send" in scenarios:
+            result["send"] = bench_send(workdir, args.send_requests, args.concurrency)
+        if "listing" in scenarios:
+            result["listing"] = bench_listing(workdir, args.sizes, args.listing_repeats)
+        if "websocket" in scenarios:
+            result["websocket"] = bench_websocket(workdir, args.ws_clients, args.ws_events)
+    finally:
+        if args.keep:
+            print(f"spool kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
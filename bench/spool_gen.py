@@ -0,0 +1,122 @@
+"""Synthetic smstools spool for benchmarks.
+
+Fills a base directory with message files shaped like the ones smsd leaves
+behind: outgoing files named by the gateway, incoming files named by modem,
+sent/failed/checked files with the status headers smsd adds. Mtimes are
+spread over the last DAYS days. A seed always produces the same messages,
+dated relative to the time of the run.
+
+    python -m bench.spool_gen /tmp/spool --count 100000
+    python -m bench.spool_gen /tmp/spool --count 1000 --mix sent=1
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+FOLDERS = ("checked", "failed", "incoming", "outgoing", "sent")
+# Share of files per folder on a gateway that has been running for a while.
+DEFAULT_MIX = {"sent": 0.6, "incoming": 0.2, "failed": 0.1, "checked": 0.05, "outgoing": 0.05}
+DAYS = 30
+
+MODEMS = ("GSM1", "GSM2", "GSM3", "GSM4")
+PREFIXES = ("090", "091", "093", "096", "097", "098", "086", "088")
+FAIL_REASONS = ("Timeout", "No answer from modem", "CMS ERROR: 38 Network out of order",
+                "CMS ERROR: 1 Unassigned (unallocated) number", "Modem initialization failed")
+BODIES = (
+    "Ma OTP cua ban la {n:06d}. Het han sau 5 phut.",
+    "Xin chao, don hang #{n} da duoc xac nhan. Cam on ban!",
+    "Don hang #{n} dang duoc van chuyen. Du kien giao ngay 25/02.",
+    "Toi muon huy don hang #{n}",
+    "Tai khoan cua ban vua duoc cong {n} VND. So du hien tai: {n}0 VND.",
+)
+
+
+def _phone(rng: random.Random) -> str:
+    return rng.choice(PREFIXES) + f"{rng.randrange(10 ** 7):07d}"
+
+
+def _date(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%y-%m-%d %H:%M:%S")
+
+
+def make_message(rng: random.Random, folder: str, ts: float, seq: int) -> tuple[str, str]:
+    """(filename, file text) of one message as smsd would leave it in folder."""
+    phone = _phone(rng)
+    body = rng.choice(BODIES).format(n=rng.randrange(10 ** 6))
+    if rng.random() < 0.1:
+        # Long multipart message.
+        body = " ".join([body] * rng.randint(3, 6))
+    modem = rng.choice(MODEMS)
+    if folder == "incoming":
+        name = f"{modem}.{seq:06x}{rng.randrange(16 ** 4):04x}"
+        headers = [f"From: 84{phone[1:]}", "From_TOA: 91 international, ISDN/telephone",
+                   "From_SMSC: 84980200030", f"Sent: {_date(ts - rng.randint(1, 30))}",
+                   f"Received: {_date(ts)}", f"Subject: {modem}", f"Modem: {modem}",
+                   "IMSI: 452040000000000", "Report: no", "Alphabet: ISO", f"Length: {len(body)}"]
+        return name, "\n".join(headers) + "\n\n" + body + "\n"
+
+    name = f"sms_{int(ts * 1e6)}_{seq:06x}{rng.randrange(16 ** 2):02x}_{phone}.sms"
+    headers = [f"To: {phone}"]
+    if folder in ("sent", "failed", "checked"):
+        headers += ["Alphabet: ISO", f"Modem: {modem}", "IMSI: 452040000000000"]
+    if folder == "sent":
+        headers += [f"Sent: {_date(ts)}", f"Message_id: {rng.randrange(256)}"]
+    elif folder == "failed":
+        headers += [f"Failed: {_date(ts)}", f"Fail_reason: {rng.choice(FAIL_REASONS)}"]
+    return name, "\n".join(headers) + "\n\n" + body + "\n"
+
+
+def generate(base_dir: str, count: int, seed: int = 0, mix: Optional[dict[str, float]] = None,
+             start: int = 0) -> dict[str, int]:
+    """Write count messages under base_dir; returns files written per folder.
+
+    start offsets the sequence (and the random stream), so a folder can be
+    grown in steps: generate(d, 1000) then generate(d, 9000, start=1000).
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(f"{seed}:{start}")
+    folders, weights = zip(*mix.items())
+    for folder in FOLDERS:
+        Path(base_dir, folder).mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    written = dict.fromkeys(folders, 0)
+    for seq in range(start, start + count):
+        folder = rng.choices(folders, weights)[0]
+        ts = now - rng.random() * DAYS * 86400
+        name, text = make_message(rng, folder, ts, seq)
+        path = os.path.join(base_dir, folder, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.utime(path, (ts, ts))
+        written[folder] += 1
+    return written
+
+
+def _parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        folder, _, weight = part.partition("=")
+        if folder not in FOLDERS:
+            raise argparse.ArgumentTypeError(f"unknown folder {folder!r}")
+        mix[folder] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("base_dir")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=_parse_mix, default=None,
+                        help="folder=weight,... (default: %s)" % ",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()))
+    args = parser.parse_args(argv)
+    print(json.dumps(generate(args.base_dir, args.count, args.seed, args.mix)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Response compression for text bodies (JSON pages, exports, frontend assets).
+
+Brotli when the client accepts it and the optional brotli package is
+installed, gzip otherwise. Streamed bodies are compressed chunk by chunk and
+flushed after each one, so progress streams still arrive as they are written.
+A compressed response's ETag is made weak, as it no longer names the exact
+bytes; If-None-Match handling here compares ETags weakly anyway.
+"""
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies gain less than the headers cost.
+MINIMUM_SIZE = 1024
+GZIP_LEVEL = 6
+# Fast enough for per-request compression; still well ahead of gzip on JSON.
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/x-ndjson",
+                      "image/svg+xml")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """"br", "gzip" or None for an Accept-Encoding header value."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._br = None
+            self._gz = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self._br is not None:
+            out = self._br.process(data)
+            return out + (self._br.finish() if final else self._br.flush())
+        out = self._gz.compress(data)
+        return out + self._gz.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing compressible responses of MINIMUM_SIZE bytes or more."""
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), "")
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[dict] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if compressor is None:
+                headers = {k.lower(): v for k, v in start["headers"]}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                vary = content_type.startswith(COMPRESSIBLE_TYPES)
+                if (not vary or b"content-encoding" in headers or start["status"] in (204, 304)
+                        or (not more and len(body) < self.minimum_size)):
+                    passthrough = True
+                    if vary:
+                        start["headers"] = _with_vary(start["headers"])
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                start["headers"] = _compressed_headers(start["headers"], encoding)
+                await send(start)
+            await send({"type": "http.response.body", "body": compressor.compress(body, not more),
+                        "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def _with_vary(headers: list) -> list:
+    vary = [v for k, v in headers if k.lower() == b"vary"]
+    if any(b"accept-encoding" in v.lower() for v in vary):
+        return headers
+    return [(k, v) for k, v in headers if k.lower() != b"vary"] + [
+        (b"vary", b", ".join(vary + [b"Accept-Encoding"]))]
+
+
+def _compressed_headers(headers: list, encoding: str) -> list:
+    out = []
+    for k, v in _with_vary(headers):
+        name = k.lower()
+        if name == b"content-length":
+            continue
+        if name == b"etag" and not v.startswith(b"W/"):
+            v = b"W/" + v
+        out.append((k, v))
+    return out + [(b"content-encoding", encoding.encode("latin-1"))]
@@ -1,12 +1,89 @@
+"""passkey.conf, parsed once and swapped atomically on reload.
+
+Every load_* helper reads the current Config held in memory, so no request
+ever opens the file. reload() re-parses it and replaces the whole Config in
+one assignment; the watcher thread calls it when the file changes (mtime,
+size or inode) and SIGHUP wakes it immediately. A reload that changes
+SECRET_KEY keeps accepting the old key for SECRET_OVERLAP seconds, so
+callers can switch over without failed requests.
+
+Only the keys (SECRET_KEY, ADMIN_KEY, METRICS_TOKEN) take effect on reload; settings that
+size pools, queues or spool roots are read once at startup.
+"""
+import logging
+import math
 import os
+import signal
+import threading
+import time
+from typing import Optional
 
 CONFIG_PATH = os.environ.get("PASSKEY_CONF", "passkey.conf")
+WATCH_INTERVAL = 2.0
+DEFAULT_SECRET_OVERLAP = 300.0
 
+log = logging.getLogger(__name__)
 
-def _load_config():
+
+class Config:
+    """One parse of passkey.conf; never mutated, replaced whole on reload."""
+
+    def __init__(self, path: str, values: dict[str, str], stamp: tuple = (),
+                 retired: tuple[tuple[str, float], ...] = ()):
+        self.path = path
+        self.values = values
+        # (mtime_ns, size, inode) of the file this was parsed from
+        self.stamp = stamp
+        # (old SECRET_KEY, accepted until) after rotations
+        self.retired = retired
+
+    @property
+    def secret_key(self) -> str:
+        if "SECRET_KEY" not in self.values:
+            raise RuntimeError("SECRET_KEY not found in passkey.conf")
+        return self.values["SECRET_KEY"]
+
+    @property
+    def admin_key(self) -> str:
+        if "ADMIN_KEY" not in self.values:
+            raise RuntimeError("ADMIN_KEY not found in passkey.conf")
+        return self.values["ADMIN_KEY"]
+
+    @property
+    def metrics_token(self) -> str:
+        """Bearer token a Prometheus scraper may use for /metrics; empty means admin tokens only."""
+        return self.values.get("METRICS_TOKEN", "")
+
+    @property
+    def secret_overlap(self) -> float:
+        """SECRET_OVERLAP seconds; a malformed value falls back to the default rather than fail a reload."""
+        raw = self.values.get("SECRET_OVERLAP", "")
+        if raw == "":
+            return DEFAULT_SECRET_OVERLAP
+        try:
+            overlap = float(raw)
+        except ValueError:
+            overlap = math.nan
+        if not math.isfinite(overlap) or overlap < 0:
+            log.warning("SECRET_OVERLAP=%r is not a number of seconds; using %g", raw, DEFAULT_SECRET_OVERLAP)
+            return DEFAULT_SECRET_OVERLAP
+        return overlap
+
+    def secrets(self, now: Optional[float] = None) -> list[str]:
+        """SECRET_KEYs a signature may use right now, the current one first."""
+        now = time.time() if now is None else now
+        return [self.secret_key] + [key for key, until in self.retired if until > now]
+
+
+def _stamp(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _parse(path: str) -> dict[str, str]:
     """Load all key=value pairs from passkey.conf into a dict."""
     config = {}
-    with open(CONFIG_PATH) as f:
+    with open(path) as f:
         for line in f:
             line = line.strip()
             if "=" in line and not line.startswith("#"):
@@ -15,20 +92,229 @@ def _load_config():
     return config
 
 
+_current: Optional[Config] = None
+_reload_lock = threading.Lock()
+
+
+def current() -> Config:
+    """The config in effect; parsed on first use (or when CONFIG_PATH changes)."""
+    config = _current
+    if config is None or config.path != CONFIG_PATH:
+        config = reload()
+    return config
+
+
+def reload() -> Config:
+    """Re-read passkey.conf and swap it in.
+
+    A file that cannot be read, or that lost SECRET_KEY/ADMIN_KEY, leaves the
+    previous config in effect (the very first load raises instead).
+    """
+    global _current
+    with _reload_lock:
+        path = CONFIG_PATH
+        old = _current if _current is not None and _current.path == path else None
+        try:
+            stamp = _stamp(path)
+            values = _parse(path)
+        except OSError:
+            if old is None:
+                raise
+            return old
+        if old is None:
+            _current = Config(path, values, stamp)
+            return _current
+        if any(key in old.values and not values.get(key) for key in ("SECRET_KEY", "ADMIN_KEY")):
+            # Probably caught mid-edit; the watcher retries until the file is whole.
+            return old
+        now = time.time()
+        retired = [(key, until) for key, until in old.retired
+                   if until > now and key != values["SECRET_KEY"]]
+        if old.values.get("SECRET_KEY") not in (None, values["SECRET_KEY"]):
+            overlap = Config(path, values).secret_overlap
+            retired.insert(0, (old.values["SECRET_KEY"], now + overlap))
+        _current = Config(path, values, stamp, tuple(retired))
+        return _current
+
+
+def _load_config():
+    """All key=value pairs from passkey.conf (the in-memory copy)."""
+    return current().values
+
+
+# --- Hot reload ---
+
+_wake = threading.Event()
+_watcher: Optional[threading.Thread] = None
+
+
+def _watch(interval: float):
+    while True:
+        hup = _wake.wait(interval)
+        _wake.clear()
+        try:
+            config = current()
+            if hup or _stamp(config.path) != config.stamp:
+                reload()
+        except OSError:
+            # Being replaced; keep the current config until it is back.
+            continue
+        except Exception:
+            # A bad edit must not end hot reload; the current config stays.
+            log.exception("reloading %s failed", CONFIG_PATH)
+
+
+def start_watcher(interval: float = WATCH_INTERVAL):
+    """Reload passkey.conf whenever it changes or the process gets SIGHUP (idempotent)."""
+    global _watcher
+    with _reload_lock:
+        if _watcher is not None:
+            return
+        _watcher = threading.Thread(target=_watch, args=(interval,), name="config-watch", daemon=True)
+        _watcher.start()
+    # Signal handlers can only be installed from the main thread.
+    if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: _wake.set())
+
+
 def load_secret():
-    config = _load_config()
-    if "SECRET_KEY" not in config:
-        raise RuntimeError("SECRET_KEY not found in passkey.conf")
-    return config["SECRET_KEY"]
+    return current().secret_key
 
 
 def load_admin_key():
-    config = _load_config()
-    if "ADMIN_KEY" not in config:
-        raise RuntimeError("ADMIN_KEY not found in passkey.conf")
-    return config["ADMIN_KEY"]
+    return current().admin_key
 
 
 def load_sms_base_dir():
+    """The primary spool root: SMS_BASE_DIR, or the first SMS_ROOTS entry."""
+    return load_sms_roots()[0][1]
+
+
+def load_sms_roots():
+    """[(name, path, weight, capacity)] for every smstools spool root.
+
+    SMS_ROOTS=name:path[:weight[:capacity]],... lists several roots; without
+    it SMS_BASE_DIR is the only root. capacity 0 means no outgoing cap.
+    """
+    config = _load_config()
+    spec = config.get("SMS_ROOTS", "")
+    if not spec:
+        return [("main", config.get("SMS_BASE_DIR", "/var/spool/sms"), 1.0, 0)]
+    roots = []
+    for item in spec.split(","):
+        parts = item.strip().split(":")
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            raise RuntimeError(f"Invalid SMS_ROOTS entry in passkey.conf: {item}")
+        weight = float(parts[2]) if len(parts) > 2 and parts[2] else 1.0
+        capacity = int(parts[3]) if len(parts) > 3 and parts[3] else 0
+        roots.append((parts[0], parts[1], weight, capacity))
+    if len({name for name, *_ in roots}) != len(roots):
+        raise RuntimeError("Duplicate root name in SMS_ROOTS")
+    return roots
+
+
+def load_spool_fsync():
+    """Durability mode for outgoing spool writes: off, always or batch."""
+    config = _load_config()
+    mode = config.get("SPOOL_FSYNC", "off").lower()
+    if mode not in ("off", "always", "batch"):
+        raise RuntimeError(f"Invalid SPOOL_FSYNC in passkey.conf: {mode}")
+    return mode
+
+
+def load_io_workers():
+    """Thread counts for the send and admin I/O executors."""
+    config = _load_config()
+    return int(config.get("SEND_WORKERS", 8)), int(config.get("ADMIN_WORKERS", 4))
+
+
+def load_cache_limits():
+    """(max entries, max bytes) for the parsed SMS file cache."""
+    config = _load_config()
+    return (int(config.get("CACHE_MAX_ENTRIES", 10000)),
+            int(config.get("CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+
+
+def load_state_dir():
+    """Directory for the gateway's own durable state (search index, queues)."""
+    config = _load_config()
+    return config.get("STATE_DIR", "state")
+
+
+def load_workers():
+    """Number of uvicorn workers sharing STATE_DIR; above 1 they elect a primary (see sms_cluster)."""
+    config = _load_config()
+    return max(1, int(config.get("WORKERS", 1)))
+
+
+def load_smsd_log():
+    """smsd log file for the dashboard's live tail; empty follows the smstools journal."""
+    config = _load_config()
+    return config.get("SMSD_LOG", "")
+
+
+def load_archive_settings():
+    """(age in seconds, folders, interval) for spool compaction; age 0 disables it."""
+    config = _load_config()
+    age = float(config.get("ARCHIVE_AFTER_DAYS", 0)) * 86400
+    folders = tuple(f.strip() for f in config.get("ARCHIVE_FOLDERS", "sent,failed,checked").split(",")
+                    if f.strip())
+    return age, folders, float(config.get("ARCHIVE_INTERVAL", 3600))
+
+
+def load_rate_limits():
+    """(global rate, global burst, per-caller rate, per-caller burst) in messages/s; 0 = off."""
+    config = _load_config()
+    return (float(config.get("SEND_RATE", 0)), float(config.get("SEND_BURST", 0)),
+            float(config.get("CALLER_RATE", 0)), float(config.get("CALLER_BURST", 0)))
+
+
+def load_send_queue():
+    """(mode, outgoing high-water mark, max queued) for /send-sms; mode is direct or queue."""
+    config = _load_config()
+    mode = config.get("SEND_MODE", "direct").lower()
+    if mode not in ("direct", "queue"):
+        raise RuntimeError(f"Invalid SEND_MODE in passkey.conf: {mode}")
+    return mode, int(config.get("OUTGOING_HIGH_WATER", 0)), int(config.get("SEND_QUEUE_MAX", 100000))
+
+
+def load_schedule_rate():
+    """(rate, burst) in messages/s at which due scheduled messages are released."""
+    config = _load_config()
+    rate = float(config.get("SCHEDULE_RELEASE_RATE", 10))
+    return rate, float(config.get("SCHEDULE_RELEASE_BURST", rate))
+
+
+def load_dedup_settings():
+    """(idempotency key TTL, automatic dedup window, entries kept in memory); window 0 = off."""
+    config = _load_config()
+    return (float(config.get("IDEMPOTENCY_TTL", 86400)), float(config.get("DEDUP_WINDOW", 0)),
+            int(config.get("DEDUP_MAX_ENTRIES", 100000)))
+
+
+def load_webhooks():
+    """([(url, folders)], workers, batch size) from WEBHOOKS=url[|folder+folder],...
+
+    Folders default to incoming, sent and failed.
+    """
+    config = _load_config()
+    hooks = []
+    for item in config.get("WEBHOOKS", "").split(","):
+        if not item.strip():
+            continue
+        url, _, folders = item.strip().partition("|")
+        folders = tuple(f.strip() for f in folders.split("+") if f.strip()) or ("incoming", "sent", "failed")
+        hooks.append((url.strip(), folders))
+    return hooks, int(config.get("WEBHOOK_WORKERS", 4)), int(config.get("WEBHOOK_BATCH", 50))
+
+
+def load_retry_policy():
+    """(max attempts, base delay, max delay, retryable reason substrings, rate) for failed/ retries.
+
+    Max attempts 0 disables automatic retries.
+    """
     config = _load_config()
-    return config.get("SMS_BASE_DIR", "/var/spool/sms")
+    reasons = config.get("RETRY_REASONS", "timeout,modem,no answer,network,no carrier,temporar,congestion")
+    return (int(config.get("RETRY_MAX_ATTEMPTS", 0)), float(config.get("RETRY_BASE_DELAY", 60)),
+            float(config.get("RETRY_MAX_DELAY", 3600)),
+            tuple(r.strip() for r in reasons.split(",") if r.strip()), float(config.get("RETRY_RATE", 1)))
@@ -0,0 +1,28 @@
+"""Dedicated thread pools for blocking spool I/O.
+
+The send path and the admin read path each get their own sized executor, so
+a slow listing of a huge folder can never queue ahead of /send-sms. Starlette's
+shared threadpool is left for cheap sync dependencies only.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from config import load_io_workers
+
+SEND_WORKERS, ADMIN_WORKERS = load_io_workers()
+
+_send_pool = ThreadPoolExecutor(max_workers=SEND_WORKERS, thread_name_prefix="spool-send")
+_admin_pool = ThreadPoolExecutor(max_workers=ADMIN_WORKERS, thread_name_prefix="spool-admin")
+
+
+async def run_send(func, *args, **kwargs):
+    """Run blocking send-path work (spool writes) on the send executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_send_pool, functools.partial(func, *args, **kwargs))
+
+
+async def run_admin(func, *args, **kwargs):
+    """Run blocking admin work (listings, file reads) on the admin executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_admin_pool, functools.partial(func, *args, **kwargs))
@@ -1,64 +1,512 @@
+import asyncio
 import hashlib
+import json
+import math
 import os
-import time
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Awaitable, Callable, Optional
 
-from fastapi import FastAPI, HTTPException, Form
+from fastapi import FastAPI, Depends, HTTPException, Form, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
-from config import load_secret, load_sms_base_dir
+from compression import CompressionMiddleware
+from config import (
+    current as current_config, start_watcher as watch_config, load_sms_base_dir, load_spool_fsync, load_rate_limits, load_send_queue,
+    load_sms_roots, load_state_dir, load_schedule_rate, load_dedup_settings, load_workers,
+)
+from executors import run_admin, run_send
+from rate_limit import RateLimiter, SharedBuckets
+from send_queue import QueueFull, SendQueue, get_send_queue
+from sms_dedup import DedupStore, InProgress, KeyReused, get_dedup_store
+from sms_metrics import LatencyMiddleware, render as render_metrics
+from sms_scheduler import Scheduler, get_scheduler, parse_send_at
+from spool_roots import Root, RootBalancer, get_balancer
+from spool_writer import SpoolWriter, get_spool_writer
 
 SMS_OUTGOING_DIR = os.path.join(load_sms_base_dir(), "outgoing")
-SECRET_KEY = load_secret()
+SMS_ROOTS = load_sms_roots()
+SPOOL_FSYNC = load_spool_fsync()
+BATCH_MAX_MESSAGES = 10000
+# Generous bound on one encoded batch item; bodies past the product are refused unread.
+BATCH_ITEM_MAX_BYTES = 4096
+BATCH_MAX_BYTES = BATCH_MAX_MESSAGES * BATCH_ITEM_MAX_BYTES
+SEND_RATE, SEND_BURST, CALLER_RATE, CALLER_BURST = load_rate_limits()
+SEND_MODE, OUTGOING_HIGH_WATER, SEND_QUEUE_MAX = load_send_queue()
+STATE_DIR = load_state_dir()
+WORKERS = load_workers()
+# Several workers draw on the same buckets, kept in one SQLite file.
+SHARED_BUCKETS = SharedBuckets(str(Path(STATE_DIR) / "ratelimit.sqlite")) if WORKERS > 1 else None
+RATE_LIMITER = RateLimiter(SEND_RATE, SEND_BURST, CALLER_RATE, CALLER_BURST, SHARED_BUCKETS)
+SCHEDULE_RATE, SCHEDULE_BURST = load_schedule_rate()
+IDEMPOTENCY_TTL, DEDUP_WINDOW, DEDUP_MAX_ENTRIES = load_dedup_settings()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up key rotations in passkey.conf without a restart.
+    watch_config()
+    loop = asyncio.get_running_loop()
+    tasks = []
+
+    def start_engines():
+        # Start releasing messages scheduled before a restart without waiting for a request.
+        _scheduler()
+        # Likewise pick up retries and deliver webhook events left from before.
+        admin_routes.retry_engine()
+        admin_routes.start_compaction()
+        webhooks = admin_routes.webhook_dispatcher()
+        if webhooks is not None:
+            tasks.append(asyncio.run_coroutine_threadsafe(webhooks.run(), loop))
+
+    cluster = admin_routes.cluster()
+    if cluster is None:
+        await run_admin(admin_routes.lock_state_dir)
+        await run_admin(start_engines)
+    else:
+        # Only the primary worker runs the engines; a follower starts them if promoted.
+        cluster.on_promote(start_engines)
+        await run_admin(cluster.start)
+    if len(SMS_ROOTS) > 1:
+        # The balancer places sends by each root's failure rate.
+        await run_admin(admin_routes.start_stats_collectors)
+    yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await asyncio.wrap_future(task)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(LatencyMiddleware)
+app.add_middleware(CompressionMiddleware)
+
+
+def _signed(raw: str, client_hash: str) -> bool:
+    """Whether client_hash is md5("{raw}&{key}") for a SECRET_KEY accepted right now."""
+    client_hash = client_hash.lower()
+    return any(hashlib.md5(f"{raw}&{key}".encode("utf-8")).hexdigest() == client_hash
+               for key in current_config().secrets())
 
 
 def verify_md5(phone: str, message: str, client_hash: str) -> bool:
-    raw = f"{phone}&{message}&{SECRET_KEY}"
-    md5 = hashlib.md5(raw.encode("utf-8")).hexdigest()
-    return md5 == client_hash.lower()
+    return _signed(f"{phone}&{message}", client_hash)
+
+
+def verify_ref_md5(ref: str, client_hash: str) -> bool:
+    """Signature over a single reference such as a schedule id or spool filename."""
+    return _signed(ref, client_hash)
+
+
+def _roots() -> list[Root]:
+    """(name, outgoing dir, weight, capacity) per spool root; the first is SMS_OUTGOING_DIR."""
+    name, _, weight, capacity = SMS_ROOTS[0]
+    return [(name, SMS_OUTGOING_DIR, weight, capacity)] + [
+        (n, os.path.join(path, "outgoing"), w, c) for n, path, w, c in SMS_ROOTS[1:]]
+
+
+def _balancer() -> RootBalancer:
+    roots = _roots()
+    outgoing = {name: directory for name, directory, _, _ in roots}
+
+    def backlog(name: str) -> int:
+        return len(_send_queue(outgoing[name])) if SEND_MODE == "queue" else 0
+
+    return get_balancer(roots, failure_rate=admin_routes.root_failure_rate, backlog=backlog)
+
+
+def _spool_writer(outgoing_dir: Optional[str] = None) -> SpoolWriter:
+    return get_spool_writer(outgoing_dir or SMS_OUTGOING_DIR, SPOOL_FSYNC)
+
+
+def _send_queue(outgoing_dir: Optional[str] = None) -> SendQueue:
+    writer = _spool_writer(outgoing_dir)
+    bucket = None
+    if SHARED_BUCKETS is not None and SEND_RATE > 0:
+        bucket = SHARED_BUCKETS.bucket("drain:" + os.path.abspath(writer.outgoing_dir), SEND_RATE, SEND_BURST or SEND_RATE)
+    return get_send_queue(writer, SEND_RATE, SEND_BURST, OUTGOING_HIGH_WATER, SEND_QUEUE_MAX, bucket)
+
+
+def _place(messages: list[tuple[str, str]]) -> dict[Root, list[int]]:
+    """Indexes of messages grouped by the spool root chosen for each."""
+    groups: dict[Root, list[int]] = {}
+    for i, root in enumerate(_balancer().place(len(messages))):
+        groups.setdefault(root, []).append(i)
+    return groups
+
+
+def _caller(request: Request) -> str:
+    """Client identity for per-caller limits; the tunnel passes the real IP in a header."""
+    return request.headers.get("cf-connecting-ip") or (request.client.host if request.client else "")
+
+
+def _admit(request: Request, n: int, deferred: bool = False) -> int:
+    """How many of n messages the rate limits let through now (blocking: shared buckets are SQLite).
+
+    The global bucket guards the modems, so it is skipped for scheduled
+    messages and in queue mode, where release and drain apply their own rate.
+    """
+    include_global = SEND_MODE != "queue" and not deferred
+    return RATE_LIMITER.acquire(_caller(request), n, include_global=include_global)
+
+
+def _rate_limited(request: Request, deferred: bool = False) -> HTTPException:
+    include_global = SEND_MODE != "queue" and not deferred
+    retry = RATE_LIMITER.retry_after(_caller(request), include_global=include_global)
+    return HTTPException(status_code=429, detail="RATE_LIMITED",
+                         headers={"Retry-After": str(max(1, math.ceil(retry)))})
+
+
+def _scheduler() -> Scheduler:
+    return get_scheduler(str(Path(STATE_DIR) / "schedule.sqlite"), _release_scheduled,
+                         SCHEDULE_RATE, SCHEDULE_BURST)
+
+
+def _schedule(messages: list[tuple[str, str, Optional[str], float]]) -> list[str]:
+    """Schedule ids; a follower worker hands the messages to the primary's scheduler."""
+    if admin_routes.is_primary():
+        return _scheduler().schedule(messages)
+    return admin_routes.on_primary("schedule", messages)
+
+
+def _parse_send_at(value: Optional[str]) -> Optional[float]:
+    """parse_send_at, with an invalid value answered by 400 INVALID_SEND_AT."""
+    try:
+        return parse_send_at(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="INVALID_SEND_AT")
+
+
+def _scheduled(schedule_id: str, when: float) -> dict:
+    return {"id": schedule_id, "send_at": datetime.fromtimestamp(when, timezone.utc).isoformat()}
+
+
+def _release_scheduled(messages: list[tuple[str, str, Optional[str]]]):
+    """Scheduler callback: due messages go out like fresh sends, or to their fixed root."""
+    outgoing = {name: directory for name, directory, _, _ in _roots()}
+    placed: list[tuple[str, str]] = []
+    fixed: dict[str, list[tuple[str, str]]] = {}
+    for phone, message, root in messages:
+        if root in outgoing:
+            fixed.setdefault(outgoing[root], []).append((phone, message))
+        else:
+            placed.append((phone, message))
+    for directory, group in fixed.items():
+        _spool_writer(directory).write_many(group)
+    if not placed:
+        return
+    # A full queue raises QueueFull; the scheduler keeps the rows and retries.
+    if SEND_MODE == "queue":
+        _queue_messages(placed)
+    else:
+        create_sms_files(placed)
+
+
+def _enqueue(messages: list[tuple[str, str]]) -> list[dict]:
+    """_queue_messages for a request: a full queue is a 503."""
+    try:
+        return _queue_messages(messages)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="QUEUE_FULL")
+
+
+def _queue_messages(messages: list[tuple[str, str]]) -> list[dict]:
+    """Queue messages on their roots' send queues; all or none are accepted (else QueueFull)."""
+    groups = [(root, _send_queue(root[1]), idxs) for root, idxs in _place(messages).items()]
+    if any(len(queue) + len(idxs) > queue.max_size for _, queue, idxs in groups):
+        raise QueueFull()
+    results: list[dict] = [{}] * len(messages)
+    for root, queue, idxs in groups:
+        queued = queue.submit([messages[i] for i in idxs])
+        for i, (f, pos) in zip(idxs, queued):
+            results[i] = {"file": f, "root": root[0], "position": pos, "eta_seconds": queue.eta(pos)}
+    return results
+
+
+def create_sms_file(phone: str, message: str) -> tuple[str, str]:
+    return create_sms_files([(phone, message)])[0]
+
 
+def create_sms_files(messages: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Write one spool file per (phone, message), one pass per root; (root, file) each."""
+    results: list[tuple[str, str]] = [("", "")] * len(messages)
+    for root, idxs in _place(messages).items():
+        filenames = _spool_writer(root[1]).write_many([messages[i] for i in idxs])
+        for i, filename in zip(idxs, filenames):
+            results[i] = (root[0], filename)
+    return results
 
-def create_sms_file(phone: str, message: str):
-    ts = int(time.time())
-    filename = f"sms_{ts}_{phone}.sms"
-    path = os.path.join(SMS_OUTGOING_DIR, filename)
 
-    content = f"""To: {phone}
+def _dedup() -> DedupStore:
+    return get_dedup_store(str(Path(STATE_DIR) / "dedup.sqlite"), DEDUP_MAX_ENTRIES, shared=WORKERS > 1)
 
-{message}
-"""
 
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
+def _claim(store: DedupStore, key: str, fingerprint: str) -> Optional[str]:
+    try:
+        return store.claim(key, fingerprint)
+    except KeyReused:
+        raise HTTPException(status_code=422, detail="IDEMPOTENCY_KEY_REUSED")
+    except InProgress:
+        raise HTTPException(status_code=409, detail="IN_PROGRESS")
 
-    return filename
+
+async def _once(key: Optional[str], fingerprint: str, ttl: float,
+                send: Callable[[], Awaitable[dict]]) -> dict:
+    """Run send once per key within ttl; repeats get the first response back."""
+    if key is None:
+        return await send()
+    store = await run_send(_dedup)
+    previous = await run_send(_claim, store, key, fingerprint)
+    if previous is not None:
+        return {**json.loads(previous), "duplicate": True}
+    try:
+        result = await send()
+    except BaseException:
+        # Shielded: a cancelled request still frees its key.
+        await asyncio.shield(run_send(store.release, key))
+        raise
+    await run_send(store.complete, key, fingerprint, json.dumps(result), ttl)
+    return result
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+async def _read_batch(request: Request) -> bytes:
+    """The request body, refused with 413 once it passes BATCH_MAX_BYTES."""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="BATCH_TOO_LARGE")
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="BATCH_TOO_LARGE")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _parse_batch(body: bytes, content_type: str) -> list:
+    """Decode a JSON array or NDJSON body into a list of message objects."""
+    try:
+        text = body.decode("utf-8")
+        if "ndjson" in content_type or "jsonl" in content_type:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        items = json.loads(text)
+    except (UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="INVALID_BODY")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="INVALID_BODY")
+    return items
 
 
 @app.post("/send-sms")
-def send_sms(
+async def send_sms(
+    request: Request,
     sdt: str = Form(...),
     noidungtinnhan: str = Form(...),
-    hash: str = Form(...)
+    hash: str = Form(...),
+    send_at: Optional[str] = Form(None),
 ):
+    """Send one message.
+
+    A repeat with the same Idempotency-Key header (or, with DEDUP_WINDOW set,
+    the same phone and message) returns the first response with duplicate=true
+    instead of sending again.
+    """
     if not verify_md5(sdt, noidungtinnhan, hash):
         raise HTTPException(status_code=403, detail="INVALID_HASH")
 
-    filename = create_sms_file(sdt, noidungtinnhan)
+    when = _parse_send_at(send_at)
+    fingerprint = _digest(sdt, noidungtinnhan, send_at or "")
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key:
+        key, ttl = "key:" + idempotency_key, IDEMPOTENCY_TTL
+    elif DEDUP_WINDOW > 0:
+        key, ttl = "msg:" + _digest(sdt, noidungtinnhan), DEDUP_WINDOW
+        fingerprint = key
+    else:
+        key, ttl = None, 0
+    return await _once(key, fingerprint, ttl,
+                       lambda: _send_one(request, sdt, noidungtinnhan, when))
+
+
+async def _send_one(request: Request, sdt: str, noidungtinnhan: str, when: Optional[float]) -> dict:
+    if not await run_send(_admit, request, 1, deferred=when is not None):
+        raise await run_send(_rate_limited, request, deferred=when is not None)
+
+    if when is not None:
+        [schedule_id] = await run_send(_schedule, [(sdt, noidungtinnhan, None, when)])
+        return {"status": "SCHEDULED", **_scheduled(schedule_id, when)}
+
+    if SEND_MODE == "queue":
+        queued = await run_send(_enqueue, [(sdt, noidungtinnhan)])
+        return {"status": "QUEUED", **queued[0]}
+
+    root, filename = await run_send(create_sms_file, sdt, noidungtinnhan)
+
+    return {
+        "status": "OK",
+        "file": filename,
+        "root": root,
+    }
+
+
+@app.post("/send-sms/cancel")
+async def cancel_scheduled_sms(
+    id: str = Form(...),
+    hash: str = Form(...),
+):
+    """Cancel a scheduled message; hash is md5("{id}&{SECRET_KEY}")."""
+    if not verify_ref_md5(id, hash):
+        raise HTTPException(status_code=403, detail="INVALID_HASH")
+    if not await run_send(admin_routes.on_primary, "cancel_scheduled", id):
+        raise HTTPException(status_code=404, detail="NOT_FOUND")
+    return {"status": "CANCELLED", "id": id}
+
+
+@app.post("/send-sms/batch")
+async def send_sms_batch(request: Request):
+    """Send many messages in one request; each item is signed like /send-sms.
+
+    Items may carry their own send_at to be scheduled instead of sent now.
+    With an Idempotency-Key header a repeated batch returns the first response.
+    """
+    body = await _read_batch(request)
+    idempotency_key = request.headers.get("idempotency-key")
+    key = "batch:" + idempotency_key if idempotency_key else None
+    return await _once(key, hashlib.sha256(body).hexdigest(), IDEMPOTENCY_TTL,
+                       lambda: _send_batch(request, body))
+
+
+async def _send_batch(request: Request, body: bytes) -> dict:
+    items = _parse_batch(body, request.headers.get("content-type", ""))
+    if len(items) > BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail="BATCH_TOO_LARGE")
+
+    results: list[dict] = []
+    accepted: list[tuple[int, str, str]] = []
+    deferred: list[tuple[int, str, str, float]] = []
+    for i, item in enumerate(items):
+        fields = item if isinstance(item, dict) else {}
+        sdt, msg, sig = (fields.get(k) for k in ("sdt", "noidungtinnhan", "hash"))
+        if not all(isinstance(v, str) and v for v in (sdt, msg, sig)):
+            results.append({"index": i, "status": "ERROR", "error": "MISSING_FIELDS"})
+        elif not verify_md5(sdt, msg, sig):
+            results.append({"index": i, "status": "ERROR", "error": "INVALID_HASH"})
+        else:
+            try:
+                when = _parse_send_at(fields.get("send_at") or None)
+            except HTTPException:
+                results.append({"index": i, "status": "ERROR", "error": "INVALID_SEND_AT"})
+                continue
+            results.append({"index": i, "status": "OK", "file": None})
+            if when is None:
+                accepted.append((i, sdt, msg))
+            else:
+                deferred.append((i, sdt, msg, when))
+
+    admitted = await run_send(_admit, request, len(accepted))
+    for i, *_ in accepted[admitted:]:
+        results[i] = {"index": i, "status": "ERROR", "error": "RATE_LIMITED"}
+    accepted = accepted[:admitted]
+    admitted = await run_send(_admit, request, len(deferred), deferred=True)
+    for i, *_ in deferred[admitted:]:
+        results[i] = {"index": i, "status": "ERROR", "error": "RATE_LIMITED"}
+    deferred = deferred[:admitted]
+
+    if deferred:
+        ids = await run_send(_schedule, [(p, m, None, w) for _, p, m, w in deferred])
+        for (i, _, _, when), schedule_id in zip(deferred, ids):
+            results[i] = {"index": i, "status": "SCHEDULED", **_scheduled(schedule_id, when)}
+
+    messages = [(p, m) for _, p, m in accepted]
+    if SEND_MODE == "queue":
+        for (i, _, _), queued in zip(accepted, await run_send(_enqueue, messages)):
+            results[i].update(status="QUEUED", **queued)
+    else:
+        written = await run_send(create_sms_files, messages)
+        for (i, _, _), (root, filename) in zip(accepted, written):
+            results[i].update(file=filename, root=root)
 
     return {
         "status": "OK",
-        "file": filename
+        "accepted": len(accepted) + len(deferred),
+        "rejected": len(items) - len(accepted) - len(deferred),
+        "results": results,
     }
 
 
+@app.get("/status/{file}")
+async def delivery_status(file: str, hash: str):
+    """Where a sent file is now (outgoing, checked, sent, failed); hash is md5("{file}&{SECRET_KEY}")."""
+    if not verify_ref_md5(file, hash):
+        raise HTTPException(status_code=403, detail="INVALID_HASH")
+    [status] = await run_admin(admin_routes.delivery_status, [file])
+    if status is None:
+        raise HTTPException(status_code=404, detail="NOT_FOUND")
+    return status
+
+
+@app.post("/status/batch")
+async def delivery_status_batch(request: Request):
+    """Status of many files; each item is {"file", "hash"} signed like /status/{file}."""
+    items = _parse_batch(await _read_batch(request), request.headers.get("content-type", ""))
+    if len(items) > BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail="BATCH_TOO_LARGE")
+
+    results: list[dict] = []
+    lookup: list[tuple[int, str]] = []
+    for item in items:
+        fields = item if isinstance(item, dict) else {}
+        file, sig = fields.get("file"), fields.get("hash")
+        if not (isinstance(file, str) and file and isinstance(sig, str)):
+            results.append({"file": file, "status": "ERROR", "error": "MISSING_FIELDS"})
+        elif not verify_ref_md5(file, sig):
+            results.append({"file": file, "status": "ERROR", "error": "INVALID_HASH"})
+        else:
+            results.append({"file": file, "state": "unknown"})
+            lookup.append((len(results) - 1, file))
+
+    found = await run_admin(admin_routes.delivery_status, [f for _, f in lookup])
+    for (i, _), status in zip(lookup, found):
+        if status is not None:
+            results[i] = status
+    return {"results": results}
+
+
 # Mount admin routes (must be before static files)
 from importlib import import_module
 admin_routes = import_module("admin-routes")
 app.include_router(admin_routes.router)
 
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(_scraper: str = Depends(admin_routes.verify_metrics_access)):
+    """Prometheus text exposition of latency histograms, folder sizes and cache counters.
+
+    Needs Authorization: Bearer METRICS_TOKEN (or an admin token): per-root
+    traffic and queue depths are not for the public side of the tunnel.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+class FrontendFiles(StaticFiles):
+    """Build assets are content-hashed, so cached for good; index.html is revalidated."""
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if path.startswith("assets/") and response.status_code in (200, 304):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers.setdefault("Cache-Control", "no-cache")
+        return response
+
+
 # Serve Svelte frontend static files (mount last to avoid route conflicts)
 static_dir = Path(__file__).parent / "static"
 if static_dir.exists():
-    app.mount("/", StaticFiles(directory=str(static_dir), html=True), name="static")
+    app.mount("/", FrontendFiles(directory=str(static_dir), html=True), name="static")
@@ -0,0 +1,210 @@
+"""Token-bucket admission control for the send endpoints.
+
+Two levels of buckets: one global bucket sized to what smsd and the modems
+can sustain, and one per caller so a single client cannot use it all up.
+A rate of 0 disables that level.
+
+With several worker processes the buckets live in a SQLite file instead
+(SharedBuckets), so the limits hold for the gateway as a whole rather than
+per worker. Each take is a single upsert, atomic without an explicit
+transaction.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Union
+
+# Per-caller buckets kept; the least recently seen caller is dropped first
+# (an idle caller's bucket would be full again anyway).
+MAX_CALLERS = 10000
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, n: int = 1) -> int:
+        """Take up to n whole tokens; returns how many were granted."""
+        with self._lock:
+            self._refill()
+            granted = min(n, int(self._tokens))
+            self._tokens -= granted
+            return granted
+
+    def give(self, n: int):
+        """Return tokens that were taken but not used."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + n)
+
+    def wait_time(self) -> float:
+        """Seconds until one token is available."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self._tokens) / self.rate)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    granted INTEGER NOT NULL,
+    idle REAL NOT NULL
+);
+"""
+
+# Refill, then take min(n, whole tokens); UPDATE expressions all see the old
+# row, so granted and tokens are computed from the same refill.
+_TAKE = """
+INSERT INTO buckets (key, tokens, updated, granted, idle)
+VALUES (:key, :burst - min(:n, CAST(:burst AS INTEGER)), :now, min(:n, CAST(:burst AS INTEGER)), :idle)
+ON CONFLICT (key) DO UPDATE SET
+    granted = min(:n, CAST(min(:burst, tokens + max(0, :now - updated) * :rate) AS INTEGER)),
+    tokens = min(:burst, tokens + max(0, :now - updated) * :rate)
+             - min(:n, CAST(min(:burst, tokens + max(0, :now - updated) * :rate) AS INTEGER)),
+    updated = :now,
+    idle = :idle
+RETURNING granted
+"""
+
+PRUNE_INTERVAL = 60.0
+
+
+class SharedBuckets:
+    """Token buckets in SQLite, shared by every process that opens db_path.
+
+    Uses wall-clock time, the one clock all workers agree on. A bucket left
+    alone long enough to be full again is deleted; a missing bucket is full.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Losing bucket levels in a crash only refills them early.
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._pruned_at = time.time()
+
+    def take(self, key: str, rate: float, burst: float, n: int = 1) -> int:
+        now = time.time()
+        with self._lock:
+            granted = self._db.execute(_TAKE, {"key": key, "rate": rate, "burst": burst, "n": n,
+                                               "now": now, "idle": burst / rate}).fetchone()[0]
+            if now - self._pruned_at > PRUNE_INTERVAL:
+                self._db.execute("DELETE FROM buckets WHERE updated + idle < ?", (now,))
+                self._pruned_at = now
+        return granted
+
+    def give(self, key: str, burst: float, n: int):
+        with self._lock:
+            self._db.execute("UPDATE buckets SET tokens = min(?, tokens + ?) WHERE key = ?", (burst, n, key))
+
+    def tokens(self, key: str, rate: float, burst: float) -> float:
+        with self._lock:
+            row = self._db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return burst
+        return min(burst, row[0] + max(0.0, time.time() - row[1]) * rate)
+
+    def bucket(self, key: str, rate: float, burst: float) -> "SharedTokenBucket":
+        return SharedTokenBucket(self, key, rate, burst)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SharedTokenBucket:
+    """TokenBucket interface over one row of SharedBuckets."""
+
+    def __init__(self, store: SharedBuckets, key: str, rate: float, burst: float):
+        self._store = store
+        self.key = key
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+
+    def take(self, n: int = 1) -> int:
+        return self._store.take(self.key, self.rate, self.burst, n)
+
+    def give(self, n: int):
+        self._store.give(self.key, self.burst, n)
+
+    def wait_time(self) -> float:
+        return max(0.0, (1 - self._store.tokens(self.key, self.rate, self.burst)) / self.rate)
+
+
+Bucket = Union[TokenBucket, SharedTokenBucket]
+
+
+class RateLimiter:
+    """Global plus per-caller token buckets, in memory or in shared SQLite."""
+
+    def __init__(self, rate: float = 0, burst: float = 0, caller_rate: float = 0,
+                 caller_burst: float = 0, shared: Optional[SharedBuckets] = None):
+        self.shared = shared
+        self.global_bucket = self._bucket("global", rate, burst or rate) if rate > 0 else None
+        self.caller_rate = caller_rate
+        self.caller_burst = caller_burst or caller_rate
+        self._callers: OrderedDict[str, Bucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: str, rate: float, burst: float) -> Bucket:
+        if self.shared is not None:
+            return self.shared.bucket(key, rate, burst)
+        return TokenBucket(rate, burst)
+
+    def _caller_bucket(self, caller: str):
+        if self.caller_rate <= 0:
+            return None
+        with self._lock:
+            bucket = self._callers.get(caller)
+            if bucket is None:
+                bucket = self._callers[caller] = self._bucket(
+                    "caller:" + caller, self.caller_rate, self.caller_burst)
+                if len(self._callers) > MAX_CALLERS:
+                    self._callers.popitem(last=False)
+            else:
+                self._callers.move_to_end(caller)
+            return bucket
+
+    def acquire(self, caller: str, n: int = 1, include_global: bool = True) -> int:
+        """Admit up to n messages from caller; returns how many were admitted.
+
+        include_global=False checks only the caller's bucket, for when the
+        global rate is enforced downstream (the send queue).
+        """
+        granted = n
+        bucket = self._caller_bucket(caller)
+        if bucket is not None:
+            granted = bucket.take(granted)
+        if include_global and self.global_bucket is not None and granted:
+            allowed = self.global_bucket.take(granted)
+            if bucket is not None and allowed < granted:
+                bucket.give(granted - allowed)
+            granted = allowed
+        return granted
+
+    def retry_after(self, caller: str, include_global: bool = True) -> float:
+        """Seconds until caller may send one more message."""
+        waits = [0.0]
+        bucket = self._caller_bucket(caller)
+        if bucket is not None:
+            waits.append(bucket.wait_time())
+        if include_global and self.global_bucket is not None:
+            waits.append(self.global_bucket.wait_time())
+        return max(waits)
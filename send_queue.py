@@ -0,0 +1,140 @@
+"""In-process queue that drains accepted messages into the outgoing spool.
+
+In queued send mode /send-sms answers immediately and one drain thread moves
+messages into outgoing/ at the global rate, pausing while outgoing/ holds
+high_water files or more, so bursts wait here instead of piling up in front
+of smsd. Filenames are assigned at submit time, so callers know the spool
+file their message will become.
+
+The queue lives in memory: messages still queued when the process exits are
+lost, like requests in flight.
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from rate_limit import Bucket, TokenBucket
+from spool_writer import SpoolWriter, count_spool_files
+
+DRAIN_BATCH = 100
+# How long a counted outgoing/ depth is trusted before scanning again.
+DEPTH_REFRESH = 0.5
+# Back-off while outgoing/ is at the high-water mark or after a write error.
+IDLE_WAIT = 0.2
+ERROR_WAIT = 1.0
+
+
+class QueueFull(Exception):
+    pass
+
+
+class SendQueue:
+    """FIFO of (filename, phone, message) drained into outgoing/."""
+
+    def __init__(self, writer: SpoolWriter, rate: float = 0, burst: float = 0,
+                 high_water: int = 0, max_size: int = 100000, bucket: Optional[Bucket] = None):
+        self.writer = writer
+        self.rate = rate
+        self.high_water = high_water
+        self.max_size = max_size
+        # A shared bucket makes several workers' queues drain at rate together.
+        self._bucket = bucket or (TokenBucket(rate, burst or rate) if rate > 0 else None)
+        self._items: deque[tuple[str, str, str]] = deque()
+        self._cond = threading.Condition()
+        self._depth = 0
+        self._depth_at = 0.0
+        self.submitted = 0
+        self.written = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def submit(self, messages: list[tuple[str, str]]) -> list[tuple[str, int]]:
+        """Queue messages; returns (filename, 1-based queue position) for each."""
+        with self._cond:
+            if len(self._items) + len(messages) > self.max_size:
+                raise QueueFull()
+            out = []
+            for phone, message in messages:
+                filename = self.writer.new_filename(phone)
+                self._items.append((filename, phone, message))
+                out.append((filename, len(self._items)))
+            self.submitted += len(messages)
+            self._cond.notify()
+        return out
+
+    def eta(self, position: int) -> float:
+        """Estimated seconds until the message at position reaches outgoing/."""
+        return round(position / self.rate, 1) if self.rate > 0 else 0.0
+
+    # --- draining ---
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="send-queue", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                n = min(len(self._items), DRAIN_BATCH)
+            if self.high_water:
+                n = min(n, self.high_water - self._outgoing_depth())
+                if n <= 0:
+                    time.sleep(IDLE_WAIT)
+                    continue
+            if self._bucket is not None:
+                n = self._bucket.take(n)
+                if not n:
+                    time.sleep(self._bucket.wait_time())
+                    continue
+            with self._cond:
+                batch = [self._items.popleft() for _ in range(n)]
+            try:
+                self.writer.write_many([(p, m) for _, p, m in batch], [f for f, _, _ in batch])
+            except OSError:
+                with self._cond:
+                    self._items.extendleft(reversed(batch))
+                time.sleep(ERROR_WAIT)
+                continue
+            self.written += n
+            self._depth += n
+
+    def _outgoing_depth(self) -> int:
+        now = time.monotonic()
+        if now - self._depth_at > DEPTH_REFRESH:
+            self._depth = count_spool_files(self.writer.outgoing_dir)
+            self._depth_at = now
+        return self._depth
+
+
+_queues: dict[str, SendQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_send_queue(writer: SpoolWriter, rate: float = 0, burst: float = 0,
+                   high_water: int = 0, max_size: int = 100000,
+                   bucket: Optional[Bucket] = None) -> SendQueue:
+    """Return the process-wide, running queue in front of a writer's directory."""
+    with _queues_lock:
+        queue = _queues.get(writer.outgoing_dir)
+        if queue is None:
+            queue = _queues[writer.outgoing_dir] = SendQueue(writer, rate, burst, high_water, max_size,
+                                                             bucket)
+            queue.start()
+        return queue
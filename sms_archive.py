@@ -0,0 +1,346 @@
+"""Compaction of aged spool files into append-only, compressed segments.
+
+smstools leaves every delivered message as its own file, so long-lived
+folders grow to millions of inodes. Messages older than a configured age are
+moved into segment files under the archive directory:
+
+* records are packed into blocks of about BLOCK_SIZE raw bytes, and each block
+  is zlib-compressed and appended to the current segment;
+* a SQLite catalogue maps (folder, filename) to (segment, block offset, block
+  length, record offset) and keeps the listing entry plus the sort and filter
+  columns, so archived messages are listed without touching the segments;
+* an FTS5 table over the archived text keeps them searchable.
+
+Segments are only ever appended to. A block is referenced by the catalogue
+only once it has been fsync'ed, and the live file is unlinked only after the
+catalogue commit, so a crash at any point leaves each message either live,
+archived, or (briefly) both, never lost.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from sms_index import FolderIndex
+from sms_parser import TYPED_FIELDS, parse_sms
+from sms_search import _transaction
+
+BLOCK_SIZE = 64 * 1024
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Files moved per catalogue transaction; bounds memory during a compaction.
+COMPACT_BATCH = 1000
+# Filenames per "IN (...)" lookup, under SQLite's variable limit.
+LOOKUP_CHUNK = 500
+
+log = logging.getLogger(__name__)
+
+# Indexed listing sort columns. For each of them the last two items of the
+# paging sort key are (column value, filename); any other field is ordered
+# by its parsed value from the stored entry.
+_SQL_ORDER = {
+    "modified": "modified",
+    "name": "lower(filename)",
+    "size": "size",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    modified REAL NOT NULL,
+    size INTEGER NOT NULL,
+    modem TEXT,
+    segment INTEGER NOT NULL,
+    block_offset INTEGER NOT NULL,
+    block_length INTEGER NOT NULL,
+    record_offset INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    UNIQUE (folder, filename)
+);
+CREATE INDEX IF NOT EXISTS archived_modified ON archived (folder, modified, filename);
+CREATE INDEX IF NOT EXISTS archived_name ON archived (folder, lower(filename), filename);
+CREATE INDEX IF NOT EXISTS archived_size ON archived (folder, size, filename);
+CREATE VIRTUAL TABLE IF NOT EXISTS archived_fts USING fts5(
+    filename, phone, headers, body, tokenize = 'trigram'
+);
+"""
+
+
+class SpoolArchive:
+    """Segment files plus their catalogue for one archive directory."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.root / "catalog.sqlite"),
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+
+    # --- compaction ---
+
+    def compact(self, index: FolderIndex, older_than: float) -> int:
+        """Move files last modified before older_than into the archive.
+
+        Returns the number of files archived.
+        """
+        with self._compact_lock:
+            index.refresh()
+            aged = [e for e in index.entries() if e["modified"] < older_than]
+            aged.sort(key=lambda e: (e["modified"], e["filename"]))
+            moved = 0
+            for i in range(0, len(aged), COMPACT_BATCH):
+                moved += self._compact_batch(index, aged[i:i + COMPACT_BATCH])
+            return moved
+
+    def _compact_batch(self, index: FolderIndex, entries: list[dict]) -> int:
+        records = []
+        for entry in entries:
+            path = index.path / entry["filename"]
+            try:
+                st = os.stat(path)
+                # Rewritten since it was indexed: leave it for the next run.
+                if st.st_mtime != entry["modified"] or st.st_size != entry["size"]:
+                    continue
+                with open(path, "rb") as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                continue
+            records.append((entry, raw))
+        if not records:
+            return 0
+
+        locations = self._append_blocks([raw for _, raw in records])
+        with self._lock, _transaction(self._db):
+            for (entry, raw), location in zip(records, locations):
+                self._insert(index.folder, entry, raw, location)
+
+        for entry, _ in records:
+            index.unlink(entry["filename"], archived=True)
+        return len(records)
+
+    def _append_blocks(self, raws: list[bytes]) -> list[tuple[int, int, int, int]]:
+        """Write records as compressed blocks; (segment, offset, length, record offset) each."""
+        locations = []
+        segment, f = self._open_segment()
+        try:
+            block = bytearray()
+            pending: list[int] = []
+
+            def write_block():
+                nonlocal segment, f
+                if f.tell() >= SEGMENT_MAX_BYTES:
+                    _sync(f)
+                    f.close()
+                    segment, f = self._open_segment(segment + 1)
+                data = zlib.compress(bytes(block))
+                offset = f.tell()
+                f.write(data)
+                locations.extend((segment, offset, len(data), r) for r in pending)
+                block.clear()
+                pending.clear()
+
+            for raw in raws:
+                pending.append(len(block))
+                block += raw
+                if len(block) >= BLOCK_SIZE:
+                    write_block()
+            if block:
+                write_block()
+            _sync(f)
+        finally:
+            f.close()
+        return locations
+
+    def _open_segment(self, number: Optional[int] = None):
+        if number is None:
+            numbers = [int(p.stem) for p in self.root.glob("*.seg")]
+            number = max(numbers, default=0)
+        path = self._segment_path(number)
+        created = not path.exists()
+        f = open(path, "ab")
+        f.seek(0, os.SEEK_END)
+        if created:
+            dir_fd = os.open(self.root, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return number, f
+
+    def _segment_path(self, number: int) -> Path:
+        return self.root / f"{number:08d}.seg"
+
+    def _insert(self, folder: str, entry: dict, raw: bytes, location: tuple):
+        self._delete(folder, entry["filename"])
+        cur = self._db.execute(
+            "INSERT INTO archived (folder, filename, modified, size, modem, segment, block_offset,"
+            " block_length, record_offset, entry) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (folder, entry["filename"], entry["modified"], entry["size"], entry.get("modem"),
+             *location, json.dumps(entry)))
+        headers, body = parse_sms(raw.decode("utf-8", errors="replace"))
+        header_text = "\n".join(f"{k}: {v}" for k, v in headers.items())
+        self._db.execute(
+            "INSERT INTO archived_fts (rowid, filename, phone, headers, body) VALUES (?, ?, ?, ?, ?)",
+            (cur.lastrowid, entry["filename"], entry.get("phone", ""), header_text, body))
+
+    def _delete(self, folder: str, name: str):
+        row = self._db.execute(
+            "SELECT id FROM archived WHERE folder = ? AND filename = ?", (folder, name)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM archived_fts WHERE rowid = ?", row)
+            self._db.execute("DELETE FROM archived WHERE id = ?", row)
+
+    def start(self, indexes: Iterable[FolderIndex], max_age: float, interval: float):
+        """Compact the given folders every interval seconds in a daemon thread (idempotent)."""
+        with self._lock:
+            if self._compactor is not None:
+                return
+            indexes = list(indexes)
+
+            def run():
+                while True:
+                    for index in indexes:
+                        try:
+                            self.compact(index, time.time() - max_age)
+                        except Exception:
+                            # Disk or catalogue trouble, a bad row: retry on the next round.
+                            log.exception("compacting %s failed", index.path)
+                    time.sleep(interval)
+
+            self._compactor = threading.Thread(target=run, name="sms-archive", daemon=True)
+            self._compactor.start()
+
+    # --- queries ---
+
+    def count(self, folder: str, modem: Optional[str] = None) -> int:
+        sql, params = "SELECT count(*) FROM archived WHERE folder = ?", [folder]
+        if modem:
+            sql, params = sql + " AND modem = ?", params + [modem]
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()[0]
+
+    def newest(self, folder: str) -> Optional[float]:
+        """Latest modification time among a folder's archived messages."""
+        with self._lock:
+            return self._db.execute("SELECT max(modified) FROM archived WHERE folder = ?",
+                                    (folder,)).fetchone()[0]
+
+    def archived_names(self, folder: str, names: list[str]) -> set[str]:
+        """Those of names that are archived in folder."""
+        found = set()
+        with self._lock:
+            for i in range(0, len(names), LOOKUP_CHUNK):
+                chunk = names[i:i + LOOKUP_CHUNK]
+                rows = self._db.execute(
+                    f"SELECT filename FROM archived WHERE folder = ? AND filename IN"
+                    f" ({','.join('?' * len(chunk))})", [folder, *chunk]).fetchall()
+                found.update(name for (name,) in rows)
+        return found
+
+    def top(self, folder: str, sort_by: str, reverse: bool, limit: int,
+            after: Optional[tuple] = None, modem: Optional[str] = None) -> list[dict]:
+        """The first limit entries in listing order (sms_paging.sort_key) after a cursor key."""
+        direction = "DESC" if reverse else "ASC"
+        sql, params = "SELECT entry FROM archived WHERE folder = ?", [folder]
+        if modem:
+            sql, params = sql + " AND modem = ?", params + [modem]
+        if sort_by in TYPED_FIELDS:
+            # Entries lacking the field sort last both ways, as in sort_key,
+            # whose first key item is this flag. SQLite orders numbers
+            # before text, as sort_key's is-a-string item does.
+            value = f"json_extract(entry, '$.{sort_by}')"
+            present = f"({value} IS {'NOT ' if reverse else ''}NULL)"
+            columns = [present, f"coalesce({value}, 0)", "filename"]
+            cursor = (after[0], after[2], after[3]) if after is not None else None
+        else:
+            column = _SQL_ORDER.get(sort_by, "modified")
+            columns = [column, "filename"]
+            cursor = after[-2:] if after is not None else None
+        if cursor is not None:
+            sql += f" AND ({', '.join(columns)}) {'<' if reverse else '>'} ({', '.join('?' * len(cursor))})"
+            params += list(cursor)
+        sql += f" ORDER BY {', '.join(f'{c} {direction}' for c in columns)} LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [_entry(e) for (e,) in rows]
+
+    def entries(self, folder: str, modem: Optional[str] = None,
+                name_contains: Optional[str] = None) -> Iterator[dict]:
+        sql, params = "SELECT entry FROM archived WHERE folder = ?", [folder]
+        if modem:
+            sql, params = sql + " AND modem = ?", params + [modem]
+        if name_contains:
+            sql, params = sql + " AND instr(lower(filename), ?) > 0", params + [name_contains.lower()]
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return (_entry(e) for (e,) in rows)
+
+    def search(self, folder: str, query: str) -> list[dict]:
+        """Archived entries whose filename, phone, headers or body contain query."""
+        phrase = '"' + query.replace('"', '""') + '"'
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT a.entry FROM archived_fts JOIN archived a ON a.id = archived_fts.rowid "
+                "WHERE archived_fts MATCH ? AND a.folder = ?", (phrase, folder)).fetchall()
+        return [_entry(e) for (e,) in rows]
+
+    def entry(self, folder: str, filename: str) -> Optional[dict]:
+        """Listing entry of an archived message, without reading its segment."""
+        with self._lock:
+            row = self._db.execute("SELECT entry FROM archived WHERE folder = ? AND filename = ?",
+                                   (folder, filename)).fetchone()
+        return _entry(row[0]) if row is not None else None
+
+    def read(self, folder: str, filename: str) -> Optional[tuple[dict, bytes]]:
+        """(entry, raw file bytes) of an archived message, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT entry, size, segment, block_offset, block_length, record_offset "
+                "FROM archived WHERE folder = ? AND filename = ?", (folder, filename)).fetchone()
+        if row is None:
+            return None
+        entry, size, segment, block_offset, block_length, record_offset = row
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(block_offset)
+            block = zlib.decompress(f.read(block_length))
+        return _entry(entry), block[record_offset:record_offset + size]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _entry(text: str) -> dict:
+    entry = json.loads(text)
+    entry["archived"] = True
+    return entry
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+_archives: dict[str, SpoolArchive] = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(root: str) -> SpoolArchive:
+    """Return the process-wide archive stored under root."""
+    key = os.path.abspath(root)
+    with _archives_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            archive = _archives[key] = SpoolArchive(key)
+        return archive
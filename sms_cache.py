@@ -0,0 +1,104 @@
+"""Bounded LRU cache of parsed smstools message files.
+
+Entries are keyed on the file path and validated against (mtime, size, inode),
+so a file moved or rewritten by smsd is re-read while files that never change
+again (sent, failed) are parsed once. The cache is bounded both by entry count
+and by an estimate of the memory held by the cached text.
+"""
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from sms_parser import PREVIEW_LENGTH, parse_sms, phone_of, typed_fields
+
+# Rough per-entry overhead of the dicts and tuples around the cached strings.
+ENTRY_OVERHEAD = 512
+
+
+class ParsedSMS:
+    """Parsed view of one message file."""
+
+    __slots__ = ("content", "headers", "body", "preview")
+
+    def __init__(self, content: str):
+        self.content = content
+        self.headers, self.body = parse_sms(content)
+        self.preview = self.body[:PREVIEW_LENGTH]
+
+    @property
+    def phone(self) -> str:
+        return phone_of(self.headers)
+
+    @property
+    def fields(self) -> dict:
+        return typed_fields(self.headers)
+
+    def cost(self) -> int:
+        text = sum(len(k) + len(v) for k, v in self.headers.items())
+        return ENTRY_OVERHEAD + len(self.content) + len(self.body) + len(self.preview) + text
+
+
+class SMSCache:
+    """Thread-safe LRU of ParsedSMS bounded by entry count and bytes."""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, tuple[tuple, ParsedSMS, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: Path, stat: Optional[os.stat_result] = None) -> ParsedSMS:
+        """Return the parsed file, reading it only if not cached at this version."""
+        if stat is None:
+            stat = os.stat(path)
+        key = str(path)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == stamp:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            parsed = ParsedSMS(f.read().decode("utf-8", errors="replace"))
+        self._put(key, stamp, parsed)
+        return parsed
+
+    def _put(self, key: str, stamp: tuple, parsed: ParsedSMS):
+        cost = parsed.cost()
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if cost > self.max_bytes:
+                return
+            self._items[key] = (stamp, parsed, cost)
+            self._bytes += cost
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_cost) = self._items.popitem(last=False)
+                self._bytes -= evicted_cost
+                self.evictions += 1
+
+    def invalidate(self, path: Path):
+        with self._lock:
+            item = self._items.pop(str(path), None)
+            if item is not None:
+                self._bytes -= item[2]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,411 @@
+"""Shared state for several uvicorn workers serving one spool.
+
+The workers elect a primary through an flock on STATE_DIR/primary.lock. Only
+the primary watches and scans the spool and runs the background engines
+(scheduled releases, retries, webhooks, compaction, search indexing). It
+serves the other workers over a Unix socket, STATE_DIR/cluster.sock:
+
+* replication: a follower gets a snapshot of every folder index on connect,
+  then every change event in order, and applies them to its own indexes, so
+  listings, counts, stats, delivery status and WebSocket clients on every
+  worker see the same spool, scanned once;
+* sync: before a listing, a follower asks the primary to apply pending
+  changes and waits for the reply, which arrives after the events they
+  produced, as FolderIndex.refresh() guarantees on the primary;
+* calls: operations on state the primary owns (scheduling, search, retry
+  and webhook status, compaction) are forwarded by name.
+
+When the primary exits, the lock is released. The first follower to take it
+starts watching and runs the engines; the others reconnect, and their
+re-snapshot emits only what actually changed.
+
+Messages are newline-delimited JSON. Send-path state (dedup keys, rate-limit
+buckets) is shared through SQLite instead, so sends never wait on this socket.
+"""
+import fcntl
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from typing import Callable, Optional
+
+from sms_index import FolderIndex
+from sms_watcher import SpoolWatcher
+
+SNAPSHOT_CHUNK = 5000
+# Messages a follower may fall behind before it is dropped; it then
+# reconnects and starts over from a snapshot.
+PEER_QUEUE_MAX = 100000
+CONNECT_RETRY = 0.2
+READY_TIMEOUT = 60.0
+SYNC_TIMEOUT = 2.0
+CALL_TIMEOUT = 60.0
+CALL_WORKERS = 4
+
+# The process's spool watchers, each with a root name; the same roots and
+# folders in every worker.
+Watchers = Callable[[], list[SpoolWatcher]]
+
+
+class ClusterError(Exception):
+    """The primary worker could not be reached, or a forwarded call failed there."""
+
+
+def _flock(path: str):
+    """The open lock file at path, exclusively locked, or None if another process holds it."""
+    f = open(path, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class _Peer:
+    """The primary's end of one follower connection."""
+
+    def __init__(self, cluster: "Cluster", conn: socket.socket):
+        self._cluster = cluster
+        self._conn = conn
+        self._out: deque[bytes] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._listeners: list[tuple[FolderIndex, Callable]] = []
+
+    def start(self):
+        threading.Thread(target=self._read_loop, name="cluster-peer-read", daemon=True).start()
+        threading.Thread(target=self._write_loop, name="cluster-peer-write", daemon=True).start()
+
+    def send(self, message: dict):
+        data = _encode(message)
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._out) >= PEER_QUEUE_MAX:
+                self._closed = True
+            else:
+                self._out.append(data)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _replicate(self):
+        """Send a snapshot of every index, then its events (starting them first)."""
+        for watcher in self._cluster.watchers():
+            watcher.start()
+            for index in watcher.indexes.values():
+                self._follow(watcher.root, index)
+        self.send({"op": "ready"})
+
+    def _follow(self, root: str, index: FolderIndex):
+        # Events that fire while the snapshot is being queued wait behind it.
+        gate = threading.Lock()
+        held: Optional[list[dict]] = []
+
+        def listener(event: dict):
+            name = event["filename"] if event["event"] == "removed_file" else event["file"]["filename"]
+            message = {"op": "event", "root": root, "event": event, "key": index.key(name)}
+            with gate:
+                if held is not None:
+                    held.append(message)
+                    return
+            self.send(message)
+
+        with gate:
+            items = index.replicate(listener)
+            self._listeners.append((index, listener))
+            for i in range(0, max(len(items), 1), SNAPSHOT_CHUNK):
+                self.send({"op": "snapshot", "root": root, "folder": index.folder,
+                           "entries": items[i:i + SNAPSHOT_CHUNK], "done": i + SNAPSHOT_CHUNK >= len(items)})
+            for message in held:
+                self.send(message)
+            held = None
+
+    def _read_loop(self):
+        try:
+            self._replicate()
+            for line in self._conn.makefile("rb"):
+                message = json.loads(line)
+                if message["op"] == "sync":
+                    self._cluster.refresh()
+                    self.send({"op": "synced", "id": message["id"]})
+                elif message["op"] == "call":
+                    self._cluster._pool.submit(self._call, message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def _call(self, message: dict):
+        try:
+            result = self._cluster.calls[message["name"]](*message["args"])
+            self.send({"op": "result", "id": message["id"], "result": result})
+        except Exception as e:
+            self.send({"op": "result", "id": message["id"], "error": f"{type(e).__name__}: {e}"})
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._out and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    break
+                batch = b"".join(self._out)
+                self._out.clear()
+            try:
+                self._conn.sendall(batch)
+            except OSError:
+                self.close()
+        for index, listener in self._listeners:
+            index.remove_listener(listener)
+        with suppress(OSError):
+            self._conn.shutdown(socket.SHUT_RDWR)
+        self._conn.close()
+        with self._cluster._state:
+            self._cluster._peers.discard(self)
+
+
+class Cluster:
+    """This worker's place among the workers sharing a state directory."""
+
+    def __init__(self, state_dir: str, watchers: Watchers, calls: dict[str, Callable]):
+        os.makedirs(state_dir, exist_ok=True)
+        self.lock_path = os.path.join(state_dir, "primary.lock")
+        self.socket_path = os.path.join(state_dir, "cluster.sock")
+        self.watchers = watchers
+        self.calls = calls
+        self.is_primary = False
+        self._promote: list[Callable[[], None]] = []
+        self._state = threading.Condition()
+        self._lock_file = None
+        self._server: Optional[socket.socket] = None
+        self._peers: set[_Peer] = set()
+        self._pool = ThreadPoolExecutor(CALL_WORKERS, thread_name_prefix="cluster-call")
+        self._conn: Optional[socket.socket] = None
+        self._ids = itertools.count(1)
+        self._waiting: dict[int, list] = {}
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def on_promote(self, fn: Callable[[], None]):
+        """Run fn once this worker is (or becomes) the primary."""
+        self._promote.append(fn)
+        if self.is_primary:
+            fn()
+
+    def start(self, timeout: float = READY_TIMEOUT):
+        """Join the workers (idempotent).
+
+        Becomes the primary if no worker is, otherwise follows it and waits
+        up to timeout for the first full snapshot.
+        """
+        with self._state:
+            if self.is_primary or self._thread is not None:
+                return
+            primary = self._try_lock()
+            if not primary:
+                for watcher in self.watchers():
+                    watcher.replicated = True
+                    for index in watcher.indexes.values():
+                        index.live_sync = self.sync
+                self._thread = threading.Thread(target=self._follow, name="cluster-follow", daemon=True)
+                self._thread.start()
+        if primary:
+            self._become_primary()
+        else:
+            self._ready.wait(timeout)
+
+    def stop(self):
+        with self._state:
+            self._stopped = True
+            server, conn, peers = self._server, self._conn, list(self._peers)
+        for sock in (server, conn):
+            if sock is not None:
+                with suppress(OSError):
+                    sock.shutdown(socket.SHUT_RDWR)
+                sock.close()
+        for peer in peers:
+            peer.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_primary = False
+
+    # --- election ---
+
+    def _try_lock(self) -> bool:
+        self._lock_file = _flock(self.lock_path)
+        return self._lock_file is not None
+
+    def _become_primary(self):
+        for watcher in self.watchers():
+            watcher.replicated = False
+            for index in watcher.indexes.values():
+                if index.live_sync == self.sync:
+                    index.live_sync = None
+            # Rescans against the replicated entries only report real changes.
+            watcher.start()
+        with suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        with self._state:
+            self._server = server
+            self.is_primary = True
+        threading.Thread(target=self._accept, name="cluster-accept", daemon=True).start()
+        for fn in self._promote:
+            fn()
+        self._ready.set()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            peer = _Peer(self, conn)
+            with self._state:
+                self._peers.add(peer)
+            peer.start()
+
+    def refresh(self):
+        """Apply every change the primary's watchers have pending."""
+        for watcher in self.watchers():
+            for index in watcher.indexes.values():
+                if index.loaded:
+                    index.refresh()
+
+    # --- following ---
+
+    def _follow(self):
+        while not self._stopped:
+            if self._try_lock():
+                self._become_primary()
+                return
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(self.socket_path)
+            except OSError:
+                conn.close()
+                time.sleep(CONNECT_RETRY)
+                continue
+            with self._state:
+                self._conn = conn
+            try:
+                self._receive(conn)
+            except (OSError, ValueError):
+                pass
+            with self._state:
+                self._conn = None
+                waiting = list(self._waiting.values())
+                self._waiting.clear()
+            for waiter in waiting:
+                waiter[1] = {"error": "primary worker went away"}
+                waiter[0].set()
+            conn.close()
+
+    def _receive(self, conn: socket.socket):
+        indexes = {(w.root, folder): index for w in self.watchers() for folder, index in w.indexes.items()}
+        snapshots: dict[tuple[str, str], list] = {}
+        for line in conn.makefile("rb"):
+            message = json.loads(line)
+            op = message["op"]
+            if op == "event":
+                index = indexes.get((message["root"], message["event"]["folder"]))
+                if index is not None:
+                    index.apply(message["event"], message["key"])
+            elif op == "snapshot":
+                key = (message["root"], message["folder"])
+                snapshots.setdefault(key, []).extend(message["entries"])
+                if message["done"] and key in indexes:
+                    indexes[key].load(snapshots.pop(key))
+            elif op == "ready":
+                self._ready.set()
+            else:
+                with self._state:
+                    waiter = self._waiting.pop(message["id"], None)
+                if waiter is not None:
+                    waiter[1] = message
+                    waiter[0].set()
+
+    def _request(self, message: dict, timeout: float) -> dict:
+        waiter = [threading.Event(), None]
+        with self._state:
+            if self._conn is None:
+                raise ClusterError("primary worker unavailable")
+            id_ = next(self._ids)
+            self._waiting[id_] = waiter
+            try:
+                self._conn.sendall(_encode({**message, "id": id_}))
+            except OSError as e:
+                del self._waiting[id_]
+                raise ClusterError(f"primary worker unavailable: {e}")
+        if not waiter[0].wait(timeout):
+            with self._state:
+                self._waiting.pop(id_, None)
+            raise ClusterError("primary worker did not answer")
+        if "error" in waiter[1]:
+            raise ClusterError(waiter[1]["error"])
+        return waiter[1]
+
+    def sync(self):
+        """Wait until the changes the primary knows of are applied here (a follower's live_sync)."""
+        try:
+            self._request({"op": "sync"}, SYNC_TIMEOUT)
+        except ClusterError:
+            # Serve what the replica has rather than fail the listing.
+            pass
+
+    def call(self, name: str, *args):
+        """Run a primary-owned operation here if primary, else on the primary; args and result are JSON."""
+        if self.is_primary:
+            return self.calls[name](*args)
+        return self._request({"op": "call", "name": name, "args": list(args)}, CALL_TIMEOUT)["result"]
+
+
+_clusters: dict[str, Cluster] = {}
+_clusters_lock = threading.Lock()
+_alone: dict[str, object] = {}
+
+
+def lock_alone(state_dir: str):
+    """Hold the primary lock of a state directory for a worker running without a cluster.
+
+    Raises ClusterError when another process holds it: several uvicorn
+    workers started without WORKERS would each keep their own dedup keys,
+    rate limits and engines over the same state.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    key = os.path.abspath(state_dir)
+    with _clusters_lock:
+        if key in _alone:
+            return
+        f = _flock(os.path.join(key, "primary.lock"))
+        if f is None:
+            raise ClusterError(f"another worker is using {key}; set WORKERS to uvicorn's --workers")
+        _alone[key] = f
+
+
+def get_cluster(state_dir: str, watchers: Watchers, calls: dict[str, Callable]) -> Cluster:
+    """Return the process-wide cluster membership for a state directory (not yet started)."""
+    key = os.path.abspath(state_dir)
+    with _clusters_lock:
+        cluster = _clusters.get(key)
+        if cluster is None:
+            cluster = _clusters[key] = Cluster(key, watchers, calls)
+        return cluster
@@ -0,0 +1,201 @@
+"""Duplicate suppression for /send-sms retries.
+
+A client that times out behind the proxy retries, and without this every
+retry becomes another spool file and another SMS. Each send is keyed either by
+the client's Idempotency-Key or, when automatic dedup is on, by its phone and
+message; the first response under a key is stored and returned again for
+every repeat until it expires.
+
+Results live in an LRU dict of at most max_entries and in SQLite. While
+nothing unexpired has been evicted from memory, the dict holds every live key
+and a miss is answered without touching the disk; after that a miss costs one
+primary-key lookup. Writes are single-row upserts on a WAL database.
+
+With shared=True several worker processes use one database: a claim is a
+row with an empty result, inserted atomically unless a live row exists, so
+exactly one worker sends. Memory then only caches finished results, and a
+miss always asks the disk.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sms_search import _transaction
+
+# How long a repeat waits for the first request under its key to finish.
+CLAIM_WAIT = 30.0
+PRUNE_INTERVAL = 60.0
+# How often a shared-mode repeat re-checks a key claimed by another worker.
+CLAIM_POLL = 0.05
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sent (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    result TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sent_expires ON sent (expires);
+"""
+
+# Shared mode: take key unless a live row holds it; returns a row only on success.
+# A claim row has result '' and expires when its holder is presumed dead.
+_CLAIM = """
+INSERT INTO sent (key, fingerprint, result, expires) VALUES (?, ?, '', ?)
+ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint, result = '',
+    expires = excluded.expires WHERE sent.expires <= ?
+RETURNING key
+"""
+
+
+class KeyReused(Exception):
+    """The key was first used for a different request."""
+
+
+class InProgress(Exception):
+    """The first request under the key is still running."""
+
+
+class DedupStore:
+    """Bounded memory-plus-disk map from send key to the response it produced."""
+
+    def __init__(self, db_path: str, max_entries: int = 100000, shared: bool = False):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self.max_entries = max_entries
+        self.shared = shared
+        self._cond = threading.Condition()
+        self._entries: OrderedDict[str, tuple[float, str, str]] = OrderedDict()
+        self._inflight: set[str] = set()
+        now = self._pruned_at = time.time()
+        with _transaction(self._db):
+            self._db.execute("DELETE FROM sent WHERE expires <= ?", (now,))
+            rows = self._db.execute(
+                "SELECT key, expires, fingerprint, result FROM sent WHERE result != ''"
+                " ORDER BY expires DESC LIMIT ?",
+                (max_entries + 1,)).fetchall()
+        # Whether keys exist on disk that are not in memory.
+        self._spilled = len(rows) > max_entries
+        for key, expires, fingerprint, result in reversed(rows[:max_entries]):
+            self._entries[key] = (expires, fingerprint, result)
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def claim(self, key: str, fingerprint: str) -> Optional[str]:
+        """The stored result for key, or None after reserving key for the caller.
+
+        A caller that got None must follow up with complete() or release().
+        Raises KeyReused if key was stored for another fingerprint and
+        InProgress if its first request does not finish within CLAIM_WAIT.
+        """
+        deadline = time.monotonic() + CLAIM_WAIT
+        with self._cond:
+            while key in self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise InProgress(key)
+                self._cond.wait(remaining)
+            entry = self._lookup(key)
+            if entry is None and self.shared:
+                entry = self._claim_shared(key, fingerprint, deadline)
+            if entry is None:
+                self._inflight.add(key)
+                return None
+            if entry[1] != fingerprint:
+                raise KeyReused(key)
+            self.hits += 1
+            return entry[2]
+
+    def complete(self, key: str, fingerprint: str, result: str, ttl: float):
+        """Store the result of a claimed key for ttl seconds."""
+        now = time.time()
+        expires = now + ttl
+        with self._cond:
+            self._db.execute("INSERT OR REPLACE INTO sent (key, fingerprint, result, expires)"
+                             " VALUES (?, ?, ?, ?)", (key, fingerprint, result, expires))
+            self._remember(key, (expires, fingerprint, result))
+            self._inflight.discard(key)
+            self._cond.notify_all()
+            if now - self._pruned_at > PRUNE_INTERVAL:
+                self._prune()
+
+    def release(self, key: str):
+        """Give up a claimed key without storing a result (the send failed)."""
+        with self._cond:
+            if self.shared:
+                self._db.execute("DELETE FROM sent WHERE key = ? AND result = ''", (key,))
+            self._inflight.discard(key)
+            self._cond.notify_all()
+
+    # --- internals (hold _cond) ---
+
+    def _claim_shared(self, key: str, fingerprint: str,
+                      deadline: float) -> Optional[tuple[float, str, str]]:
+        """None once this process holds key, else the result another worker stored."""
+        while True:
+            now = time.time()
+            if self._db.execute(_CLAIM, (key, fingerprint, now + CLAIM_WAIT, now)).fetchone():
+                return None
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry
+            # Claimed by another worker and not finished yet.
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise InProgress(key)
+            self._cond.wait(min(CLAIM_POLL, remaining))
+
+    def _lookup(self, key: str) -> Optional[tuple[float, str, str]]:
+        entry = self._entries.get(key)
+        if entry is None and (self._spilled or self.shared):
+            row = self._db.execute("SELECT expires, fingerprint, result FROM sent WHERE key = ?"
+                                   " AND result != ''", (key,)).fetchone()
+            if row is not None:
+                entry = tuple(row)
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remember(self, key: str, entry: tuple[float, str, str]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, (expires, _, _) = self._entries.popitem(last=False)
+            if expires > time.time():
+                self._spilled = True
+
+    def _prune(self):
+        now = time.time()
+        self._db.execute("DELETE FROM sent WHERE expires <= ?", (now,))
+        self._pruned_at = now
+
+    def close(self):
+        with self._cond:
+            self._db.close()
+
+
+_stores: dict[str, DedupStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_dedup_store(db_path: str, max_entries: int = 100000, shared: bool = False) -> DedupStore:
+    """Return the process-wide dedup store at db_path."""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = DedupStore(key, max_entries, shared)
+        return store
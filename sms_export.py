@@ -0,0 +1,164 @@
+"""Streaming bulk export of a spool folder as NDJSON, CSV or .tar.gz.
+
+Everything is produced by generators walking the directory with os.scandir,
+one file at a time, and emitted in bounded chunks: memory use is constant
+however many files the folder holds.
+"""
+import csv
+import io
+import json
+import math
+import os
+import tarfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from sms_parser import TYPED_FIELDS, parse_sms, phone_of, typed_fields
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "tar": ("application/gzip", "tar.gz"),
+}
+CHUNK_SIZE = 64 * 1024
+
+CSV_COLUMNS = ("folder", "filename", "modified_iso", "size", "phone") + TYPED_FIELDS + ("body",)
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Accept unix seconds or an ISO 8601 timestamp (UTC when naive); ValueError otherwise."""
+    if value is None or value == "":
+        return None
+    try:
+        ts = float(value)
+    except ValueError:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    if not math.isfinite(ts):
+        raise ValueError(f"not a finite time: {value!r}")
+    return ts
+
+
+def iter_messages(folder_path: Path, since: Optional[float] = None, until: Optional[float] = None,
+                  phone: Optional[str] = None) -> Iterator[tuple[Path, os.stat_result, bytes]]:
+    """Yield (path, stat, file contents) for matching files, one at a time."""
+    try:
+        it = os.scandir(folder_path)
+    except FileNotFoundError:
+        return
+    with it:
+        for de in it:
+            if de.name.startswith("."):
+                continue
+            try:
+                if not de.is_file():
+                    continue
+                st = de.stat()
+                if since is not None and st.st_mtime < since:
+                    continue
+                if until is not None and st.st_mtime >= until:
+                    continue
+                with open(de.path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # Moved on by smsd while we were walking the folder.
+                continue
+            if phone and phone not in phone_of(parse_sms(_decode(data))[0]):
+                continue
+            yield Path(de.path), st, data
+
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace")
+
+
+def message_record(path: Path, st: os.stat_result, data: bytes) -> dict:
+    headers, body = parse_sms(_decode(data))
+    return {
+        "folder": path.parent.name,
+        "filename": path.name,
+        "modified": st.st_mtime,
+        "modified_iso": datetime.fromtimestamp(st.st_mtime, timezone.utc).isoformat(),
+        "size": st.st_size,
+        "phone": phone_of(headers),
+        **typed_fields(headers),
+        "headers": headers,
+        "body": body,
+    }
+
+
+def _chunked(pieces: Iterator[bytes]) -> Iterator[bytes]:
+    buf = bytearray()
+    for piece in pieces:
+        buf += piece
+        if len(buf) >= CHUNK_SIZE:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+
+def _ndjson(messages) -> Iterator[bytes]:
+    for path, st, data in messages:
+        yield json.dumps(message_record(path, st, data), ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _csv(messages) -> Iterator[bytes]:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for path, st, data in messages:
+        writer.writerow(message_record(path, st, data))
+        yield out.getvalue().encode("utf-8")
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue().encode("utf-8")
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink whose buffered bytes are taken by the generator."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+    def take(self) -> bytes:
+        out = bytes(self.data)
+        self.data.clear()
+        return out
+
+
+def _tar(messages, folder: str) -> Iterator[bytes]:
+    sink = _Drain()
+    with tarfile.open(fileobj=sink, mode="w|gz") as tar:
+        # Files go in byte for byte: UCS2 and ISO-8859 bodies are not UTF-8.
+        for path, st, data in messages:
+            info = tarfile.TarInfo(f"{folder}/{path.name}")
+            info.size = len(data)
+            info.mtime = int(st.st_mtime)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+            yield sink.take()
+    yield sink.take()
+
+
+def export_folder(folder_path: Path, fmt: str, since: Optional[float] = None,
+                  until: Optional[float] = None, phone: Optional[str] = None) -> Iterator[bytes]:
+    """Byte chunks of the export of one folder in the given format."""
+    messages = iter_messages(folder_path, since, until, phone)
+    if fmt == "csv":
+        pieces = _csv(messages)
+    elif fmt == "tar":
+        pieces = _tar(messages, folder_path.name)
+    else:
+        pieces = _ndjson(messages)
+    return _chunked(pieces)
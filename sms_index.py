@@ -0,0 +1,269 @@
+"""In-memory index of smstools spool folders.
+
+Each folder keeps one metadata entry per file, keyed on (name, mtime, size),
+so listings are served from memory and only new or changed files are parsed.
+Every change the index discovers is reported once to its listeners, whichever
+caller (a listing or the directory watcher) happened to discover it.
+Events are delivered under the index lock, in the order changes were applied,
+so listeners must be quick and must not block.
+
+An index can also be a replica of another process's index: load() installs
+a snapshot and apply() replays its events, without touching the directory.
+"""
+import os
+import secrets
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from sms_metrics import histogram
+
+# A directory whose mtime is this close to "now" may still receive another
+# change within the same timestamp tick, so it is rescanned regardless.
+RACY_WINDOW = 1.0
+
+FOLDER_SCAN = histogram("sms_folder_scan_seconds", "Full rescans of a spool folder.", ("folder",))
+
+LoadEntry = Callable[[Path, os.stat_result], dict]
+Listener = Callable[[dict], None]
+
+
+class FolderIndex:
+    """Metadata for every visible file in one spool folder."""
+
+    def __init__(self, path: Path, load_entry: LoadEntry):
+        self.path = Path(path)
+        self.folder = self.path.name
+        self._load_entry = load_entry
+        self._entries: dict[str, dict] = {}
+        self._keys: dict[str, tuple[int, int]] = {}
+        # Bumped on every change; the epoch tells this index apart from the
+        # same folder's index in another process or before a restart.
+        self._epoch = secrets.token_hex(4)
+        self._generation = 0
+        self._dir_mtime: Optional[int] = None
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._listeners: list[Listener] = []
+        # Set by a watcher that keeps this index current; refresh() then
+        # only asks the watcher to apply pending events instead of stat'ing.
+        self.live_sync: Optional[Callable[[], None]] = None
+
+    def add_listener(self, listener: Listener, snapshot: bool = False) -> Optional[list[dict]]:
+        """Register a callback for new_file / changed_file / removed_file events.
+
+        A removed_file event for a file moved into the archive carries
+        "archived": true.
+
+        With snapshot=True the folder is loaded if needed and its entries are
+        returned atomically with the registration: every later change reaches
+        the listener and none already in the snapshot does.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            if not snapshot:
+                return None
+            if not self._loaded:
+                self.rescan()
+            return list(self._entries.values())
+
+    def replicate(self, listener: Listener) -> list[tuple[dict, tuple[int, int]]]:
+        """add_listener(snapshot=True) returning (entry, key) pairs, for another index's load()."""
+        with self._lock:
+            self.add_listener(listener, snapshot=True)
+            return [(entry, self._keys[name]) for name, entry in self._entries.items()]
+
+    def remove_listener(self, listener: Listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def refresh(self):
+        """Bring the index in line with the directory.
+
+        Skipped entirely when the directory mtime is unchanged; otherwise the
+        folder is rescanned and only files whose (mtime, size) moved are parsed.
+        """
+        if self.live_sync is not None:
+            self.live_sync()
+            return
+        try:
+            dir_stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.rescan()
+            return
+
+        if (dir_stat.st_mtime_ns == self._dir_mtime
+                and time.time() - dir_stat.st_mtime > RACY_WINDOW):
+            return
+        self.rescan()
+
+    def rescan(self):
+        """Unconditionally rescan the directory, parsing only changed files."""
+        events = []
+        with self._lock, FOLDER_SCAN.time(self.folder):
+            try:
+                dir_mtime = os.stat(self.path).st_mtime_ns
+                found = _scan(self.path)
+            except FileNotFoundError:
+                dir_mtime, found = None, {}
+
+            for name, st in found.items():
+                event = self._store(name, st)
+                if event:
+                    events.append(event)
+            for name in self._entries.keys() - found.keys():
+                events.append(self._remove(name))
+            self._dir_mtime = dir_mtime
+            if self._loaded:
+                self._emit(events)
+            self._loaded = True
+
+    def update(self, name: str):
+        """Re-check a single file after the watcher reported a change to it."""
+        if name.startswith("."):
+            return
+        with self._lock:
+            try:
+                st = os.stat(self.path / name)
+            except FileNotFoundError:
+                st = None
+            if st is not None and stat.S_ISREG(st.st_mode):
+                event = self._store(name, st)
+            elif name in self._entries:
+                event = self._remove(name)
+            else:
+                event = None
+            if event:
+                self._emit([event])
+
+    def unlink(self, name: str, archived: bool = False):
+        """Delete a file and emit its removal before any watcher event for it can.
+
+        archived marks the removal as a move into the archive.
+        """
+        with self._lock:
+            try:
+                os.unlink(self.path / name)
+            except FileNotFoundError:
+                pass
+            if name in self._entries:
+                self._emit([self._remove(name, archived)])
+
+    def load(self, items: list[tuple[dict, tuple[int, int]]]):
+        """Replace the contents with a snapshot of (entry, key) pairs from another index.
+
+        Emits only the differences once loaded, like a rescan.
+        """
+        events = []
+        with self._lock:
+            found = {}
+            for entry, key in items:
+                found[entry["filename"]] = None
+                event = self._put(entry["filename"], entry, tuple(key))
+                if event:
+                    events.append(event)
+            for name in self._entries.keys() - found.keys():
+                events.append(self._remove(name))
+            if self._loaded:
+                self._emit(events)
+            self._loaded = True
+
+    def apply(self, event: dict, key: Optional[tuple[int, int]] = None):
+        """Replay a change event from another index; key is that index's key(name)."""
+        with self._lock:
+            if event["event"] == "removed_file":
+                name = event["filename"]
+                archived = event.get("archived", False)
+                applied = self._remove(name, archived) if name in self._entries else None
+            else:
+                applied = self._put(event["file"]["filename"], event["file"], tuple(key or ()))
+            if applied:
+                self._emit([applied])
+
+    def key(self, name: str) -> Optional[tuple[int, int]]:
+        """(mtime_ns, size) the entry for name was built from."""
+        return self._keys.get(name)
+
+    def _store(self, name: str, st: os.stat_result) -> Optional[dict]:
+        key = (st.st_mtime_ns, st.st_size)
+        if self._keys.get(name) == key:
+            return None
+        return self._put(name, self._load_entry(self.path / name, st), key)
+
+    def _put(self, name: str, entry: dict, key: tuple) -> Optional[dict]:
+        previous = self._keys.get(name)
+        if previous == key:
+            return None
+        old = self._entries.get(name)
+        self._entries[name] = entry
+        self._keys[name] = key
+        self._generation += 1
+        if previous is None:
+            return {"event": "new_file", "folder": self.folder, "file": entry}
+        return {"event": "changed_file", "folder": self.folder, "file": entry, "previous": old}
+
+    def _remove(self, name: str, archived: bool = False) -> dict:
+        old = self._entries.pop(name)
+        del self._keys[name]
+        self._generation += 1
+        event = {"event": "removed_file", "folder": self.folder, "filename": name, "previous": old}
+        if archived:
+            event["archived"] = True
+        return event
+
+    def _emit(self, events: list[dict]):
+        for event in events:
+            for listener in self._listeners:
+                listener(event)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def version(self) -> str:
+        """Changes whenever the entries do (as of the last refresh); an HTTP validator."""
+        return f"{self._epoch}.{self._generation}"
+
+    def get(self, name: str) -> Optional[dict]:
+        return self._entries.get(name)
+
+    def entries(self) -> list[dict]:
+        """Snapshot of all indexed entries (unordered)."""
+        with self._lock:
+            return list(self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _scan(path: Path) -> dict[str, os.stat_result]:
+    """Stat every visible regular file in a directory."""
+    found = {}
+    with os.scandir(path) as it:
+        for de in it:
+            if de.name.startswith("."):
+                continue
+            try:
+                if de.is_file():
+                    found[de.name] = de.stat()
+            except FileNotFoundError:
+                continue
+    return found
+
+
+_indexes: dict[str, FolderIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_folder_index(path: Path, load_entry: LoadEntry) -> FolderIndex:
+    """Return the process-wide index for a folder, creating it on first use."""
+    key = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = FolderIndex(Path(key), load_entry)
+        return index
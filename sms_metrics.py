@@ -0,0 +1,210 @@
+"""Process-wide metrics in the Prometheus text exposition format.
+
+Kept deliberately small instead of pulling in a client library: counters and
+histograms are a dict lookup plus a few integer additions under a lock, and
+everything that already has a count somewhere (folder sizes, cache hits,
+WebSocket clients) is read by a callback at scrape time, so the hot paths pay
+nothing for it.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+
+# Seconds; covers a sub-millisecond spool write up to a slow folder listing.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[str, ...]
+# collect() -> {label values: value}
+Collect = Callable[[], dict[Labels, float]]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _label_text(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(str(v))}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *values: str, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._label_text(k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """A value set by the code, or read from collect() at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Labels = (), collect: Optional[Collect] = None,
+                 kind: Optional[str] = None):
+        super().__init__(name, help, labels)
+        self._values: dict[Labels, float] = {}
+        self._collect = collect
+        # A callback may expose a running total that lives elsewhere.
+        if kind:
+            self.kind = kind
+
+    def inc(self, *values: str, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def dec(self, *values: str, amount: float = 1):
+        self.inc(*values, amount=-amount)
+
+    def samples(self) -> list[str]:
+        if self._collect is not None:
+            items = list(self._collect().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{self._label_text(k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Labels = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[Labels, list] = {}
+
+    def observe(self, value: float, *values: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(values)
+            if row is None:
+                row = self._values[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def time(self, *values: str) -> "_Timer":
+        """Context manager observing the duration of its block."""
+        return _Timer(self, values)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for values, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = self._label_text(values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_number(row[-1])}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, values: Labels):
+        self._histogram = histogram
+        self._values = values
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, *self._values)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+_registry: dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric: _Metric) -> _Metric:
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name: str, help: str, labels: Labels = ()) -> Counter:
+    return _register(Counter(name, help, labels))
+
+
+def gauge(name: str, help: str, labels: Labels = (), collect: Optional[Collect] = None,
+          kind: Optional[str] = None) -> Gauge:
+    """A gauge; with collect, values (or a running total, kind="counter") are read at scrape time."""
+    return _register(Gauge(name, help, labels, collect, kind))
+
+
+def histogram(name: str, help: str, labels: Labels = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def render() -> str:
+    """Every registered metric in the text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+
+HTTP_LATENCY = histogram("sms_http_request_duration_seconds", "HTTP request latency by route.",
+                         ("method", "route", "status"))
+
+
+class LatencyMiddleware:
+    """ASGI middleware observing HTTP_LATENCY per matched route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Templates, not raw paths, keep the label set bounded; static files are "other".
+            path = getattr(route, "path", None) or "other"
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], path, status[0] + "xx")
@@ -0,0 +1,100 @@
+"""Ordering, keyset cursors and top-k page selection for folder listings.
+
+Pages are picked with a bounded heap instead of sorting the whole folder, so
+the cost of an early page grows with per_page rather than folder size. Keyset
+cursors encode the sort key of the last row served; the next page is simply
+"the k rows after that key", which stays stable while files come and go.
+"""
+import base64
+import heapq
+import json
+from typing import Callable, Iterable, Optional
+
+from sms_parser import TYPED_FIELDS
+
+SORT_FIELDS = ("modified", "name", "size") + TYPED_FIELDS
+
+# Beyond this fraction of the folder a full sort is cheaper than a heap.
+HEAP_SELECT_RATIO = 0.25
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def sort_key(sort_by: str, reverse: bool) -> Callable[[dict], tuple]:
+    """Total order for entries; filename breaks ties so cursors are exact.
+
+    For optional status fields, entries lacking the field sort last in both
+    directions; unparseable raw strings are kept apart from typed values.
+    """
+    if sort_by == "name":
+        return lambda e: (e["filename"].lower(), e["filename"])
+    if sort_by == "size" or sort_by in TYPED_FIELDS:
+        missing_flag = (0, 1) if reverse else (1, 0)
+
+        def key(e):
+            value = e.get(sort_by)
+            if value is None:
+                return (missing_flag[0], False, 0, e["filename"])
+            return (missing_flag[1], isinstance(value, str), value, e["filename"])
+        return key
+    return lambda e: (e["modified"], e["filename"])
+
+
+def encode_cursor(sort_by: str, sort_order: str, key: tuple) -> str:
+    raw = json.dumps([sort_by, sort_order, list(key)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str, sort_order: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cur_sort, cur_order, key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if cur_sort != sort_by or cur_order != sort_order or not _valid_key(sort_by, key):
+        raise InvalidCursor(cursor)
+    return tuple(key)
+
+
+def _number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _valid_key(sort_by: str, key) -> bool:
+    """Whether key has the shape sort_key(sort_by) produces, so it compares with real keys."""
+    if not isinstance(key, list) or not key or not isinstance(key[-1], str):
+        return False
+    if sort_by == "name":
+        return len(key) == 2 and isinstance(key[0], str)
+    if sort_by == "size" or sort_by in TYPED_FIELDS:
+        if len(key) != 4 or key[0] not in (0, 1) or not isinstance(key[1], bool):
+            return False
+        # Typed values are strings, numbers or (report) booleans.
+        return isinstance(key[2], str) if key[1] else isinstance(key[2], (int, float))
+    return len(key) == 2 and _number(key[0])
+
+
+def select_page(entries: list[dict], key: Callable[[dict], tuple], reverse: bool,
+                offset: int, count: int, after: Optional[tuple] = None) -> list[dict]:
+    """Rows [offset, offset + count) of entries in key order, after a cursor key.
+
+    Uses heap selection (O(n log k) time, O(k) memory) unless the page lies
+    deep enough in the folder that a plain sort is cheaper.
+    """
+    rows: Iterable[dict] = entries
+    if after is not None:
+        if reverse:
+            rows = (e for e in entries if key(e) < after)
+        else:
+            rows = (e for e in entries if key(e) > after)
+
+    k = offset + count
+    if k > len(entries) * HEAP_SELECT_RATIO:
+        ordered = sorted(rows, key=key, reverse=reverse)
+    elif reverse:
+        ordered = heapq.nlargest(k, rows, key=key)
+    else:
+        ordered = heapq.nsmallest(k, rows, key=key)
+    return ordered[offset:k]
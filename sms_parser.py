@@ -0,0 +1,124 @@
+"""Parser for smstools message files.
+
+An smstools file is a block of "Name: value" header lines, one blank line,
+then the message body. The known status headers are also exposed as typed
+fields so listings can filter and sort on them without re-reading files.
+"""
+import codecs
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+PREVIEW_LENGTH = 120
+# Longest header block we are willing to scan before giving up on a file.
+MAX_HEADER_BYTES = 16 * 1024
+
+# smstools writes timestamps as "yy-mm-dd hh:mm:ss" in the modem's local time.
+SMSTOOLS_DATE_FORMAT = "%y-%m-%d %H:%M:%S"
+
+
+def _timestamp(value: str):
+    try:
+        return datetime.strptime(value, SMSTOOLS_DATE_FORMAT).isoformat()
+    except ValueError:
+        return value
+
+
+def _integer(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _yes_no(value: str):
+    lowered = value.lower()
+    if lowered in ("yes", "true", "on"):
+        return True
+    if lowered in ("no", "false", "off"):
+        return False
+    return value
+
+
+# header (lower-cased) -> (field name, converter)
+TYPED_HEADERS: dict[str, tuple[str, Callable[[str], object]]] = {
+    "sent": ("sent", _timestamp),
+    "received": ("received", _timestamp),
+    "modem": ("modem", str),
+    "message_id": ("message_id", _integer),
+    "fail_reason": ("fail_reason", str),
+    "alphabet": ("alphabet", str),
+    "report": ("report", _yes_no),
+}
+TYPED_FIELDS = tuple(name for name, _ in TYPED_HEADERS.values())
+
+
+def _split_header(line: str) -> Optional[tuple[str, str]]:
+    if ":" not in line:
+        return None
+    key, value = line.split(":", 1)
+    return key.strip(), value.strip()
+
+
+def typed_fields(headers: dict[str, str]) -> dict:
+    """Typed status fields for a header dict; absent headers map to None."""
+    fields = dict.fromkeys(TYPED_FIELDS)
+    for key, value in headers.items():
+        typed = TYPED_HEADERS.get(key.lower())
+        if typed:
+            name, convert = typed
+            fields[name] = convert(value)
+    return fields
+
+
+def phone_of(headers: dict[str, str]) -> str:
+    return headers.get("From") or headers.get("To") or ""
+
+
+def parse_sms(text: str) -> tuple[dict[str, str], str]:
+    """Split full smstools file text into (headers, body)."""
+    headers: dict[str, str] = {}
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped:
+            return headers, "\n".join(lines[i + 1:]).strip()
+        pair = _split_header(stripped)
+        if pair:
+            headers[pair[0]] = pair[1]
+    return headers, ""
+
+
+def read_sms_header(path: Path, preview_length: int = PREVIEW_LENGTH) -> tuple[dict[str, str], str]:
+    """Read only the header block and the start of the body.
+
+    Stops at the header/body boundary and then reads just enough of the body
+    for a preview, so listing large messages never reads them whole.
+    Returns (headers, preview).
+    """
+    headers: dict[str, str] = {}
+    consumed = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            consumed += len(raw)
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line:
+                break
+            pair = _split_header(line)
+            if pair:
+                headers[pair[0]] = pair[1]
+            if consumed > MAX_HEADER_BYTES:
+                return headers, ""
+        else:
+            return headers, ""
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        preview = ""
+        # Leading blank space is skipped, matching parse_sms()'s strip().
+        while len(preview) <= preview_length:
+            chunk = f.read(4 * preview_length)
+            if not chunk:
+                preview = (preview + decoder.decode(b"", final=True)).rstrip()
+                break
+            preview = (preview + decoder.decode(chunk)).lstrip()
+    return headers, preview[:preview_length]
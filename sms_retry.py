@@ -0,0 +1,323 @@
+"""Automatic re-sending of messages that land in failed/.
+
+Every new file in a root's failed/ folder is read once and classified by its
+Fail_reason header: reasons containing one of the configured substrings
+(modem timeouts, network errors, ...) are transient and are retried, others
+(unknown subscriber, blacklisted, ...) are permanent. A retry is a new file
+in the same root's outgoing/ carrying X-Retry (the attempt number) and
+X-Retry-Of (the failed file's name); the attempt count therefore travels with
+the message, and a message whose X-Retry reached max_attempts is given up.
+
+Attempt n waits base_delay * 2**(n-1) seconds, capped at max_delay, and all
+retries share a token bucket. When a root produced OUTAGE_FAILURES failures
+within OUTAGE_WINDOW seconds it is treated as down: due retries for it are
+pushed back by OUTAGE_WINDOW without spending an attempt, so a full modem
+outage turns into a pause rather than a retry storm. Retries for a root that
+is not attached (removed from the configuration) are parked the same way
+until it is.
+
+Decisions are kept in SQLite, so scheduled retries survive a restart and a
+failed file is never retried twice.
+"""
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Callable, Optional
+
+from rate_limit import TokenBucket
+from sms_index import FolderIndex
+from sms_parser import parse_sms
+from sms_search import _transaction
+
+RETRY_HEADER = "X-Retry"
+RETRY_OF_HEADER = "X-Retry-Of"
+OUTAGE_FAILURES = 20
+OUTAGE_WINDOW = 60.0
+# Finished decisions are kept this long for metrics and to avoid re-reading.
+RETENTION = 7 * 86400
+MAX_SLEEP = 5.0
+ERROR_WAIT = 1.0
+
+# write(root, [(phone, message, extra headers)]) -> spool filenames
+Write = Callable[[str, list[tuple[str, str, dict[str, str]]]], list[str]]
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS retries (
+    root TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    message TEXT NOT NULL,
+    reason TEXT,
+    attempt INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    due REAL,
+    retried_as TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (root, filename)
+);
+CREATE INDEX IF NOT EXISTS retries_state ON retries (state, updated);
+CREATE TABLE IF NOT EXISTS cursors (
+    root TEXT PRIMARY KEY,
+    modified REAL NOT NULL
+);
+"""
+
+STATES = ("pending", "retried", "permanent", "exhausted")
+
+
+class RetryEngine:
+    """Classifies failed messages and re-queues the transient ones with backoff."""
+
+    def __init__(self, db_path: str, write: Write, max_attempts: int = 3, base_delay: float = 60,
+                 max_delay: float = 3600, reasons: tuple[str, ...] = (), rate: float = 1.0):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._write = write
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.reasons = tuple(r.lower() for r in reasons)
+        self._bucket = TokenBucket(rate, max(rate, 1.0)) if rate > 0 else None
+        self._cond = threading.Condition()
+        self._folders: dict[str, Path] = {}
+        self._new: deque[tuple[str, str]] = deque()
+        self._failures: dict[str, deque] = defaultdict(deque)
+        self._heap: list[tuple[float, str, str]] = [
+            (due, root, filename) for root, filename, due in
+            self._db.execute("SELECT root, filename, due FROM retries WHERE state = 'pending'")]
+        heapq.heapify(self._heap)
+        self.deferred = 0
+        self._pruned_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def classify(self, reason: Optional[str]) -> bool:
+        """Whether a fail reason is worth retrying."""
+        reason = (reason or "").lower()
+        return any(r in reason for r in self.reasons)
+
+    def attach(self, index: FolderIndex, root: str):
+        """Follow a root's failed/ folder (idempotent), catching up on missed files."""
+        with self._cond:
+            if root in self._folders:
+                return
+            self._folders[root] = index.path
+            row = self._db.execute("SELECT modified FROM cursors WHERE root = ?", (root,)).fetchone()
+        entries = index.add_listener(lambda event: self._on_event(root, event), snapshot=True)
+        with self._cond:
+            if row is None:
+                # First start: leave the existing failures alone.
+                self._db.execute("INSERT OR IGNORE INTO cursors (root, modified) VALUES (?, ?)",
+                                 (root, time.time()))
+            else:
+                self._new.extend((root, e["filename"]) for e in entries if e["modified"] >= row[0])
+            self._cond.notify()
+
+    def _on_event(self, root: str, event: dict):
+        # Called under the index lock: only queue it.
+        if event["event"] == "new_file":
+            with self._cond:
+                self._new.append((root, event["file"]["filename"]))
+                self._failures[root].append(time.time())
+                self._cond.notify()
+
+    def outage(self, root: str) -> bool:
+        """Whether root failed OUTAGE_FAILURES messages within the last OUTAGE_WINDOW seconds."""
+        with self._cond:
+            recent = self._failures[root]
+            cutoff = time.time() - OUTAGE_WINDOW
+            while recent and recent[0] < cutoff:
+                recent.popleft()
+            return len(recent) >= OUTAGE_FAILURES
+
+    def metrics(self) -> dict:
+        """Decision counts by state and fail reason, plus outage deferrals."""
+        with self._cond:
+            states = dict(self._db.execute("SELECT state, COUNT(*) FROM retries GROUP BY state"))
+            reasons = dict(self._db.execute(
+                "SELECT coalesce(reason, 'unknown'), COUNT(*) FROM retries GROUP BY 1"))
+            roots = list(self._folders)
+        return {
+            **{state: states.get(state, 0) for state in STATES},
+            "deferred": self.deferred,
+            "reasons": reasons,
+            "outage": [root for root in roots if self.outage(root)],
+        }
+
+    # --- worker ---
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sms-retry", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                if not self._new:
+                    delay = self._heap[0][0] - time.time() if self._heap else MAX_SLEEP
+                    if delay > 0:
+                        self._cond.wait(min(delay, MAX_SLEEP))
+                        continue
+                new = list(self._new)
+                self._new.clear()
+            try:
+                if new:
+                    self._classify(new)
+                self._release_due()
+                self._prune()
+            except Exception:
+                # Disk or database trouble, or a bad row: keep the engine alive.
+                log.exception("retry engine cycle failed")
+                time.sleep(ERROR_WAIT)
+
+    def _classify(self, new: list[tuple[str, str]]):
+        now = time.time()
+        rows = []
+        for root, filename in new:
+            try:
+                text = (self._folders[root] / filename).read_text(encoding="utf-8", errors="replace")
+            except OSError:
+                continue
+            headers, body = parse_sms(text)
+            reason = headers.get("Fail_reason")
+            try:
+                attempt = int(headers.get(RETRY_HEADER, 0)) + 1
+            except ValueError:
+                attempt = 1
+            if not self.classify(reason) or not headers.get("To"):
+                state, due = "permanent", None
+            elif attempt > self.max_attempts:
+                state, due = "exhausted", None
+            else:
+                state = "pending"
+                due = now + min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            rows.append((root, filename, headers.get("To", ""), body, reason, attempt, state, due, now))
+        modified = {}
+        for root, filename in new:
+            try:
+                mtime = (self._folders[root] / filename).stat().st_mtime
+            except OSError:
+                continue
+            modified[root] = max(modified.get(root, 0.0), mtime)
+        with self._cond:
+            with _transaction(self._db):
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO retries (root, filename, phone, message, reason, attempt,"
+                    " state, due, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self._db.executemany(
+                    "INSERT INTO cursors (root, modified) VALUES (?, ?) ON CONFLICT (root)"
+                    " DO UPDATE SET modified = max(modified, excluded.modified)", list(modified.items()))
+            for root, filename, *_, state, due, _ in rows:
+                if state == "pending":
+                    heapq.heappush(self._heap, (due, root, filename))
+
+    def _release_due(self):
+        now = time.time()
+        due: dict[str, list[str]] = defaultdict(list)
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                _, root, filename = heapq.heappop(self._heap)
+                due[root].append(filename)
+        for root, filenames in due.items():
+            try:
+                self._release(root, filenames, now)
+            except Exception:
+                # Put this root's retries back; the other roots still go out.
+                log.exception("releasing retries for %s failed", root)
+                self._postpone(root, filenames, time.time() + ERROR_WAIT, persist=False)
+
+    def _release(self, root: str, filenames: list[str], now: float):
+        """Resend one root's due retries, or push them back; raises before pushing any back."""
+        with self._cond:
+            attached = root in self._folders
+        if not attached:
+            self._postpone(root, filenames, now + OUTAGE_WINDOW, persist=False)
+            return
+        if self.outage(root):
+            self._postpone(root, filenames, now + OUTAGE_WINDOW)
+            self.deferred += len(filenames)
+            return
+        n = self._bucket.take(len(filenames)) if self._bucket is not None else len(filenames)
+        if n:
+            self._resend(root, filenames[:n])
+        if n < len(filenames):
+            self._postpone(root, filenames[n:], now + self._bucket.wait_time(), persist=False)
+
+    def _postpone(self, root: str, filenames: list[str], due: float, persist: bool = True):
+        with self._cond:
+            if persist:
+                self._db.executemany("UPDATE retries SET due = ? WHERE root = ? AND filename = ?",
+                                     [(due, root, f) for f in filenames])
+            for filename in filenames:
+                heapq.heappush(self._heap, (due, root, filename))
+
+    def _resend(self, root: str, filenames: list[str]):
+        with self._cond:
+            marks = ",".join("?" * len(filenames))
+            rows = self._db.execute(
+                f"SELECT filename, phone, message, attempt FROM retries WHERE root = ? AND state = 'pending'"
+                f" AND filename IN ({marks})", [root, *filenames]).fetchall()
+        if not rows:
+            return
+        messages = [(phone, message, {RETRY_HEADER: str(attempt), RETRY_OF_HEADER: filename})
+                    for filename, phone, message, attempt in rows]
+        written = self._write(root, messages)
+        now = time.time()
+        with self._cond:
+            with _transaction(self._db):
+                self._db.executemany(
+                    "UPDATE retries SET state = 'retried', retried_as = ?, updated = ?"
+                    " WHERE root = ? AND filename = ?",
+                    [(new, now, root, row[0]) for new, row in zip(written, rows)])
+
+    def _prune(self):
+        now = time.time()
+        if now - self._pruned_at < 3600:
+            return
+        with self._cond:
+            self._db.execute("DELETE FROM retries WHERE state != 'pending' AND updated < ?",
+                             (now - RETENTION,))
+        self._pruned_at = now
+
+    def close(self):
+        self.stop()
+        with self._cond:
+            self._db.close()
+
+
+_engines: dict[str, RetryEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_retry_engine(db_path: str, write: Write, max_attempts: int = 3, base_delay: float = 60,
+                     max_delay: float = 3600, reasons: tuple[str, ...] = (),
+                     rate: float = 1.0) -> RetryEngine:
+    """Return the process-wide, running retry engine stored at db_path."""
+    key = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = RetryEngine(key, write, max_attempts, base_delay, max_delay,
+                                                 reasons, rate)
+            engine.start()
+        return engine
@@ -0,0 +1,238 @@
+"""Deferred sends: a durable store plus one heap-driven release thread.
+
+Scheduled messages are rows in a SQLite table, so they survive restarts; the
+process keeps only (send_at, id) pairs in a heap. A single thread sleeps until
+the earliest send_at and hands due messages to the release callback through a
+token bucket, so a backlog (many messages for the same minute, or everything
+that fell due while the process was down) drains at a controlled rate.
+
+Rows are deleted only after the release callback returned, so delivery into
+outgoing/ is at-least-once: a crash between the two re-releases those
+messages on the next start.
+"""
+import heapq
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from rate_limit import TokenBucket
+from sms_export import parse_time
+from sms_search import _transaction
+
+RELEASE_BATCH = 100
+# Longest single sleep, so a clock change is noticed within this many seconds.
+MAX_SLEEP = 60.0
+ERROR_WAIT = 1.0
+# Furthest in the future a message may be scheduled.
+MAX_AHEAD = 366 * 86400
+
+# release([(phone, message, root)]) puts messages into outgoing/; root is None
+# for messages the sender lets the balancer place.
+Release = Callable[[list[tuple[str, str, Optional[str]]]], object]
+
+
+def parse_send_at(value: Optional[str]) -> Optional[float]:
+    """Unix time to send at, or None to send now (absent or already past).
+
+    ValueError unless value is unix seconds or ISO 8601 no more than
+    MAX_AHEAD away, so nothing invalid is ever stored.
+    """
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"send_at must be a string: {value!r}")
+    when = parse_time(value)
+    if when is None:
+        return None
+    now = time.time()
+    if when > now + MAX_AHEAD:
+        raise ValueError(f"send_at more than {MAX_AHEAD}s ahead: {value!r}")
+    return when if when > now else None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled (
+    id TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    message TEXT NOT NULL,
+    root TEXT,
+    send_at REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduled_send_at ON scheduled (send_at);
+"""
+
+
+class Scheduler:
+    """Durable timer queue releasing messages at or after their send_at."""
+
+    def __init__(self, db_path: str, release: Optional[Release] = None, rate: float = 10,
+                 burst: float = 0):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self.release = release
+        self.rate = rate
+        self._bucket = TokenBucket(rate, burst or rate) if rate > 0 else None
+        self._cond = threading.Condition()
+        self._due: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._inflight: set[str] = set()
+        for id_, send_at in self._db.execute("SELECT id, send_at FROM scheduled"):
+            self._due[id_] = send_at
+            self._heap.append((send_at, id_))
+        heapq.heapify(self._heap)
+        self.released = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, messages: list[tuple[str, str, Optional[str], float]]) -> list[str]:
+        """Persist (phone, message, root, send_at) tuples; returns their ids."""
+        now = time.time()
+        rows = [(uuid.uuid4().hex, phone, message, root, send_at, now)
+                for phone, message, root, send_at in messages]
+        with self._cond:
+            with _transaction(self._db):
+                self._db.executemany(
+                    "INSERT INTO scheduled (id, phone, message, root, send_at, created)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", rows)
+            for id_, _, _, _, send_at, _ in rows:
+                self._due[id_] = send_at
+                heapq.heappush(self._heap, (send_at, id_))
+            self._cond.notify()
+        return [row[0] for row in rows]
+
+    def cancel(self, id_: str) -> bool:
+        """Drop a scheduled message; False if unknown or already being released."""
+        with self._cond:
+            if id_ not in self._due or id_ in self._inflight:
+                return False
+            self._db.execute("DELETE FROM scheduled WHERE id = ?", (id_,))
+            # The heap entry goes stale and is skipped when it surfaces.
+            del self._due[id_]
+            return True
+
+    def pending(self, limit: int = 100, offset: int = 0) -> list[dict]:
+        """Scheduled messages, earliest first."""
+        with self._cond:
+            rows = self._db.execute(
+                "SELECT id, phone, message, root, send_at, created FROM scheduled"
+                " ORDER BY send_at, id LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        keys = ("id", "phone", "message", "root", "send_at", "created")
+        return [dict(zip(keys, row)) for row in rows]
+
+    # --- release ---
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sms-scheduler", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                delay = self._next_delay()
+                if delay is None or self.release is None:
+                    self._cond.wait(MAX_SLEEP)
+                    continue
+                if delay > 0:
+                    self._cond.wait(min(delay, MAX_SLEEP))
+                    continue
+            n = RELEASE_BATCH
+            if self._bucket is not None:
+                n = self._bucket.take(n)
+                if not n:
+                    time.sleep(self._bucket.wait_time())
+                    continue
+            batch = self._pop_due(n)
+            if self._bucket is not None and len(batch) < n:
+                self._bucket.give(n - len(batch))
+            if batch:
+                self._release(batch)
+
+    def _next_delay(self) -> Optional[float]:
+        """Seconds until the earliest live entry is due (holds _cond)."""
+        while self._heap:
+            send_at, id_ = self._heap[0]
+            if self._due.get(id_) == send_at and id_ not in self._inflight:
+                return send_at - time.time()
+            heapq.heappop(self._heap)
+        return None
+
+    def _pop_due(self, n: int) -> list[tuple[str, float]]:
+        batch = []
+        now = time.time()
+        with self._cond:
+            while len(batch) < n and self._heap and self._heap[0][0] <= now:
+                send_at, id_ = heapq.heappop(self._heap)
+                if self._due.get(id_) == send_at and id_ not in self._inflight:
+                    self._inflight.add(id_)
+                    batch.append((id_, send_at))
+        return batch
+
+    def _release(self, batch: list[tuple[str, float]]):
+        ids = [id_ for id_, _ in batch]
+        marks = ",".join("?" * len(ids))
+        try:
+            with self._cond:
+                rows = self._db.execute(
+                    f"SELECT id, phone, message, root FROM scheduled WHERE id IN ({marks})", ids).fetchall()
+            by_id = {row[0]: row[1:] for row in rows}
+            self.release([by_id[id_] for id_ in ids if id_ in by_id])
+        except Exception:
+            # Put them back and try again shortly.
+            with self._cond:
+                for id_, send_at in batch:
+                    self._inflight.discard(id_)
+                    heapq.heappush(self._heap, (send_at, id_))
+            time.sleep(ERROR_WAIT)
+            return
+        with self._cond:
+            self._db.execute(f"DELETE FROM scheduled WHERE id IN ({marks})", ids)
+            for id_ in ids:
+                self._inflight.discard(id_)
+                self._due.pop(id_, None)
+            self.released += len(ids)
+
+    def close(self):
+        self.stop()
+        with self._cond:
+            self._db.close()
+
+
+_schedulers: dict[str, Scheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(db_path: str, release: Optional[Release] = None, rate: float = 10,
+                  burst: float = 0) -> Scheduler:
+    """Return the process-wide, running scheduler stored at db_path.
+
+    The first caller that passes release wires it in; until then due
+    messages simply wait.
+    """
+    key = os.path.abspath(db_path)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = Scheduler(key, release, rate, burst)
+            scheduler.start()
+        elif release is not None and scheduler.release is None:
+            scheduler.release = release
+            with scheduler._cond:
+                scheduler._cond.notify()
+        return scheduler
@@ -0,0 +1,184 @@
+"""Full-text search over spool messages, backed by SQLite FTS5.
+
+The on-disk index covers filename, phone, headers and body of every message
+and is maintained incrementally from folder index change events. A trigram
+tokenizer gives case-insensitive substring matching, the same semantics the
+filename filter always had, for queries of three or more characters.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+from sms_index import FolderIndex
+
+# FTS5's trigram tokenizer cannot match shorter queries.
+MIN_QUERY_LENGTH = 3
+FLUSH_INTERVAL = 0.5
+
+LoadMessage = Callable[[Path], tuple[dict[str, str], str]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_files (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    modified REAL NOT NULL,
+    size INTEGER NOT NULL,
+    UNIQUE (folder, filename)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS sms_fts USING fts5(
+    filename, phone, headers, body, tokenize = 'trigram'
+);
+"""
+
+
+class SearchIndex:
+    """SQLite FTS5 index of the messages in a set of spool folders."""
+
+    def __init__(self, db_path: str, load_message: LoadMessage):
+        self.db_path = db_path
+        self._load_message = load_message
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._pending: deque = deque()
+        self._indexes: dict[str, FolderIndex] = {}
+        self._reconciled: set[str] = set()
+        self._flusher: Optional[threading.Thread] = None
+
+    # --- wiring ---
+
+    def attach(self, index: FolderIndex):
+        """Follow a folder index's change events (idempotent)."""
+        with self._lock:
+            if index.folder in self._indexes:
+                return
+            self._indexes[index.folder] = index
+            index.add_listener(self._pending.append)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="sms-search", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                # Keep following changes; the next reconcile repairs any gap.
+                self._reconciled.clear()
+
+    # --- writes ---
+
+    def flush(self):
+        """Apply every queued change event in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            with _transaction(self._db):
+                while self._pending:
+                    event = self._pending.popleft()
+                    folder = event["folder"]
+                    if event["event"] == "removed_file":
+                        self._delete(folder, event["filename"])
+                    else:
+                        self._index_entry(self._indexes[folder], event["file"])
+
+    def reconcile(self, index: FolderIndex):
+        """Bring the stored rows for one folder in line with its index.
+
+        Only files whose (modified, size) differ from the stored row are
+        re-read, so after a restart the cost is proportional to what changed.
+        """
+        index.refresh()
+        entries = {e["filename"]: e for e in index.entries()}
+        with self._lock:
+            stored = {
+                name: (modified, size)
+                for name, modified, size in self._db.execute(
+                    "SELECT filename, modified, size FROM sms_files WHERE folder = ?", (index.folder,))
+            }
+            with _transaction(self._db):
+                for name in stored.keys() - entries.keys():
+                    self._delete(index.folder, name)
+                for name, entry in entries.items():
+                    if stored.get(name) != (entry["modified"], entry["size"]):
+                        self._index_entry(index, entry)
+            self._reconciled.add(index.folder)
+
+    def _index_entry(self, index: FolderIndex, entry: dict):
+        name = entry["filename"]
+        try:
+            headers, body = self._load_message(index.path / name)
+        except OSError:
+            # Gone again before we got to it; the removal event follows.
+            return
+        self._delete(index.folder, name)
+        cur = self._db.execute(
+            "INSERT INTO sms_files (folder, filename, modified, size) VALUES (?, ?, ?, ?)",
+            (index.folder, name, entry["modified"], entry["size"]))
+        header_text = "\n".join(f"{k}: {v}" for k, v in headers.items())
+        self._db.execute(
+            "INSERT INTO sms_fts (rowid, filename, phone, headers, body) VALUES (?, ?, ?, ?, ?)",
+            (cur.lastrowid, name, entry.get("phone", ""), header_text, body))
+
+    def _delete(self, folder: str, name: str):
+        row = self._db.execute(
+            "SELECT id FROM sms_files WHERE folder = ? AND filename = ?", (folder, name)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM sms_fts WHERE rowid = ?", row)
+            self._db.execute("DELETE FROM sms_files WHERE id = ?", row)
+
+    # --- queries ---
+
+    def search(self, folder: str, query: str) -> list[str]:
+        """Filenames in a folder whose filename, phone, headers or body contain query."""
+        index = self._indexes[folder]
+        if folder not in self._reconciled:
+            self.reconcile(index)
+        else:
+            index.refresh()
+        self.flush()
+        phrase = '"' + query.replace('"', '""') + '"'
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT f.filename FROM sms_fts JOIN sms_files f ON f.id = sms_fts.rowid "
+                "WHERE sms_fts MATCH ? AND f.folder = ?", (phrase, folder)).fetchall()
+        return [name for (name,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+@contextmanager
+def _transaction(db: sqlite3.Connection):
+    db.execute("BEGIN")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+_search_indexes: dict[str, SearchIndex] = {}
+_search_lock = threading.Lock()
+
+
+def get_search_index(db_path: str, load_message: LoadMessage) -> SearchIndex:
+    """Return the process-wide search index stored at db_path."""
+    key = os.path.abspath(db_path)
+    with _search_lock:
+        index = _search_indexes.get(key)
+        if index is None:
+            index = _search_indexes[key] = SearchIndex(key, load_message)
+        return index
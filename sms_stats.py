@@ -0,0 +1,196 @@
+"""Delivery statistics maintained incrementally from folder change events.
+
+Nothing here ever rescans the spool: counters are seeded once from each
+folder index snapshot and then adjusted by every new/changed/removed event,
+so a stats query costs the same however many files the folders hold.
+
+Two kinds of numbers are kept:
+
+* population counters mirror what is currently in each folder, archived
+  messages included (file counts, per-modem, per-prefix, failure reasons,
+  top destinations);
+* arrival histograms count files entering a folder per minute (last hour)
+  and per hour (last day); they only grow, so archiving or deleting old
+  files does not rewrite history.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Iterable, Optional
+
+from sms_index import FolderIndex
+
+MINUTE_BUCKETS = 60
+HOUR_BUCKETS = 24
+PREFIX_LENGTH = 3
+TOP_DESTINATIONS = 10
+# How long a computed top-destinations list may be reused.
+TOP_CACHE_SECONDS = 5.0
+
+DELIVERY_FOLDERS = ("sent", "failed")
+FAILURE_WINDOWS = ("last_hour", "last_24h")
+
+
+def _prefix(phone: str) -> str:
+    return phone.lstrip("+")[:PREFIX_LENGTH]
+
+
+class _Histogram:
+    """Arrival counts in fixed-width time buckets, pruned past a horizon."""
+
+    def __init__(self, width: int, buckets: int):
+        self.width = width
+        self.buckets = buckets
+        self.counts: dict[int, int] = defaultdict(int)
+
+    def add(self, ts: float, now: float):
+        bucket = int(ts // self.width)
+        oldest = int(now // self.width) - self.buckets + 1
+        if bucket >= oldest:
+            self.counts[bucket] += 1
+        if len(self.counts) > self.buckets * 2:
+            for b in [b for b in self.counts if b < oldest]:
+                del self.counts[b]
+
+    def series(self, now: float) -> list[dict]:
+        current = int(now // self.width)
+        return [{"t": b * self.width, "count": self.counts.get(b, 0)}
+                for b in range(current - self.buckets + 1, current + 1)]
+
+    def total(self, now: float) -> int:
+        current = int(now // self.width)
+        return sum(self.counts.get(b, 0) for b in range(current - self.buckets + 1, current + 1))
+
+
+class StatsCollector:
+    """Counts and histograms for a set of spool folders."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._folders: set[str] = set()
+        self.counts: Counter = Counter()
+        self.per_minute: dict[str, _Histogram] = {}
+        self.per_hour: dict[str, _Histogram] = {}
+        self.modems: dict[str, Counter] = defaultdict(Counter)
+        self.prefixes: dict[str, Counter] = defaultdict(Counter)
+        self.fail_reasons: Counter = Counter()
+        self.destinations: Counter = Counter()
+        self._top_cache: tuple[float, list] = (0.0, [])
+
+    def attach(self, index: FolderIndex, archived: Optional[Callable[[], Iterable[dict]]] = None):
+        """Seed from the index snapshot and follow its changes (idempotent).
+
+        archived returns the entries already moved out of the folder into the
+        archive; it is only called on the first attach.
+        """
+        with self._lock:
+            if index.folder in self._folders:
+                return
+            self._folders.add(index.folder)
+            self.per_minute[index.folder] = _Histogram(60, MINUTE_BUCKETS)
+            self.per_hour[index.folder] = _Histogram(3600, HOUR_BUCKETS)
+        entries = index.add_listener(self._on_event, snapshot=True)
+        live = {entry["filename"] for entry in entries}
+        gone = [entry for entry in (archived() if archived else ()) if entry["filename"] not in live]
+        now = time.time()
+        with self._lock:
+            for entry in entries:
+                self._count(index.folder, entry, +1)
+                self._arrival(index.folder, entry["modified"], now)
+            for entry in gone:
+                self._count(index.folder, entry, +1)
+
+    # --- event handling ---
+
+    def _on_event(self, event: dict):
+        folder = event["folder"]
+        now = time.time()
+        with self._lock:
+            # Archived messages still count; only the file moved.
+            if event.get("archived"):
+                return
+            if event.get("previous"):
+                self._count(folder, event["previous"], -1)
+            if event["event"] != "removed_file":
+                self._count(folder, event["file"], +1)
+            if event["event"] == "new_file":
+                self._arrival(folder, now, now)
+
+    def _arrival(self, folder: str, ts: float, now: float):
+        self.per_minute[folder].add(ts, now)
+        self.per_hour[folder].add(ts, now)
+
+    def _count(self, folder: str, entry: dict, delta: int):
+        self.counts[folder] += delta
+        if folder not in DELIVERY_FOLDERS:
+            return
+        phone = entry.get("phone") or ""
+        self.modems[entry.get("modem") or "unknown"][folder] += delta
+        self.prefixes[_prefix(phone) or "unknown"][folder] += delta
+        if folder == "failed":
+            self.fail_reasons[entry.get("fail_reason") or "unknown"] += delta
+        elif phone:
+            self.destinations[phone] += delta
+
+    # --- queries ---
+
+    def _top_destinations(self, now: float) -> list[dict]:
+        cached_at, top = self._top_cache
+        if now - cached_at > TOP_CACHE_SECONDS:
+            top = [{"phone": p, "count": c}
+                   for p, c in self.destinations.most_common(TOP_DESTINATIONS) if c > 0]
+            self._top_cache = (now, top)
+        return top
+
+    def failure_rate(self, window: str = "last_hour") -> Optional[float]:
+        """Share of deliveries in the window that ended in failed/, or None without any."""
+        with self._lock:
+            return self._failure_rate(window, time.time())
+
+    def _failure_rate(self, window: str, now: float) -> Optional[float]:
+        hist = self.per_minute if window == "last_hour" else self.per_hour
+        sent = hist["sent"].total(now) if "sent" in hist else 0
+        failed = hist["failed"].total(now) if "failed" in hist else 0
+        return round(failed / (sent + failed), 4) if sent + failed else None
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            folders = {
+                folder: {
+                    "count": self.counts[folder],
+                    "per_minute": self.per_minute[folder].series(now),
+                    "per_hour": self.per_hour[folder].series(now),
+                }
+                for folder in sorted(self._folders)
+            }
+            return {
+                "generated_at": now,
+                "folders": folders,
+                "failure_rate": {window: self._failure_rate(window, now) for window in FAILURE_WINDOWS},
+                "fail_reasons": {r: c for r, c in self.fail_reasons.most_common() if c > 0},
+                "modems": {m: {f: c[f] for f in DELIVERY_FOLDERS}
+                           for m, c in sorted(self.modems.items()) if any(c.values())},
+                "prefixes": {p: {f: c[f] for f in DELIVERY_FOLDERS}
+                             for p, c in sorted(self.prefixes.items()) if any(c.values())},
+                "top_destinations": self._top_destinations(now),
+            }
+
+
+_collectors: dict[str, StatsCollector] = {}
+_collectors_lock = threading.Lock()
+
+
+def running_stats_collector(base_dir: str) -> Optional[StatsCollector]:
+    """The collector for a spool root if one was started, without starting it."""
+    with _collectors_lock:
+        return _collectors.get(base_dir)
+
+
+def get_stats_collector(base_dir: str) -> StatsCollector:
+    """Return the process-wide collector for a spool root."""
+    with _collectors_lock:
+        collector = _collectors.get(base_dir)
+        if collector is None:
+            collector = _collectors[base_dir] = StatsCollector()
+        return collector
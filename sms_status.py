@@ -0,0 +1,119 @@
+"""Delivery status of outgoing messages, maintained from folder change events.
+
+smstools moves each message file from outgoing/ to checked/ and then to sent/
+or failed/ under the same name. The tracker follows those moves through the
+folder indexes the watcher keeps live, so a status query is a dict lookup no
+matter how large the folders are. It is seeded once from each folder snapshot,
+with file mtimes standing in for the arrival times it did not see.
+
+Records of files that left every tracked folder (deleted, or archived out of
+sent/ and failed/, which the record then notes) are kept for the last
+GONE_MAX such files; older ones are answered by the caller's fallback (the
+archive catalogue).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sms_index import FolderIndex
+
+TRACKED_FOLDERS = ("outgoing", "checked", "sent", "failed")
+FINAL_FOLDERS = ("sent", "failed")
+GONE_MAX = 100000
+
+
+class StatusTracker:
+    """Current folder and move history of every message file in one spool root."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._folders: set[str] = set()
+        # filename -> {"folder", "entry", "history": [(folder, ts)]}
+        self._records: dict[str, dict] = {}
+        self._present: dict[str, set[str]] = {}
+        self._gone: OrderedDict[str, None] = OrderedDict()
+
+    def attach(self, index: FolderIndex):
+        """Seed from the index snapshot and follow its changes (idempotent)."""
+        with self._lock:
+            if index.folder in self._folders or index.folder not in TRACKED_FOLDERS:
+                return
+            self._folders.add(index.folder)
+        entries = index.add_listener(self._on_event, snapshot=True)
+        with self._lock:
+            for entry in entries:
+                self._arrive(index.folder, entry, entry["modified"])
+
+    def status(self, filename: str) -> Optional[dict]:
+        """Where a message file is now and where it has been, or None if unknown."""
+        with self._lock:
+            record = self._records.get(filename)
+            if record is None:
+                return None
+            folder, entry = record["folder"], record["entry"]
+            return {
+                "file": filename,
+                "state": folder,
+                "final": folder in FINAL_FOLDERS,
+                "fail_reason": entry.get("fail_reason") if folder == "failed" else None,
+                "modem": entry.get("modem"),
+                "present": bool(self._present.get(filename)),
+                "archived": record.get("archived", False),
+                "history": [{"folder": f, "at": ts} for f, ts in record["history"]],
+            }
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    # --- event handling ---
+
+    def _on_event(self, event: dict):
+        folder = event["folder"]
+        now = time.time()
+        with self._lock:
+            if event["event"] == "removed_file":
+                self._leave(folder, event["filename"], event.get("archived", False))
+            else:
+                self._arrive(folder, event["file"], now, moved=event["event"] == "new_file")
+
+    def _arrive(self, folder: str, entry: dict, ts: float, moved: bool = True):
+        name = entry["filename"]
+        record = self._records.get(name)
+        if record is None:
+            record = self._records[name] = {"folder": folder, "entry": entry, "history": []}
+        if moved:
+            record["history"].append((folder, ts))
+        record["folder"], record["entry"] = folder, entry
+        record.pop("archived", None)
+        self._present.setdefault(name, set()).add(folder)
+        self._gone.pop(name, None)
+
+    def _leave(self, folder: str, name: str, archived: bool = False):
+        present = self._present.get(name)
+        if present is None:
+            return
+        present.discard(folder)
+        if present:
+            return
+        # Either mid-move (the next folder's event follows) or gone for good.
+        del self._present[name]
+        if archived:
+            self._records[name]["archived"] = True
+        self._gone[name] = None
+        while len(self._gone) > GONE_MAX:
+            old, _ = self._gone.popitem(last=False)
+            del self._records[old]
+
+
+_trackers: dict[str, StatusTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_status_tracker(base_dir: str) -> StatusTracker:
+    """Return the process-wide tracker for a spool root."""
+    with _trackers_lock:
+        tracker = _trackers.get(base_dir)
+        if tracker is None:
+            tracker = _trackers[base_dir] = StatusTracker()
+        return tracker
@@ -0,0 +1,317 @@
+"""Process-wide watcher for the smstools spool folders.
+
+One background thread keeps every folder index current (inotify on Linux,
+directory polling elsewhere). Each change is computed once by the index and
+fanned out to all WebSocket subscribers, each with its own bounded queue.
+
+In a follower worker (see sms_cluster) the indexes are replicas fed by the
+primary worker, and the watcher only fans their events out.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from sms_index import FolderIndex
+from sms_metrics import histogram
+
+POLL_INTERVAL = 1.0
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Pause after a failed cycle (a transient OSError, a bug) before the next one.
+ERROR_WAIT = 1.0
+
+log = logging.getLogger(__name__)
+
+FANOUT_LAG = histogram("sms_event_fanout_lag_seconds",
+                       "Time from a folder change being broadcast to a WebSocket client taking it.")
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_ATTRIB catches mtime-only changes (touch, utime); chmod alone is a no-op
+# for the index since entries are keyed on (mtime, size).
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class _Inotify:
+    """Minimal ctypes binding to the Linux inotify API."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self) -> list[tuple[int, int, str]]:
+        """Return pending (wd, mask, name) events without blocking."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Subscription:
+    """A WebSocket client's view of the change stream.
+
+    Events are queued on the subscriber's own event loop. When a client falls
+    more than SUBSCRIBER_QUEUE_SIZE events behind it is marked overflowed
+    instead of buffering without bound; the caller should drop the connection.
+    """
+
+    def __init__(self, watchers: list["SpoolWatcher"], maxsize: int):
+        self._watchers = watchers
+        self._loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+        # perf_counter() at broadcast of each queued event, for FANOUT_LAG.
+        self._published: deque[float] = deque()
+
+    def _offer(self, event: dict, published: float):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+            self._published.append(published)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self._published.clear()
+            # Wake the consumer so it notices the overflow promptly.
+            self.queue.put_nowait(None)
+
+    def publish(self, event: dict):
+        try:
+            self._loop.call_soon_threadsafe(self._offer, event, time.perf_counter())
+        except RuntimeError:
+            # Event loop already closed; the client is gone.
+            self.close()
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, or None on timeout or overflow."""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event is not None and self._published:
+            FANOUT_LAG.observe(time.perf_counter() - self._published.popleft())
+        return event
+
+    def close(self):
+        for watcher in self._watchers:
+            watcher.unsubscribe(self)
+
+
+class SpoolWatcher:
+    """Keeps a set of folder indexes live and broadcasts their changes."""
+
+    def __init__(self, indexes: list[FolderIndex], root: Optional[str] = None):
+        self.indexes = {index.folder: index for index in indexes}
+        # Spool root name added to every broadcast event, when set.
+        self.root = root
+        self.backend: Optional[str] = None
+        # Indexes are kept live by the primary worker; start() watches nothing.
+        self.replicated = False
+        self._subscribers: set[Subscription] = set()
+        self._subs_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._inotify: Optional[_Inotify] = None
+        self._wds: dict[int, FolderIndex] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        for index in indexes:
+            index.add_listener(self._broadcast)
+
+    # --- lifecycle ---
+
+    def start(self):
+        """Start watching (idempotent). Blocks until every index is loaded."""
+        with self._start_lock:
+            if self._thread is not None or self.replicated:
+                return
+            if sys.platform.startswith("linux"):
+                try:
+                    self._inotify = _Inotify()
+                except (OSError, AttributeError):
+                    self._inotify = None
+            self.backend = "inotify" if self._inotify else "poll"
+            with self._read_lock:
+                self._attach_missing()
+            self._thread = threading.Thread(target=self._run, name="sms-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for index in self._wds.values():
+            index.live_sync = None
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def _attach_missing(self):
+        """Watch folders not yet watched, then load them (holds _read_lock).
+
+        The watch is added before the rescan so no change can slip between
+        the two; events queued meanwhile are re-applied idempotently.
+        """
+        watched = set(self._wds.values())
+        for index in self.indexes.values():
+            if index in watched:
+                continue
+            if self._inotify is not None:
+                try:
+                    wd = self._inotify.add_watch(str(index.path))
+                except OSError:
+                    continue
+                self._wds[wd] = index
+                index.rescan()
+                index.live_sync = self.sync
+            else:
+                index.rescan()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._cycle()
+            except Exception:
+                # Every index's live_sync points here: the thread must not die.
+                log.exception("spool watcher cycle failed")
+                self._stop.wait(ERROR_WAIT)
+
+    def _cycle(self):
+        if self._inotify is None:
+            for index in self.indexes.values():
+                index.refresh()
+            self._stop.wait(POLL_INTERVAL)
+            return
+        readable, _, _ = select.select([self._inotify.fd], [], [], POLL_INTERVAL)
+        if readable:
+            self.sync()
+        if len(self._wds) < len(self.indexes):
+            with self._read_lock:
+                self._attach_missing()
+
+    # --- inotify event handling ---
+
+    def sync(self):
+        """Apply every pending inotify event now.
+
+        Listings call this (through FolderIndex.refresh) so a file written
+        just before a request is visible to it without waiting for the thread.
+        """
+        with self._read_lock:
+            while True:
+                events = self._inotify.read()
+                if not events:
+                    return
+                for wd, mask, name in events:
+                    self._handle(wd, mask, name)
+
+    def _handle(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            for index in self._wds.values():
+                index.rescan()
+            return
+        index = self._wds.get(wd)
+        if index is None:
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+            # Folder itself went away; fall back to rescans until re-attached.
+            del self._wds[wd]
+            index.live_sync = None
+            index.rescan()
+            return
+        if name:
+            index.update(name)
+
+    # --- fan-out ---
+
+    def subscribe(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> Subscription:
+        """Register the calling event loop's client for change events."""
+        return subscribe([self], maxsize)
+
+    def unsubscribe(self, sub: Subscription):
+        with self._subs_lock:
+            self._subscribers.discard(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _broadcast(self, event: dict):
+        # Archived messages stay listed; clients must not drop them.
+        if event.get("archived"):
+            return
+        with self._subs_lock:
+            subscribers = list(self._subscribers)
+        if subscribers and self.root is not None:
+            event = {**event, "root": self.root}
+        for sub in subscribers:
+            sub.publish(event)
+
+
+def subscribe(watchers: list[SpoolWatcher], maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> Subscription:
+    """One client's merged view of the change streams of several watchers."""
+    sub = Subscription(watchers, maxsize)
+    for watcher in watchers:
+        with watcher._subs_lock:
+            watcher._subscribers.add(sub)
+    return sub
+
+
+_watchers: dict[str, SpoolWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def get_watcher(base_dir: str, indexes: list[FolderIndex], root: Optional[str] = None) -> SpoolWatcher:
+    """Return the process-wide watcher for a spool root, creating it on first use."""
+    key = os.path.abspath(base_dir)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            watcher = _watchers[key] = SpoolWatcher(indexes, root)
+        return watcher
@@ -0,0 +1,276 @@
+"""Outbound webhooks for new incoming messages and delivery outcomes.
+
+Events come from the same folder indexes the spool watcher keeps live for the
+dashboard WebSocket: every new file in a subscribed folder becomes one JSON
+event, shaped like the WebSocket's new_file events plus an id and the root.
+
+Events are written to a SQLite outbox before anything is sent, and deleted
+only once the endpoint answered 2xx, so delivery is at-least-once and
+survives restarts; receivers should dedup on the event id. Files that
+arrived while the gateway was down are picked up at the next start from each
+folder's newest delivered mtime.
+
+A pool of async workers shares one keep-alive HTTP client. Each POST carries
+up to batch_size events for one URL as {"events": [...]}, signed with
+HMAC-SHA256 of the body in X-Signature (secret may be a callable, read per
+batch, so a rotated key is used without a restart). A URL has at most one batch in flight
+and, while its oldest event is backing off, later ones wait behind it, so an
+endpoint sees events in order and a down endpoint is not hammered. A failed
+batch is retried after BACKOFF_BASE * 2**attempts seconds (with jitter),
+capped at BACKOFF_MAX.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Callable, Union
+
+import httpx
+
+from sms_index import FolderIndex
+from sms_search import _transaction
+
+POLL_INTERVAL = 0.5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 3600.0
+# Pause after an unexpected error (outbox trouble, a bug) before trying again.
+ERROR_WAIT = 5.0
+
+log = logging.getLogger(__name__)
+
+# (url, folders whose new files it receives)
+Hook = tuple[str, tuple[str, ...]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_at REAL NOT NULL,
+    UNIQUE (url, event_id)
+);
+CREATE INDEX IF NOT EXISTS outbox_url ON outbox (url, id);
+CREATE TABLE IF NOT EXISTS cursors (
+    root TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    modified REAL NOT NULL,
+    PRIMARY KEY (root, folder)
+);
+"""
+
+
+def event_id(root: str, folder: str, entry: dict) -> str:
+    raw = f"{root}/{folder}/{entry['filename']}/{entry['modified']}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+class WebhookDispatcher:
+    """Persistent outbox of folder events plus the workers that deliver it."""
+
+    def __init__(self, db_path: str, hooks: list[Hook], secret: Union[str, Callable[[], str]],
+                 workers: int = 4, batch_size: int = 50, timeout: float = 10.0):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self.hooks = hooks
+        self._secret = secret
+        self.workers = workers
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._attached: set[tuple[str, str]] = set()
+        self._pending: deque[tuple[str, str, dict]] = deque()
+        self._busy: set[str] = set()
+        self.delivered = 0
+        self.failures = 0
+
+    @property
+    def folders(self) -> set[str]:
+        return {folder for _, folders in self.hooks for folder in folders}
+
+    def attach(self, index: FolderIndex, root: str):
+        """Follow a folder's new files (idempotent), catching up on missed ones."""
+        if index.folder not in self.folders:
+            return
+        with self._lock:
+            if (root, index.folder) in self._attached:
+                return
+            self._attached.add((root, index.folder))
+            row = self._db.execute("SELECT modified FROM cursors WHERE root = ? AND folder = ?",
+                                   (root, index.folder)).fetchone()
+        entries = index.add_listener(lambda event: self._on_event(root, event), snapshot=True)
+        if row is None:
+            # First start: only files from now on, not the whole history.
+            with self._lock:
+                self._db.execute("INSERT OR IGNORE INTO cursors (root, folder, modified) VALUES (?, ?, ?)",
+                                 (root, index.folder, time.time()))
+        else:
+            self._pending.extend((root, index.folder, e) for e in entries if e["modified"] >= row[0])
+
+    def _on_event(self, root: str, event: dict):
+        # Called under the index lock: only queue it.
+        if event["event"] == "new_file":
+            self._pending.append((root, event["folder"], event["file"]))
+
+    def __len__(self) -> int:
+        """Events waiting in the outbox."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    # --- outbox ---
+
+    def flush(self) -> int:
+        """Move queued folder events into the outbox; returns the rows added."""
+        batch = []
+        while self._pending:
+            batch.append(self._pending.popleft())
+        if not batch:
+            return 0
+        now = time.time()
+        rows, cursors = [], {}
+        for root, folder, entry in batch:
+            eid = event_id(root, folder, entry)
+            payload = json.dumps({"id": eid, "event": "new_file", "root": root, "folder": folder,
+                                  "file": entry})
+            rows += [(url, eid, payload, now) for url, folders in self.hooks if folder in folders]
+            key = (root, folder)
+            cursors[key] = max(cursors.get(key, 0.0), entry["modified"])
+        with self._lock:
+            with _transaction(self._db):
+                before = self._db.total_changes
+                self._db.executemany("INSERT OR IGNORE INTO outbox (url, event_id, payload, next_at)"
+                                     " VALUES (?, ?, ?, ?)", rows)
+                added = self._db.total_changes - before
+                self._db.executemany(
+                    "INSERT INTO cursors (root, folder, modified) VALUES (?, ?, ?)"
+                    " ON CONFLICT (root, folder) DO UPDATE SET modified = max(modified, excluded.modified)",
+                    [(root, folder, modified) for (root, folder), modified in cursors.items()])
+        return added
+
+    def claim(self) -> list[tuple[str, list[tuple[int, str, int]]]]:
+        """Due (url, [(row id, payload, attempts)]) batches for URLs with nothing in flight."""
+        now = time.time()
+        with self._lock:
+            heads = self._db.execute(
+                "SELECT url, next_at FROM outbox WHERE id IN (SELECT MIN(id) FROM outbox GROUP BY url)")
+            urls = [url for url, next_at in heads if next_at <= now and url not in self._busy]
+            batches = []
+            for url in urls[:self.workers]:
+                rows = self._db.execute(
+                    "SELECT id, payload, attempts FROM outbox WHERE url = ? ORDER BY id LIMIT ?",
+                    (url, self.batch_size)).fetchall()
+                if rows:
+                    self._busy.add(url)
+                    batches.append((url, rows))
+            return batches
+
+    def settle(self, url: str, rows: list[tuple[int, str, int]], ok: bool):
+        """Delete a delivered batch, or schedule its retry."""
+        ids = [row[0] for row in rows]
+        with self._lock:
+            with _transaction(self._db):
+                if ok:
+                    self._db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+                    self.delivered += len(ids)
+                else:
+                    attempts = max(row[2] for row in rows) + 1
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                    self._db.executemany("UPDATE outbox SET attempts = ?, next_at = ? WHERE id = ?",
+                                         [(attempts, time.time() + delay, i) for i in ids])
+                    self.failures += 1
+            self._busy.discard(url)
+
+    def unclaim(self, url: str):
+        """Free a claimed URL whose batch was not settled."""
+        with self._lock:
+            self._busy.discard(url)
+
+    # --- delivery ---
+
+    async def run(self):
+        """Deliver the outbox until cancelled."""
+        limits = httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            workers = [asyncio.create_task(self._worker(client, queue)) for _ in range(self.workers)]
+            try:
+                while True:
+                    try:
+                        await asyncio.to_thread(self.flush)
+                        batches = await asyncio.to_thread(self.claim)
+                    except Exception:
+                        log.exception("webhook outbox cycle failed")
+                        await asyncio.sleep(ERROR_WAIT)
+                        continue
+                    for batch in batches:
+                        await queue.put(batch)
+                    if not batches:
+                        await asyncio.sleep(POLL_INTERVAL)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self, client: httpx.AsyncClient, queue: asyncio.Queue):
+        while True:
+            url, rows = await queue.get()
+            settled = False
+            try:
+                try:
+                    ok = await self._post(client, url, [payload for _, payload, _ in rows])
+                except Exception:
+                    # Not a transport error (e.g. an invalid URL): back off like a failed POST.
+                    log.exception("webhook delivery to %s failed", url)
+                    ok = False
+                await asyncio.to_thread(self.settle, url, rows, ok)
+                settled = True
+            except Exception:
+                # The outcome could not be recorded: hold the URL a while before a new claim.
+                log.exception("settling webhook batch for %s failed", url)
+                await asyncio.sleep(ERROR_WAIT)
+            finally:
+                # settle() freed the URL; otherwise (also when shutting down, the
+                # rows staying due) free it off the loop, as _lock guards SQLite work.
+                if not settled:
+                    await asyncio.to_thread(self.unclaim, url)
+
+    async def _post(self, client: httpx.AsyncClient, url: str, payloads: list[str]) -> bool:
+        body = ('{"events": [' + ",".join(payloads) + "]}").encode("utf-8")
+        secret = self._secret() if callable(self._secret) else self._secret
+        signature = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        try:
+            resp = await client.post(url, content=body, headers={
+                "Content-Type": "application/json", "X-Signature": f"sha256={signature}"})
+        except httpx.HTTPError:
+            return False
+        return 200 <= resp.status_code < 300
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_dispatchers: dict[str, WebhookDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_webhook_dispatcher(db_path: str, hooks: list[Hook], secret: Union[str, Callable[[], str]],
+                           workers: int = 4, batch_size: int = 50) -> WebhookDispatcher:
+    """Return the process-wide dispatcher whose outbox is at db_path."""
+    key = os.path.abspath(db_path)
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(key)
+        if dispatcher is None:
+            dispatcher = _dispatchers[key] = WebhookDispatcher(key, hooks, secret, workers, batch_size)
+        return dispatcher
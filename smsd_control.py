@@ -0,0 +1,138 @@
+"""smsd service control and log tailing on asyncio subprocesses.
+
+Output is yielded line by line as the child writes it, without holding a
+thread. When the generator is closed or cancelled (the client went away) the
+child is killed, so no restart or tail outlives its request.
+"""
+import asyncio
+from collections import deque
+from contextlib import suppress
+from typing import AsyncIterator, Optional
+
+SERVICE = "smstools"
+STATUS_TIMEOUT = 10.0
+RESTART_TIMEOUT = 30.0
+# Longest line read as one; longer output is passed on in pieces.
+MAX_LINE = 64 * 1024
+TAIL_LINES = 100
+# Lines held for a client that reads slower than the log grows; older ones are dropped.
+TAIL_BUFFER = 1000
+
+
+class Command:
+    """One child process; lines() streams its merged stdout and stderr."""
+
+    def __init__(self, *argv: str, timeout: Optional[float] = None):
+        self.argv = argv
+        self.timeout = timeout
+        self.returncode: Optional[int] = None
+
+    async def lines(self) -> AsyncIterator[str]:
+        """Output lines as written; a failure to start or a timeout is reported as a line."""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *self.argv, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT, limit=MAX_LINE)
+        except OSError as e:
+            yield f"Error running {self.argv[0]}: {e}\n"
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout if self.timeout is not None else None
+        try:
+            while True:
+                remaining = deadline - loop.time() if deadline is not None else None
+                try:
+                    line = await asyncio.wait_for(_readline(proc.stdout), remaining)
+                    if not line:
+                        # Let it exit by itself: killing an exited child races its reaping.
+                        remaining = deadline - loop.time() if deadline is not None else None
+                        await asyncio.wait_for(proc.wait(), remaining)
+                        break
+                except asyncio.TimeoutError:
+                    yield f">> {self.argv[0]} timed out after {self.timeout:g}s\n"
+                    break
+                yield line.decode("utf-8", errors="replace")
+        finally:
+            if proc.returncode is None:
+                with suppress(ProcessLookupError):
+                    proc.kill()
+            self.returncode = await proc.wait()
+
+
+async def _readline(stream: asyncio.StreamReader) -> bytes:
+    try:
+        return await stream.readline()
+    except ValueError:
+        # Over MAX_LINE: hand on what is buffered.
+        return await stream.read(MAX_LINE)
+
+
+async def restart() -> AsyncIterator[str]:
+    """Status, restart and status again of the smsd service, as a progress log."""
+    yield ">> Checking smsd status...\n"
+    async for line in Command("sudo", "systemctl", "status", SERVICE, timeout=STATUS_TIMEOUT).lines():
+        yield line
+
+    yield ">> Restarting smsd...\n"
+    command = Command("sudo", "systemctl", "restart", SERVICE, timeout=RESTART_TIMEOUT)
+    async for line in command.lines():
+        yield line
+    if command.returncode == 0:
+        yield ">> smsd restarted successfully\n"
+    else:
+        yield f">> Restart failed (code {command.returncode})\n"
+
+    yield "\n>> Verifying smsd status...\n"
+    async for line in Command("sudo", "systemctl", "status", SERVICE, timeout=STATUS_TIMEOUT).lines():
+        yield line
+
+
+def tail_command(log_path: str, lines: int = TAIL_LINES) -> Command:
+    """Follow log_path, or smsd's journal when log_path is empty."""
+    if log_path:
+        return Command("tail", "-n", str(lines), "-F", log_path)
+    return Command("journalctl", "-u", SERVICE, "-n", str(lines), "-f", "-o", "short-iso", "--no-pager")
+
+
+async def tail(command: Command, buffer: int = TAIL_BUFFER) -> AsyncIterator[str]:
+    """Lines of a never-ending command, holding at most buffer of them for a slow reader.
+
+    The child is always read at full speed; when the reader falls behind, the
+    oldest held lines are dropped and a note says how many.
+    """
+    held: deque[str] = deque()
+    dropped = 0
+    ready = asyncio.Event()
+    finished = False
+
+    async def pump():
+        nonlocal dropped, finished
+        try:
+            async for line in command.lines():
+                if len(held) >= buffer:
+                    held.popleft()
+                    dropped += 1
+                held.append(line)
+                ready.set()
+        finally:
+            finished = True
+            ready.set()
+
+    reader = asyncio.create_task(pump())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if dropped:
+                yield f">> {dropped} lines dropped\n"
+                dropped = 0
+            chunk = "".join(held)
+            held.clear()
+            if chunk:
+                yield chunk
+            if finished and not held:
+                return
+    finally:
+        reader.cancel()
+        with suppress(asyncio.CancelledError):
+            await reader
@@ -0,0 +1,101 @@
+"""Placement of outgoing messages across several smstools spool roots.
+
+Each root is an smsd instance (usually one box of modems) with a weight and
+an optional outgoing capacity. A message goes to the root with the lowest
+load score:
+
+    (outgoing depth + backlog) / weight * (1 + FAILURE_PENALTY * failure rate)
+
+Roots whose outgoing/ is at capacity are only used when every root is full.
+Depths are counted at most every DEPTH_REFRESH seconds and advanced locally
+for each placement in between; failure rates come from a caller-supplied
+function and are refreshed every FAILURE_REFRESH seconds.
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+from spool_writer import count_spool_files
+
+DEPTH_REFRESH = 0.5
+FAILURE_REFRESH = 30.0
+# A root failing every message counts as (1 + FAILURE_PENALTY) times as loaded.
+FAILURE_PENALTY = 4.0
+
+# (name, outgoing dir, weight, capacity)
+Root = tuple[str, str, float, int]
+
+
+class RootBalancer:
+    """Picks the least-loaded spool root for each outgoing message."""
+
+    def __init__(self, roots: list[Root],
+                 failure_rate: Optional[Callable[[str], Optional[float]]] = None,
+                 backlog: Optional[Callable[[str], int]] = None):
+        self.roots = roots
+        self._failure_rate = failure_rate
+        self._backlog = backlog
+        self._lock = threading.Lock()
+        self._depths: dict[str, int] = {}
+        self._depths_at = 0.0
+        self._failures: dict[str, float] = {}
+        self._failures_at = 0.0
+
+    def place(self, count: int = 1) -> list[Root]:
+        """The root for each of count messages, in order."""
+        if len(self.roots) == 1:
+            return self.roots * count
+        self._refresh()
+        with self._lock:
+            placed = []
+            for _ in range(count):
+                root = min(self.roots, key=self._score)
+                self._depths[root[0]] += 1
+                placed.append(root)
+            return placed
+
+    def _score(self, root: Root) -> tuple:
+        name, _, weight, capacity = root
+        depth = self._depths[name]
+        load = depth / max(weight, 1e-9) * (1 + FAILURE_PENALTY * self._failures.get(name, 0.0))
+        return (capacity > 0 and depth >= capacity, load)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._depths_at > DEPTH_REFRESH:
+            depths = {}
+            for name, outgoing, _, _ in self.roots:
+                depths[name] = count_spool_files(outgoing)
+                if self._backlog is not None:
+                    depths[name] += self._backlog(name)
+            with self._lock:
+                self._depths, self._depths_at = depths, now
+        if self._failure_rate is not None and now - self._failures_at > FAILURE_REFRESH:
+            failures = {}
+            for name, *_ in self.roots:
+                rate = self._failure_rate(name)
+                failures[name] = rate if rate is not None else 0.0
+            with self._lock:
+                self._failures, self._failures_at = failures, now
+
+    def loads(self) -> dict[str, dict]:
+        """Current depth and failure rate per root, as used for placement."""
+        self._refresh()
+        with self._lock:
+            return {name: {"depth": self._depths.get(name, 0), "failure_rate": self._failures.get(name),
+                           "weight": weight, "capacity": capacity}
+                    for name, _, weight, capacity in self.roots}
+
+
+_balancers: dict[tuple, RootBalancer] = {}
+_balancers_lock = threading.Lock()
+
+
+def get_balancer(roots: list[Root], failure_rate=None, backlog=None) -> RootBalancer:
+    """Return the process-wide balancer for a set of roots."""
+    key = tuple(roots)
+    with _balancers_lock:
+        balancer = _balancers.get(key)
+        if balancer is None:
+            balancer = _balancers[key] = RootBalancer(roots, failure_rate, backlog)
+        return balancer
@@ -0,0 +1,206 @@
+"""Collision-free, atomic writer for the smstools outgoing spool.
+
+Files are written under a hidden temporary name (smsd and the admin listing
+both skip dotfiles) and renamed into place, so smsd never picks up a partial
+message. Durability is selected per writer:
+
+    off     no fsync; fastest, a crash may lose recently queued messages
+    always  fsync every file and the directory before returning
+    batch   group commit: writers arriving within FSYNC_WINDOW share one
+            filesystem sync and one directory fsync
+"""
+import ctypes
+import ctypes.util
+import itertools
+import os
+import re
+import secrets
+import threading
+import time
+from typing import Optional
+
+from sms_metrics import counter, histogram
+
+FSYNC_MODES = ("off", "always", "batch")
+FSYNC_WINDOW = 0.005
+
+_UNSAFE_NAME_CHARS = re.compile(r"[^0-9A-Za-z+]")
+
+SPOOL_WRITE = histogram("sms_spool_write_seconds", "Time to write one batch into outgoing/, syncs included.",
+                        ("fsync",))
+SPOOL_FILES = counter("sms_spool_files_written_total", "Messages written into outgoing/.")
+
+
+def format_sms(phone: str, message: str, headers: Optional[dict[str, str]] = None) -> str:
+    extra = "".join(f"{k}: {v}\n" for k, v in (headers or {}).items())
+    return f"To: {phone}\n{extra}\n{message}\n"
+
+
+try:
+    _syncfs_fn = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6").syncfs
+except (OSError, AttributeError):
+    _syncfs_fn = None
+
+
+def _syncfs(fd: int):
+    """Flush every dirty page of the filesystem holding fd (one syscall)."""
+    if _syncfs_fn is None or _syncfs_fn(fd) != 0:
+        os.sync()
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def count_spool_files(directory: str) -> int:
+    """Number of visible (non-temporary) files in a spool directory."""
+    try:
+        with os.scandir(directory) as it:
+            return sum(1 for de in it if not de.name.startswith("."))
+    except FileNotFoundError:
+        return 0
+
+
+class _Batch:
+    def __init__(self):
+        self.renames: list[tuple[str, str]] = []
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class _GroupCommit:
+    """Shares one sync among all writers that arrive within a short window.
+
+    The first writer of a batch becomes its leader: it waits FSYNC_WINDOW,
+    syncs the data of every temp file in the batch at once, performs the
+    renames and fsyncs the directory. Followers just wait for the result.
+    """
+
+    def __init__(self, directory: str, window: float):
+        self._dir = directory
+        self._window = window
+        self._lock = threading.Lock()
+        self._batch: Optional[_Batch] = None
+
+    def commit(self, renames: list[tuple[str, str]]):
+        with self._lock:
+            leader = self._batch is None
+            if leader:
+                self._batch = _Batch()
+            batch = self._batch
+            batch.renames.extend(renames)
+
+        if leader:
+            time.sleep(self._window)
+            with self._lock:
+                self._batch = None
+            try:
+                fd = os.open(self._dir, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    _syncfs(fd)
+                    for tmp, final in batch.renames:
+                        os.rename(tmp, final)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except BaseException as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+
+class SpoolWriter:
+    """Writes outgoing messages with unique names and atomic visibility."""
+
+    def __init__(self, outgoing_dir: str, fsync: str = "off", fsync_window: float = FSYNC_WINDOW):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"Invalid fsync mode {fsync!r}. Allowed: {FSYNC_MODES}")
+        self.outgoing_dir = outgoing_dir
+        self.fsync = fsync
+        # Random start: other worker processes write to the same directory.
+        self._seq = itertools.count(secrets.randbelow(0x10000))
+        self._group = _GroupCommit(outgoing_dir, fsync_window) if fsync == "batch" else None
+
+    def new_filename(self, phone: str) -> str:
+        """sms_<unix microseconds>_<sequence><random>_<phone>.sms"""
+        ts = time.time_ns() // 1000
+        seq = next(self._seq) & 0xFFFF
+        safe_phone = _UNSAFE_NAME_CHARS.sub("", phone)
+        return f"sms_{ts}_{seq:04x}{secrets.token_hex(2)}_{safe_phone}.sms"
+
+    def write(self, phone: str, message: str) -> str:
+        """Queue one message; returns its spool filename."""
+        return self.write_many([(phone, message)])[0]
+
+    def write_many(self, messages: list[tuple[str, str]],
+                   filenames: Optional[list[str]] = None,
+                   headers: Optional[list[dict[str, str]]] = None) -> list[str]:
+        """Queue several messages with at most one sync for the whole batch.
+
+        filenames, when given, are names handed out earlier by new_filename();
+        headers, when given, are extra header lines for each message.
+        """
+        if not messages:
+            return []
+        with SPOOL_WRITE.time(self.fsync):
+            filenames = self._write_many(messages, filenames, headers)
+        SPOOL_FILES.inc(amount=len(filenames))
+        return filenames
+
+    def _write_many(self, messages: list[tuple[str, str]], filenames: Optional[list[str]],
+                    headers: Optional[list[dict[str, str]]]) -> list[str]:
+        names = iter(filenames) if filenames is not None else None
+        extra = iter(headers) if headers is not None else None
+        filenames = []
+        renames = []
+        try:
+            for phone, message in messages:
+                filename = next(names) if names is not None else self.new_filename(phone)
+                final = os.path.join(self.outgoing_dir, filename)
+                tmp = os.path.join(self.outgoing_dir, f".{filename}.tmp")
+                renames.append((tmp, final))
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(format_sms(phone, message, next(extra) if extra is not None else None))
+                    if self.fsync == "always":
+                        f.flush()
+                        os.fsync(f.fileno())
+                filenames.append(filename)
+
+            if self._group is not None:
+                self._group.commit(renames)
+            else:
+                for tmp, final in renames:
+                    os.rename(tmp, final)
+                if self.fsync == "always":
+                    _fsync_dir(self.outgoing_dir)
+        except BaseException:
+            for tmp, _ in renames:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+            raise
+        return filenames
+
+
+_writers: dict[str, SpoolWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_spool_writer(outgoing_dir: str, fsync: str = "off") -> SpoolWriter:
+    """Return the process-wide writer for an outgoing directory."""
+    key = os.path.abspath(outgoing_dir)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = SpoolWriter(key, fsync)
+        return writer
@@ -8,7 +8,8 @@ import pytest
 _tmp_dir = tempfile.mkdtemp()
 _conf_path = os.path.join(_tmp_dir, "passkey.conf")
 with open(_conf_path, "w") as f:
-    f.write("SECRET_KEY=test_secret\nADMIN_KEY=test_admin\n")
+    f.write("SECRET_KEY=test_secret\nADMIN_KEY=test_admin\nMETRICS_TOKEN=test_metrics\n")
+    f.write(f"STATE_DIR={os.path.join(_tmp_dir, 'state')}\n")
 os.environ["PASSKEY_CONF"] = _conf_path
 
 # Create temp SMS directories
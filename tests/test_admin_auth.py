@@ -32,3 +32,19 @@ def test_protected_endpoint_invalid_token(client):
 def test_protected_endpoint_valid_token(client, auth_headers):
     resp = client.get("/admin/api/sms/sent", headers=auth_headers)
     assert resp.status_code == 200
+
+
+def test_token_survives_secret_rotation(client, monkeypatch, tmp_path):
+    import config
+    conf = tmp_path / "passkey.conf"
+    conf.write_text("SECRET_KEY=test_secret\nADMIN_KEY=test_admin\n")
+    monkeypatch.setattr(config, "CONFIG_PATH", str(conf))
+    config.reload()
+    token = client.post("/admin/login", data={"admin_key": "test_admin"}).json()["token"]
+    conf.write_text("SECRET_KEY=rotated\nADMIN_KEY=new_admin\n")
+    config.reload()
+
+    resp = client.get("/admin/api/sms/sent", headers={"Authorization": f"Bearer {token}"})
+    assert resp.status_code == 200
+    assert client.post("/admin/login", data={"admin_key": "test_admin"}).status_code == 403
+    assert client.post("/admin/login", data={"admin_key": "new_admin"}).status_code == 200
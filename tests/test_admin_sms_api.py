@@ -120,3 +120,220 @@ def test_file_entry_has_required_fields(client, auth_headers):
     assert "size" in f
     assert "modified" in f
     assert "modified_iso" in f
+
+
+# --- Send test SMS ---
+
+def test_send_test_sms_writes_outgoing(client, auth_headers):
+    resp = client.post("/admin/api/send-test-sms",
+                       data={"phone": "0907777777", "message": "Admin test"}, headers=auth_headers)
+    assert resp.status_code == 200
+    filename = resp.json()["file"]
+    path = os.path.join(SMS_TMP_DIR, "outgoing", filename)
+    with open(path) as f:
+        assert f.read() == "To: 0907777777\n\nAdmin test\n"
+
+
+# --- Parsed status fields ---
+
+def test_list_exposes_status_fields(client, auth_headers):
+    _create_sms_file("checked", "fields_a.sms",
+                     "To: 0901234567\nModem: GSM1\nSent: 24-02-20 10:00:00\nMessage_id: 7\n\nHi")
+    _create_sms_file("checked", "fields_b.sms",
+                     "To: 0901234567\nModem: GSM2\nSent: 24-02-21 10:00:00\n\nHi")
+    resp = client.get("/admin/api/sms/checked?sort_by=sent&sort_order=asc", headers=auth_headers)
+    files = [f for f in resp.json()["files"] if f["filename"].startswith("fields_")]
+    assert [f["filename"] for f in files] == ["fields_a.sms", "fields_b.sms"]
+    assert files[0]["modem"] == "GSM1"
+    assert files[0]["sent"] == "2024-02-20T10:00:00"
+    assert files[0]["message_id"] == 7
+
+    resp = client.get("/admin/api/sms/checked?modem=GSM2", headers=auth_headers)
+    assert [f["filename"] for f in resp.json()["files"]] == ["fields_b.sms"]
+
+
+def test_read_exposes_headers_and_body(client, auth_headers):
+    content = "From: 0908888888\nReceived: 24-02-20 09:00:00\n\nIncoming body"
+    _create_sms_file("incoming", "detail_fields.sms", content)
+    data = client.get("/admin/api/sms/incoming/detail_fields.sms", headers=auth_headers).json()
+    assert data["content"] == content
+    assert data["headers"] == {"From": "0908888888", "Received": "24-02-20 09:00:00"}
+    assert data["body"] == "Incoming body"
+    assert data["phone"] == "0908888888"
+    assert data["received"] == "2024-02-20T09:00:00"
+
+
+def test_search_by_body_and_phone(client, auth_headers):
+    _create_sms_file("incoming", "search_body.sms", "From: 0911222333\n\nYour parcel has shipped")
+    _create_sms_file("incoming", "search_other.sms", "From: 0900000000\n\nUnrelated")
+    resp = client.get("/admin/api/sms/incoming?search=PARCEL", headers=auth_headers)
+    assert [f["filename"] for f in resp.json()["files"]] == ["search_body.sms"]
+    resp = client.get("/admin/api/sms/incoming?search=1222", headers=auth_headers)
+    assert [f["filename"] for f in resp.json()["files"]] == ["search_body.sms"]
+
+
+# --- Cursor pagination ---
+
+def test_cursor_pagination(client, auth_headers):
+    for i in range(5):
+        _create_sms_file("checked", f"cursor_{i}.sms")
+    url = "/admin/api/sms/checked?sort_by=name&sort_order=asc&per_page=2&search=cursor_"
+    seen = []
+    data = client.get(url, headers=auth_headers).json()
+    while True:
+        seen.extend(f["filename"] for f in data["files"])
+        if not data["next_cursor"]:
+            break
+        data = client.get(f"{url}&cursor={data['next_cursor']}", headers=auth_headers).json()
+    assert seen == [f"cursor_{i}.sms" for i in range(5)]
+
+
+def test_invalid_cursor(client, auth_headers):
+    resp = client.get("/admin/api/sms/checked?cursor=garbage", headers=auth_headers)
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == "INVALID_CURSOR"
+
+    from sms_paging import encode_cursor
+    mistyped = encode_cursor("modified", "desc", ("x", "y"))
+    resp = client.get(f"/admin/api/sms/checked?cursor={mistyped}", headers=auth_headers)
+    assert resp.status_code == 400
+
+
+# --- Stats ---
+
+def test_stats_endpoint(client, auth_headers):
+    _create_sms_file("failed", "stats_failed.sms", "To: 0901234567\nFail_reason: Timeout\n\nHi")
+    resp = client.get("/admin/api/stats", headers=auth_headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert set(data["folders"]) == {"checked", "failed", "incoming", "outgoing", "sent"}
+    assert data["fail_reasons"].get("Timeout", 0) >= 1
+
+
+def test_stats_requires_auth(client):
+    assert client.get("/admin/api/stats").status_code in (401, 403)
+
+
+# --- Archive ---
+
+def test_archived_messages_stay_visible(client, auth_headers):
+    old = _create_sms_file("failed", "arch_old.sms", "To: 0907777777\n\nArchived kumquat")
+    ts = time.time() - 5 * 86400
+    os.utime(old, (ts, ts))
+    client.get("/admin/api/sms/failed", headers=auth_headers)
+    before = client.get("/admin/api/stats", headers=auth_headers).json()
+
+    resp = client.post("/admin/api/archive/compact?older_than_days=1", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.json()["archived"]["failed"] == 1
+    assert not os.path.exists(old)
+
+    # Archiving moves the file; it still counts.
+    after = client.get("/admin/api/stats", headers=auth_headers).json()
+    assert after["folders"]["failed"]["count"] == before["folders"]["failed"]["count"]
+    assert after["fail_reasons"] == before["fail_reasons"]
+
+    names = {f["filename"]: f for f in client.get(
+        "/admin/api/sms/failed?per_page=200", headers=auth_headers).json()["files"]}
+    assert names["arch_old.sms"]["archived"] is True
+
+    detail = client.get("/admin/api/sms/failed/arch_old.sms", headers=auth_headers).json()
+    assert detail["body"] == "Archived kumquat"
+    assert detail["archived"] is True
+
+    found = client.get("/admin/api/sms/failed?search=kumquat", headers=auth_headers).json()
+    assert [f["filename"] for f in found["files"]] == ["arch_old.sms"]
+
+    # Archived but not yet unlinked: listed and counted once, as the live file.
+    total = client.get("/admin/api/sms/failed", headers=auth_headers).json()["total"]
+    _create_sms_file("failed", "arch_old.sms", "To: 0907777777\n\nArchived kumquat")
+    os.utime(old, (ts, ts))
+    listing = client.get("/admin/api/sms/failed?per_page=200", headers=auth_headers).json()
+    assert listing["total"] == total
+    assert [f.get("archived") for f in listing["files"] if f["filename"] == "arch_old.sms"] == [None]
+
+
+def test_compact_requires_age_when_disabled(client, auth_headers):
+    resp = client.post("/admin/api/archive/compact", headers=auth_headers)
+    assert resp.status_code == 400
+
+
+# --- Multiple spool roots ---
+
+def test_second_root_is_merged(client, auth_headers, monkeypatch, tmp_path):
+    import importlib
+    admin_routes = importlib.import_module("admin-routes")
+    second = tmp_path / "box2"
+    for folder in ("checked", "failed", "incoming", "outgoing", "sent"):
+        (second / folder).mkdir(parents=True)
+    monkeypatch.setattr(admin_routes, "SMS_ROOTS",
+                        [("main", SMS_TMP_DIR, 1.0, 0), ("box2", str(second), 1.0, 0)])
+    _create_sms_file("incoming", "root_main.sms")
+    (second / "incoming" / "root_box2.sms").write_text("From: 0908888888\n\nFrom box two")
+
+    data = client.get("/admin/api/sms/incoming?per_page=200", headers=auth_headers).json()
+    roots = {f["filename"]: f["root"] for f in data["files"]}
+    assert roots["root_main.sms"] == "main"
+    assert roots["root_box2.sms"] == "box2"
+
+    detail = client.get("/admin/api/sms/incoming/root_box2.sms", headers=auth_headers).json()
+    assert detail["root"] == "box2"
+    assert detail["body"] == "From box two"
+    resp = client.get("/admin/api/sms/incoming/root_box2.sms?root=main", headers=auth_headers)
+    assert resp.status_code == 404
+    resp = client.get("/admin/api/stats?root=nope", headers=auth_headers)
+    assert resp.status_code == 400
+
+    resp = client.post("/admin/api/send-test-sms", headers=auth_headers,
+                       data={"phone": "0908888888", "message": "hi", "root": "box2"})
+    assert resp.json()["root"] == "box2"
+    assert (second / "outgoing" / resp.json()["file"]).exists()
+
+
+def test_scheduled_list_and_cancel(client, auth_headers):
+    send_at = str(time.time() + 30 * 86400)
+    resp = client.post("/admin/api/send-test-sms", headers=auth_headers,
+                       data={"phone": "0907777777", "message": "future", "send_at": send_at})
+    assert resp.json()["status"] == "SCHEDULED"
+    schedule_id = resp.json()["id"]
+
+    items = client.get("/admin/api/scheduled", headers=auth_headers).json()["items"]
+    item = next(i for i in items if i["id"] == schedule_id)
+    assert item["phone"] == "0907777777" and item["root"] == "main"
+
+    assert client.delete(f"/admin/api/scheduled/{schedule_id}", headers=auth_headers).status_code == 200
+    assert client.delete(f"/admin/api/scheduled/{schedule_id}", headers=auth_headers).status_code == 404
+
+    for bad in ("nan", str(time.time() + 400 * 86400)):
+        resp = client.post("/admin/api/send-test-sms", headers=auth_headers,
+                           data={"phone": "0907777777", "message": "future", "send_at": bad})
+        assert resp.status_code == 400 and resp.json()["detail"] == "INVALID_SEND_AT"
+
+
+# --- Conditional GET ---
+
+def test_listing_etag_holds_until_folder_changes(client, auth_headers):
+    _create_sms_file("incoming", "etag_a.sms")
+    etag = client.get("/admin/api/sms/incoming", headers=auth_headers).headers["etag"]
+    conditional = {**auth_headers, "If-None-Match": etag}
+    resp = client.get("/admin/api/sms/incoming", headers=conditional)
+    assert resp.status_code == 304
+    assert resp.content == b""
+    _create_sms_file("incoming", "etag_b.sms")
+    resp = client.get("/admin/api/sms/incoming", headers=conditional)
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
+
+
+def test_read_file_etag_follows_file(client, auth_headers):
+    path = _create_sms_file("incoming", "etag_detail.sms")
+    client.get("/admin/api/sms/incoming", headers=auth_headers)
+    url = "/admin/api/sms/incoming/etag_detail.sms"
+    etag = client.get(url, headers=auth_headers).headers["etag"]
+    conditional = {**auth_headers, "If-None-Match": etag}
+    assert client.get(url, headers=conditional).status_code == 304
+    with open(path, "a") as f:
+        f.write(" again")
+    resp = client.get(url, headers=conditional)
+    assert resp.status_code == 200
+    assert resp.json()["body"].endswith("again")
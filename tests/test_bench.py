@@ -0,0 +1,42 @@
+"""Tests for the synthetic spool generator used by the benchmarks."""
+import os
+
+from bench.spool_gen import FOLDERS, generate
+from sms_parser import parse_sms
+
+
+def _tree(base):
+    return {folder: sorted(os.listdir(os.path.join(base, folder))) for folder in FOLDERS}
+
+
+def test_generate_counts_per_folder(tmp_path):
+    written = generate(str(tmp_path), 500)
+    assert sum(written.values()) == 500
+    for folder, n in written.items():
+        assert len(os.listdir(tmp_path / folder)) == n
+    assert written["sent"] > written["outgoing"]
+
+
+def test_generate_grows_in_steps_without_collisions(tmp_path):
+    generate(str(tmp_path), 200, mix={"sent": 1.0})
+    generate(str(tmp_path), 300, mix={"sent": 1.0}, start=200)
+    assert len(os.listdir(tmp_path / "sent")) == 500
+
+
+def test_same_seed_same_messages(tmp_path):
+    generate(str(tmp_path / "a"), 100, seed=7)
+    generate(str(tmp_path / "b"), 100, seed=7)
+    a, b = _tree(tmp_path / "a"), _tree(tmp_path / "b")
+    assert [len(v) for v in a.values()] == [len(v) for v in b.values()]
+    # Names differ only in the timestamp, which is relative to the run.
+    assert sorted(n.split("_", 2)[2] for n in a["sent"]) == sorted(n.split("_", 2)[2] for n in b["sent"])
+
+
+def test_generated_files_parse_like_smsd_files(tmp_path):
+    generate(str(tmp_path), 200)
+    for name in os.listdir(tmp_path / "failed"):
+        headers, body = parse_sms((tmp_path / "failed" / name).read_text())
+        assert headers["To"] and headers["Fail_reason"] and body
+    for name in os.listdir(tmp_path / "incoming"):
+        headers, _ = parse_sms((tmp_path / "incoming" / name).read_text())
+        assert headers["From"].startswith("84")
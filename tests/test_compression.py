@@ -0,0 +1,61 @@
+"""Tests for response compression and static asset caching."""
+import asyncio
+import os
+import zlib
+from pathlib import Path
+
+import pytest
+
+import compression
+from compression import CompressionMiddleware, choose_encoding
+from tests.conftest import SMS_TMP_DIR
+
+
+def test_choose_encoding(monkeypatch):
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("") is None
+    monkeypatch.setattr(compression, "brotli", None)
+    assert choose_encoding("br, gzip") == "gzip"
+
+
+def test_stream_is_flushed_per_chunk():
+    chunks = [b"line %d\n" % i * 100 for i in range(3)]
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain")]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app)(scope, None, send))
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+    # Every chunk decodes as soon as it arrives.
+    decoder = zlib.decompressobj(31)
+    assert [decoder.decompress(m["body"]) for m in sent[1:]] == chunks
+
+
+def test_large_listing_is_compressed(client, auth_headers):
+    for i in range(30):
+        with open(os.path.join(SMS_TMP_DIR, "outgoing", f"gz_{i:02d}.sms"), "w") as f:
+            f.write("To: 0901234567\n\nHello")
+    resp = client.get("/admin/api/sms/outgoing", headers={**auth_headers, "Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["etag"].startswith('W/"')
+    assert "Accept-Encoding" in resp.headers["vary"]
+    assert len(resp.json()["files"]) >= 30
+
+
+def test_hashed_assets_are_immutable(client):
+    assets = Path(__file__).parent.parent / "static" / "assets"
+    if not assets.is_dir():
+        pytest.skip("frontend not built")
+    name = next(p.name for p in assets.iterdir() if p.is_file())
+    assert "immutable" in client.get(f"/assets/{name}").headers["cache-control"]
+    assert client.get("/").headers["cache-control"] == "no-cache"
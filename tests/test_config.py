@@ -1,6 +1,7 @@
 """Tests for config.py loading."""
 import os
 import tempfile
+import time
 from importlib import reload
 
 import config
@@ -34,3 +35,121 @@ def test_load_secret():
 
 def test_load_admin_key():
     assert config.load_admin_key() == "test_admin"
+
+
+def test_load_spool_fsync_defaults_to_off():
+    assert config.load_spool_fsync() == "off"
+
+
+def test_load_workers_defaults_to_one():
+    assert config.load_workers() == 1
+
+
+def test_load_io_workers_defaults():
+    assert config.load_io_workers() == (8, 4)
+
+
+def test_load_cache_limits_defaults():
+    assert config.load_cache_limits() == (10000, 32 * 1024 * 1024)
+
+
+def test_load_archive_settings_defaults():
+    assert config.load_archive_settings() == (0.0, ("sent", "failed", "checked"), 3600.0)
+
+
+def test_load_send_limits_defaults():
+    assert config.load_rate_limits() == (0.0, 0.0, 0.0, 0.0)
+    assert config.load_send_queue() == ("direct", 0, 100000)
+
+
+def test_load_sms_roots(monkeypatch):
+    monkeypatch.setattr(config, "_load_config", lambda: {
+        "SMS_ROOTS": "east:/var/spool/sms:2:500, west:/mnt/west/sms"})
+    assert config.load_sms_roots() == [("east", "/var/spool/sms", 2.0, 500),
+                                       ("west", "/mnt/west/sms", 1.0, 0)]
+    assert config.load_sms_base_dir() == "/var/spool/sms"
+
+
+def test_load_sms_roots_defaults_to_base_dir(monkeypatch):
+    monkeypatch.setattr(config, "_load_config", lambda: {"SMS_BASE_DIR": "/srv/sms"})
+    assert config.load_sms_roots() == [("main", "/srv/sms", 1.0, 0)]
+
+
+def test_load_schedule_rate_defaults():
+    assert config.load_schedule_rate() == (10.0, 10.0)
+
+
+def test_load_dedup_settings_defaults():
+    assert config.load_dedup_settings() == (86400.0, 0.0, 100000)
+
+
+def test_load_retry_policy_defaults_to_off():
+    max_attempts, base, cap, reasons, rate = config.load_retry_policy()
+    assert (max_attempts, base, cap, rate) == (0, 60.0, 3600.0, 1.0)
+    assert "timeout" in reasons
+
+
+def _conf(path, secret, admin="admin", extra=""):
+    path.write_text(f"SECRET_KEY={secret}\nADMIN_KEY={admin}\n{extra}")
+    # Let the stamp change even on coarse-mtime filesystems.
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000 * len(secret)))
+
+
+def test_config_is_parsed_once(tmp_path, monkeypatch):
+    conf = tmp_path / "passkey.conf"
+    _conf(conf, "one")
+    monkeypatch.setattr(config, "CONFIG_PATH", str(conf))
+    assert config.load_secret() == "one"
+    conf.unlink()
+    # Nothing re-reads the file until a reload.
+    assert config.load_secret() == "one"
+    assert config.load_admin_key() == "admin"
+
+
+def test_reload_keeps_old_secret_during_overlap(tmp_path, monkeypatch):
+    conf = tmp_path / "passkey.conf"
+    _conf(conf, "old")
+    monkeypatch.setattr(config, "CONFIG_PATH", str(conf))
+    assert config.current().secrets() == ["old"]
+    _conf(conf, "new", extra="SECRET_OVERLAP=60\n")
+    cfg = config.reload()
+    assert cfg.secret_key == "new"
+    assert cfg.secrets() == ["new", "old"]
+    assert cfg.secrets(now=time.time() + 61) == ["new"]
+
+
+def test_reload_survives_malformed_overlap(tmp_path, monkeypatch):
+    conf = tmp_path / "passkey.conf"
+    _conf(conf, "old")
+    monkeypatch.setattr(config, "CONFIG_PATH", str(conf))
+    config.current()
+    _conf(conf, "new", extra="SECRET_OVERLAP=5m\n")
+    cfg = config.reload()
+    assert cfg.secret_overlap == config.DEFAULT_SECRET_OVERLAP
+    assert cfg.secrets() == ["new", "old"]
+    assert cfg.secrets(now=time.time() + config.DEFAULT_SECRET_OVERLAP + 1) == ["new"]
+
+
+def test_reload_rejects_file_without_keys(tmp_path, monkeypatch):
+    conf = tmp_path / "passkey.conf"
+    _conf(conf, "good")
+    monkeypatch.setattr(config, "CONFIG_PATH", str(conf))
+    before = config.current()
+    conf.write_text("ADMIN_KEY=admin\n")
+    assert config.reload() is before
+    conf.unlink()
+    assert config.reload() is before
+
+
+def test_watcher_reloads_changed_file(tmp_path, monkeypatch):
+    conf = tmp_path / "passkey.conf"
+    _conf(conf, "first")
+    monkeypatch.setattr(config, "CONFIG_PATH", str(conf))
+    monkeypatch.setattr(config, "_watcher", None)
+    assert config.load_secret() == "first"
+    config.start_watcher(interval=0.05)
+    _conf(conf, "second")
+    deadline = time.time() + 5
+    while config.load_secret() != "second" and time.time() < deadline:
+        time.sleep(0.02)
+    assert config.current().secrets() == ["second", "first"]
@@ -0,0 +1,38 @@
+"""Tests for the separate send/admin I/O executors."""
+import asyncio
+import threading
+import time
+
+import executors
+
+
+def test_send_path_not_blocked_by_saturated_admin_pool():
+    release = threading.Event()
+
+    async def scenario():
+        blockers = [asyncio.ensure_future(executors.run_admin(release.wait, 5))
+                    for _ in range(executors.ADMIN_WORKERS + 2)]
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        result = await executors.run_send(lambda: "sent")
+        elapsed = time.monotonic() - start
+        release.set()
+        await asyncio.gather(*blockers)
+        return result, elapsed
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == "sent"
+    assert elapsed < 0.5
+
+
+def test_exceptions_propagate():
+    def boom():
+        raise ValueError("boom")
+
+    async def scenario():
+        try:
+            await executors.run_admin(boom)
+        except ValueError as e:
+            return str(e)
+
+    assert asyncio.run(scenario()) == "boom"
@@ -0,0 +1,36 @@
+"""Tests for token-bucket admission control."""
+from rate_limit import RateLimiter, TokenBucket
+
+
+def test_bucket_grants_up_to_burst_then_refills(monkeypatch):
+    import rate_limit
+    now = [100.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=2, burst=3)
+    assert bucket.take(5) == 3
+    assert bucket.take() == 0
+    assert bucket.wait_time() == 0.5
+    now[0] += 1.0
+    assert bucket.take(5) == 2
+
+
+def test_global_shortfall_refunds_caller_tokens():
+    limiter = RateLimiter(rate=0.001, burst=1, caller_rate=0.001, caller_burst=5)
+    assert limiter.acquire("a", 3) == 1
+    # The two tokens the global bucket refused went back to the caller.
+    assert limiter.acquire("a", 5, include_global=False) == 4
+
+
+def test_unlimited_by_default():
+    limiter = RateLimiter()
+    assert limiter.acquire("a", 1000) == 1000
+    assert limiter.retry_after("a") == 0.0
+
+
+def test_shared_buckets_span_connections(tmp_path):
+    from rate_limit import SharedBuckets
+    path = str(tmp_path / "rl.sqlite")
+    one, two = SharedBuckets(path), SharedBuckets(path)
+    assert RateLimiter(0.001, 3, shared=one).acquire("a", 2) == 2
+    # Another worker's limiter draws on the same global bucket.
+    assert RateLimiter(0.001, 3, shared=two).acquire("b", 2) == 1
@@ -0,0 +1,58 @@
+"""Tests for the queued send mode."""
+import os
+import time
+
+import pytest
+
+import send_queue
+from send_queue import QueueFull, SendQueue
+from spool_writer import SpoolWriter
+
+
+def _wait(cond, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _visible(path):
+    return [n for n in os.listdir(path) if not n.startswith(".")]
+
+
+def test_queue_holds_outgoing_under_high_water(monkeypatch, tmp_path):
+    monkeypatch.setattr(send_queue, "DEPTH_REFRESH", 0)
+    monkeypatch.setattr(send_queue, "IDLE_WAIT", 0.01)
+    queue = SendQueue(SpoolWriter(str(tmp_path)), high_water=3)
+    queue.submit([("0901234567", f"m{i}") for i in range(5)])
+    queue.start()
+    try:
+        assert _wait(lambda: len(_visible(tmp_path)) == 3)
+        time.sleep(0.05)
+        assert len(_visible(tmp_path)) == 3
+        # smsd picks two files up; the queue refills to the mark.
+        for name in _visible(tmp_path)[:2]:
+            os.unlink(tmp_path / name)
+        assert _wait(lambda: len(queue) == 0)
+        assert len(_visible(tmp_path)) == 3
+    finally:
+        queue.stop()
+
+
+def test_submit_assigns_filenames_and_positions(tmp_path):
+    queue = SendQueue(SpoolWriter(str(tmp_path)), rate=2, max_size=3)
+    queued = queue.submit([("0901234567", "a"), ("0901234567", "b")])
+    assert [pos for _, pos in queued] == [1, 2]
+    assert all(f.endswith("_0901234567.sms") for f, _ in queued)
+    assert queue.eta(2) == 1.0
+    with pytest.raises(QueueFull):
+        queue.submit([("0901234567", "c"), ("0901234567", "d")])
+
+    queue.start()
+    try:
+        assert _wait(lambda: queue.written == 2)
+        assert sorted(_visible(tmp_path)) == sorted(f for f, _ in queued)
+    finally:
+        queue.stop()
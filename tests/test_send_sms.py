@@ -1,5 +1,6 @@
 """Tests for POST /send-sms endpoint."""
 import hashlib
+import time
 
 
 def _make_hash(phone, message, secret="test_secret"):
@@ -44,3 +45,319 @@ def test_send_sms_utf8_message(client):
     h = _make_hash(phone, msg)
     resp = client.post("/send-sms", data={"sdt": phone, "noidungtinnhan": msg, "hash": h})
     assert resp.status_code == 200
+
+
+# --- Batch ---
+
+def _item(phone, message, secret="test_secret"):
+    return {"sdt": phone, "noidungtinnhan": message, "hash": _make_hash(phone, message, secret)}
+
+
+def test_send_sms_batch_json(client):
+    items = [_item("0901234567", "Batch one"), _item("0901234567", "Batch two")]
+    resp = client.post("/send-sms/batch", json=items)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["accepted"] == 2
+    assert data["rejected"] == 0
+    files = [r["file"] for r in data["results"]]
+    assert len(set(files)) == 2
+    assert all("0901234567" in f for f in files)
+
+
+def test_send_sms_batch_ndjson(client):
+    import json
+    body = "\n".join(json.dumps(_item(p, "NDJSON")) for p in ("0901111111", "0902222222"))
+    resp = client.post("/send-sms/batch", content=body,
+                       headers={"Content-Type": "application/x-ndjson"})
+    assert resp.status_code == 200
+    assert resp.json()["accepted"] == 2
+
+
+def test_send_sms_batch_per_message_errors(client):
+    bad = _item("0903333333", "Bad")
+    bad["hash"] = "wrong"
+    items = [_item("0903333333", "Good"), bad, {"sdt": "0903333333"}]
+    data = client.post("/send-sms/batch", json=items).json()
+    assert data["accepted"] == 1
+    assert data["results"][0]["status"] == "OK"
+    assert data["results"][1] == {"index": 1, "status": "ERROR", "error": "INVALID_HASH"}
+    assert data["results"][2]["error"] == "MISSING_FIELDS"
+
+
+def test_send_sms_batch_invalid_body(client):
+    resp = client.post("/send-sms/batch", content="not json",
+                       headers={"Content-Type": "application/json"})
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == "INVALID_BODY"
+
+
+def test_batch_body_over_cap_is_refused_unread(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "BATCH_MAX_BYTES", 64)
+    items = [_item("0901234567", "x" * 100)]
+    resp = client.post("/send-sms/batch", json=items)
+    assert resp.status_code == 413
+    assert resp.json()["detail"] == "BATCH_TOO_LARGE"
+
+    # Without Content-Length the stream is cut off at the cap.
+    chunks = iter([b"[", b" " * 100, b"]"])
+    resp = client.post("/status/batch", content=chunks, headers={"Content-Type": "application/json"})
+    assert resp.status_code == 413
+
+
+# --- Rate limiting and queued mode ---
+
+def test_send_sms_rate_limited_per_caller(client, monkeypatch):
+    import main
+    from rate_limit import RateLimiter
+    monkeypatch.setattr(main, "RATE_LIMITER", RateLimiter(caller_rate=0.01, caller_burst=2))
+    data = {"sdt": "0904444444", "noidungtinnhan": "Limited", "hash": _make_hash("0904444444", "Limited")}
+    assert client.post("/send-sms", data=data).status_code == 200
+    assert client.post("/send-sms", data=data).status_code == 200
+    resp = client.post("/send-sms", data=data)
+    assert resp.status_code == 429
+    assert resp.json()["detail"] == "RATE_LIMITED"
+    assert int(resp.headers["retry-after"]) >= 1
+    # Another caller has its own bucket.
+    other = client.post("/send-sms", data=data, headers={"CF-Connecting-IP": "203.0.113.9"})
+    assert other.status_code == 200
+
+
+def test_send_sms_batch_partially_admitted(client, monkeypatch):
+    import main
+    from rate_limit import RateLimiter
+    monkeypatch.setattr(main, "RATE_LIMITER", RateLimiter(rate=0.01, burst=2))
+    items = [_item("0905555555", f"Burst {i}") for i in range(3)]
+    data = client.post("/send-sms/batch", json=items).json()
+    assert data["accepted"] == 2
+    assert data["results"][2] == {"index": 2, "status": "ERROR", "error": "RATE_LIMITED"}
+
+
+def test_send_sms_limits_and_dedup_run_off_the_event_loop(client, monkeypatch):
+    import threading
+    import main
+    from rate_limit import RateLimiter
+
+    threads = []
+
+    class Recording(RateLimiter):
+        def acquire(self, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return super().acquire(*args, **kwargs)
+
+    monkeypatch.setattr(main, "RATE_LIMITER", Recording())
+    data = {"sdt": "0906666666", "noidungtinnhan": "Off loop", "hash": _make_hash("0906666666", "Off loop")}
+    assert client.post("/send-sms", data=data, headers={"Idempotency-Key": "off-loop"}).status_code == 200
+    assert threads and all(name.startswith("spool-send") for name in threads)
+
+
+def test_send_sms_queued_mode(client, monkeypatch, tmp_path):
+    import os
+    import main
+    import send_queue
+    from spool_writer import SpoolWriter
+    queue = send_queue.SendQueue(SpoolWriter(str(tmp_path)), rate=1000, burst=1000)
+    monkeypatch.setattr(main, "SEND_MODE", "queue")
+    monkeypatch.setattr(main, "_send_queue", lambda *_: queue)
+
+    data = {"sdt": "0906666666", "noidungtinnhan": "Queued", "hash": _make_hash("0906666666", "Queued")}
+    body = client.post("/send-sms", data=data).json()
+    assert body["status"] == "QUEUED"
+    assert body["position"] == 1
+    assert body["eta_seconds"] == 0.0
+
+    batch = client.post("/send-sms/batch", json=[_item("0906666666", "Q2"), _item("0906666666", "Q3")]).json()
+    assert [r["position"] for r in batch["results"]] == [2, 3]
+    queue.start()
+    try:
+        for _ in range(100):
+            if len(queue) == 0 and queue.written == 3:
+                break
+            time.sleep(0.02)
+        assert sorted(os.listdir(tmp_path)) == sorted([body["file"]] + [r["file"] for r in batch["results"]])
+    finally:
+        queue.stop()
+
+
+def test_scheduled_release_into_full_queue_raises_queue_full(client, monkeypatch, tmp_path):
+    import main
+    import pytest
+    import send_queue
+    from spool_writer import SpoolWriter
+    queue = send_queue.SendQueue(SpoolWriter(str(tmp_path)), max_size=1)
+    monkeypatch.setattr(main, "SEND_MODE", "queue")
+    monkeypatch.setattr(main, "_send_queue", lambda *_: queue)
+
+    # The scheduler thread gets the plain error (and retries), not an HTTP 503.
+    with pytest.raises(send_queue.QueueFull):
+        main._release_scheduled([("0906666666", "a", None), ("0906666666", "b", None)])
+    resp = client.post("/send-sms/batch", json=[_item("0906666666", "c"), _item("0906666666", "d")])
+    assert resp.status_code == 503
+    assert resp.json()["detail"] == "QUEUE_FULL"
+
+
+def test_send_sms_placed_on_least_loaded_root(client, monkeypatch, tmp_path):
+    import importlib
+    import os
+    import main
+    admin_routes = importlib.import_module("admin-routes")
+    busy, idle = tmp_path / "busy", tmp_path / "idle"
+    for root in (busy, idle):
+        for folder in ("outgoing", "sent", "failed", "checked", "incoming"):
+            (root / folder).mkdir(parents=True)
+    for i in range(3):
+        (busy / "outgoing" / f"waiting{i}.sms").write_text("To: 0900000000\n\nx")
+    roots = [("busy", str(busy), 1.0, 0), ("idle", str(idle), 1.0, 0)]
+    monkeypatch.setattr(main, "SMS_ROOTS", roots)
+    monkeypatch.setattr(main, "SMS_OUTGOING_DIR", str(busy / "outgoing"))
+    monkeypatch.setattr(admin_routes, "SMS_ROOTS", roots)
+    monkeypatch.setattr(admin_routes, "SMS_BASE_DIR", str(busy))
+
+    data = {"sdt": "0907777777", "noidungtinnhan": "Placed", "hash": _make_hash("0907777777", "Placed")}
+    body = client.post("/send-sms", data=data).json()
+    assert body["root"] == "idle"
+    assert os.path.exists(idle / "outgoing" / body["file"])
+    # Placing a send never starts the dashboard's spool watchers.
+    import sms_watcher
+    assert not {str(busy), str(idle)} & set(sms_watcher._watchers)
+
+
+def test_send_sms_scheduled_and_cancelled(client):
+    phone, msg = "0901234567", "Later please"
+    send_at = str(time.time() + 3600)
+    resp = client.post("/send-sms", data={"sdt": phone, "noidungtinnhan": msg,
+                                          "hash": _make_hash(phone, msg), "send_at": send_at})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["status"] == "SCHEDULED"
+    schedule_id = data["id"]
+
+    cancel_hash = hashlib.md5(f"{schedule_id}&test_secret".encode()).hexdigest()
+    resp = client.post("/send-sms/cancel", data={"id": schedule_id, "hash": "bad"})
+    assert resp.status_code == 403
+    resp = client.post("/send-sms/cancel", data={"id": schedule_id, "hash": cancel_hash})
+    assert resp.json() == {"status": "CANCELLED", "id": schedule_id}
+    resp = client.post("/send-sms/cancel", data={"id": schedule_id, "hash": cancel_hash})
+    assert resp.status_code == 404
+
+
+def test_send_sms_invalid_send_at(client):
+    phone, msg = "0901234567", "When?"
+    resp = client.post("/send-sms", data={"sdt": phone, "noidungtinnhan": msg,
+                                          "hash": _make_hash(phone, msg), "send_at": "tomorrow"})
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == "INVALID_SEND_AT"
+
+
+def test_send_sms_out_of_range_send_at_is_not_scheduled(client):
+    import main
+    phone, msg = "0901234567", "Far away"
+    before = len(main._scheduler())
+    for send_at in ("inf", "nan", "1e20", "99999999999"):
+        resp = client.post("/send-sms", data={"sdt": phone, "noidungtinnhan": msg,
+                                              "hash": _make_hash(phone, msg), "send_at": send_at})
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "INVALID_SEND_AT"
+    assert len(main._scheduler()) == before
+
+
+def test_send_sms_batch_non_string_send_at(client):
+    phone, msg = "0901234567", "Typed"
+    items = [{"sdt": phone, "noidungtinnhan": msg, "hash": _make_hash(phone, msg), "send_at": [1]}]
+    data = client.post("/send-sms/batch", json=items).json()
+    assert data["results"] == [{"index": 0, "status": "ERROR", "error": "INVALID_SEND_AT"}]
+
+
+def _spool_files(phone):
+    import os
+    import main
+    return [n for n in os.listdir(main.SMS_OUTGOING_DIR) if phone in n]
+
+
+def test_send_sms_idempotency_key(client):
+    phone, msg = "0908111111", "Once only"
+    data = {"sdt": phone, "noidungtinnhan": msg, "hash": _make_hash(phone, msg)}
+    headers = {"Idempotency-Key": "retry-test-1"}
+    first = client.post("/send-sms", data=data, headers=headers).json()
+    again = client.post("/send-sms", data=data, headers=headers).json()
+    assert again == {**first, "duplicate": True}
+    assert _spool_files(phone) == [first["file"]]
+
+    other = {"sdt": phone, "noidungtinnhan": "Different", "hash": _make_hash(phone, "Different")}
+    resp = client.post("/send-sms", data=other, headers=headers)
+    assert resp.status_code == 422
+    assert resp.json()["detail"] == "IDEMPOTENCY_KEY_REUSED"
+
+
+def test_send_sms_dedup_window(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "DEDUP_WINDOW", 60.0)
+    phone, msg = "0908222222", "Same text"
+    data = {"sdt": phone, "noidungtinnhan": msg, "hash": _make_hash(phone, msg)}
+    first = client.post("/send-sms", data=data).json()
+    assert client.post("/send-sms", data=data).json()["file"] == first["file"]
+    other = {"sdt": phone, "noidungtinnhan": "New text", "hash": _make_hash(phone, "New text")}
+    assert client.post("/send-sms", data=other).json()["file"] != first["file"]
+    assert len(_spool_files(phone)) == 2
+
+
+def test_batch_idempotency_key(client):
+    headers = {"Idempotency-Key": "batch-retry-1"}
+    items = [_item("0908333333", "B1"), _item("0908333333", "B2")]
+    first = client.post("/send-sms/batch", json=items, headers=headers).json()
+    again = client.post("/send-sms/batch", json=items, headers=headers).json()
+    assert again["duplicate"] and again["results"] == first["results"]
+    assert len(_spool_files("0908333333")) == 2
+
+
+def _ref_hash(ref, secret="test_secret"):
+    return hashlib.md5(f"{ref}&{secret}".encode()).hexdigest()
+
+
+def test_delivery_status(client):
+    import os
+    import main
+    phone, msg = "0908444444", "Track me"
+    sent = client.post("/send-sms", data={"sdt": phone, "noidungtinnhan": msg,
+                                          "hash": _make_hash(phone, msg)}).json()
+    file = sent["file"]
+    assert client.get(f"/status/{file}", params={"hash": "bad"}).status_code == 403
+
+    def state():
+        return client.get(f"/status/{file}", params={"hash": _ref_hash(file)}).json().get("state")
+
+    assert state() == "outgoing"
+    base = os.path.dirname(main.SMS_OUTGOING_DIR)
+    os.rename(os.path.join(base, "outgoing", file), os.path.join(base, "sent", file))
+    for _ in range(100):
+        if state() == "sent":
+            break
+        time.sleep(0.02)
+    assert state() == "sent"
+
+    batch = client.post("/status/batch", json=[
+        {"file": file, "hash": _ref_hash(file)},
+        {"file": "nope.sms", "hash": _ref_hash("nope.sms")},
+        {"file": file, "hash": "bad"},
+    ]).json()["results"]
+    assert batch[0]["state"] == "sent" and batch[0]["root"] == "main"
+    assert batch[1] == {"file": "nope.sms", "state": "unknown"}
+    assert batch[2]["error"] == "INVALID_HASH"
+    assert client.get("/status/nope.sms", params={"hash": _ref_hash("nope.sms")}).status_code == 404
+
+
+def test_send_sms_accepts_old_secret_during_rotation(client, monkeypatch, tmp_path):
+    import config
+    conf = tmp_path / "passkey.conf"
+    conf.write_text("SECRET_KEY=test_secret\nADMIN_KEY=test_admin\n")
+    monkeypatch.setattr(config, "CONFIG_PATH", str(conf))
+    config.reload()
+    conf.write_text("SECRET_KEY=rotated\nADMIN_KEY=test_admin\nSECRET_OVERLAP=60\n")
+    config.reload()
+
+    for secret in ("rotated", "test_secret"):
+        data = {"sdt": "0901234567", "noidungtinnhan": secret, "hash": _make_hash("0901234567", secret, secret)}
+        assert client.post("/send-sms", data=data).json()["status"] == "OK"
+    data = {"sdt": "0901234567", "noidungtinnhan": "x", "hash": _make_hash("0901234567", "x", "other")}
+    assert client.post("/send-sms", data=data).json()["detail"] == "INVALID_HASH"
@@ -0,0 +1,56 @@
+"""Tests for the parsed SMS LRU cache."""
+import pytest
+
+from sms_cache import SMSCache
+
+
+def _write(path, content):
+    path.write_text(content, encoding="utf-8")
+    return path
+
+
+def test_cache_hit_and_miss_counters(tmp_path):
+    cache = SMSCache()
+    path = _write(tmp_path / "a.sms", "To: 0901234567\n\nHello")
+    first = cache.get(path)
+    second = cache.get(path)
+    assert first is second
+    assert first.phone == "0901234567"
+    assert first.preview == "Hello"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_reloads_changed_file(tmp_path):
+    cache = SMSCache()
+    path = _write(tmp_path / "a.sms", "To: 0901234567\n\nHello")
+    cache.get(path)
+    _write(path, "To: 0901234567\n\nChanged body")
+    assert cache.get(path).body == "Changed body"
+    assert cache.misses == 2
+
+
+def test_cache_evicts_by_entry_count(tmp_path):
+    cache = SMSCache(max_entries=2)
+    paths = [_write(tmp_path / f"{i}.sms", "To: 1\n\nx") for i in range(3)]
+    for p in paths:
+        cache.get(p)
+    assert cache.stats()["entries"] == 2
+    assert cache.evictions == 1
+    cache.get(paths[0])
+    assert cache.misses == 4
+
+
+def test_cache_evicts_by_bytes(tmp_path):
+    cache = SMSCache(max_bytes=3000)
+    for i in range(5):
+        cache.get(_write(tmp_path / f"{i}.sms", "To: 1\n\n" + "x" * 500))
+    stats = cache.stats()
+    assert stats["bytes"] <= 3000
+    assert stats["entries"] < 5
+
+
+def test_cache_missing_file_raises(tmp_path):
+    cache = SMSCache()
+    with pytest.raises(OSError):
+        cache.get(tmp_path / "missing.sms")
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,98 @@
+"""Tests for sharing spool state between workers."""
+import time
+
+import pytest
+
+import sms_watcher
+from sms_cluster import Cluster, ClusterError, lock_alone
+from sms_index import FolderIndex
+from sms_watcher import SpoolWatcher
+
+
+def _entry(path, stat):
+    return {"filename": path.name, "size": stat.st_size}
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def spool(tmp_path):
+    (tmp_path / "spool" / "sent").mkdir(parents=True)
+    return tmp_path / "spool" / "sent"
+
+
+@pytest.fixture
+def worker(tmp_path, spool, monkeypatch):
+    monkeypatch.setattr(sms_watcher, "POLL_INTERVAL", 0.05)
+    made = []
+
+    def make(calls=None, load_entry=_entry):
+        index = FolderIndex(spool, load_entry)
+        watcher = SpoolWatcher([index], root="main")
+        cluster = Cluster(str(tmp_path / "state"), lambda: [watcher], calls or {})
+        made.append((cluster, watcher))
+        cluster.start()
+        return cluster, index
+
+    yield make
+    for cluster, watcher in reversed(made):
+        cluster.stop()
+        watcher.stop()
+
+
+def test_follower_replicates_without_scanning(spool, worker):
+    for name in ("a.sms", "b.sms"):
+        (spool / name).write_text("To: 0901234567\n\nHello")
+    primary, _ = worker()
+    loads = []
+    follower, index = worker(load_entry=lambda path, stat: loads.append(path) or _entry(path, stat))
+    assert primary.is_primary and not follower.is_primary
+    assert sorted(e["filename"] for e in index.entries()) == ["a.sms", "b.sms"]
+    assert loads == []
+
+
+def test_refresh_waits_for_the_primary(spool, worker):
+    worker()
+    _, index = worker()
+    (spool / "new.sms").write_text("To: 0901234567\n\nHello")
+    index.refresh()
+    assert index.get("new.sms")["size"] > 0
+    (spool / "new.sms").unlink()
+    index.refresh()
+    assert index.get("new.sms") is None
+
+
+def test_lone_worker_refuses_a_shared_state_dir(tmp_path, worker):
+    lock_alone(str(tmp_path / "alone"))
+    lock_alone(str(tmp_path / "alone"))
+    worker()
+    with pytest.raises(ClusterError):
+        lock_alone(str(tmp_path / "state"))
+
+
+def test_calls_run_on_the_primary(worker):
+    def fail():
+        raise ValueError("nope")
+
+    worker({"add": lambda a, b: a + b, "fail": fail})
+    follower, _ = worker()
+    assert follower.call("add", 2, 3) == 5
+    with pytest.raises(ClusterError, match="nope"):
+        follower.call("fail")
+
+
+def test_follower_takes_over(spool, worker):
+    primary, _ = worker()
+    follower, index = worker()
+    promoted = []
+    follower.on_promote(lambda: promoted.append(True))
+    primary.stop()
+    _wait(lambda: follower.is_primary)
+    assert promoted == [True]
+    (spool / "after.sms").write_text("To: 0901234567\n\nHello")
+    _wait(lambda: index.get("after.sms") is not None)
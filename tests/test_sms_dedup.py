@@ -0,0 +1,79 @@
+"""Tests for send deduplication."""
+import threading
+import time
+
+import pytest
+
+import sms_dedup
+from sms_dedup import DedupStore, InProgress, KeyReused
+
+
+def test_repeat_returns_stored_result(tmp_path):
+    store = DedupStore(str(tmp_path / "d.sqlite"))
+    assert store.claim("k", "fp") is None
+    store.complete("k", "fp", '{"file": "a"}', ttl=60)
+    assert store.claim("k", "fp") == '{"file": "a"}'
+    with pytest.raises(KeyReused):
+        store.claim("k", "other")
+
+
+def test_released_key_can_be_claimed_again(tmp_path):
+    store = DedupStore(str(tmp_path / "d.sqlite"))
+    assert store.claim("k", "fp") is None
+    store.release("k")
+    assert store.claim("k", "fp") is None
+
+
+def test_concurrent_repeat_waits_for_first(tmp_path):
+    store = DedupStore(str(tmp_path / "d.sqlite"))
+    assert store.claim("k", "fp") is None
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(store.claim("k", "fp")))
+    waiter.start()
+    time.sleep(0.05)
+    store.complete("k", "fp", "first", ttl=60)
+    waiter.join(timeout=2)
+    assert got == ["first"]
+
+
+def test_in_progress_times_out(monkeypatch, tmp_path):
+    monkeypatch.setattr(sms_dedup, "CLAIM_WAIT", 0.05)
+    store = DedupStore(str(tmp_path / "d.sqlite"))
+    store.claim("k", "fp")
+    with pytest.raises(InProgress):
+        store.claim("k", "fp")
+
+
+def test_expired_entries_are_forgotten(tmp_path):
+    store = DedupStore(str(tmp_path / "d.sqlite"))
+    store.claim("k", "fp")
+    store.complete("k", "fp", "old", ttl=0.01)
+    time.sleep(0.02)
+    assert store.claim("k", "fp") is None
+
+
+def test_evicted_and_restarted_entries_come_from_disk(tmp_path):
+    path = str(tmp_path / "d.sqlite")
+    store = DedupStore(path, max_entries=2)
+    for key in ("a", "b", "c"):
+        store.claim(key, "fp")
+        store.complete(key, "fp", key.upper(), ttl=60)
+    assert len(store) == 2
+    assert store.claim("a", "fp") == "A"
+    store.close()
+
+    store = DedupStore(path, max_entries=2)
+    assert [store.claim(key, "fp") for key in ("a", "b", "c")] == ["A", "B", "C"]
+
+
+def test_shared_stores_see_each_others_claims(tmp_path):
+    path = str(tmp_path / "d.sqlite")
+    first, second = DedupStore(path, shared=True), DedupStore(path, shared=True)
+    assert first.claim("k", "fp") is None
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(second.claim("k", "fp")))
+    waiter.start()
+    time.sleep(0.1)
+    first.complete("k", "fp", "first", ttl=60)
+    waiter.join(timeout=2)
+    assert got == ["first"]
@@ -0,0 +1,91 @@
+"""Tests for streaming folder export."""
+import csv
+import io
+import json
+import os
+import tarfile
+
+from tests.conftest import SMS_TMP_DIR
+
+
+def _create(folder, name, content, mtime=None):
+    path = os.path.join(SMS_TMP_DIR, folder, name)
+    with open(path, "w") as f:
+        f.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def _setup_export_folder():
+    _create("checked", "exp_old.sms", "To: 0901111111\nModem: GSM1\n\nOld message", mtime=1_000_000)
+    _create("checked", "exp_new.sms", "To: 0902222222\nModem: GSM2\n\nNew message", mtime=2_000_000)
+
+
+def _records(resp):
+    return {r["filename"]: r for r in map(json.loads, resp.text.splitlines())
+            if r["filename"].startswith("exp_")}
+
+
+def test_export_ndjson(client, auth_headers):
+    _setup_export_folder()
+    resp = client.get("/admin/api/sms/checked/export", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    records = _records(resp)
+    assert records["exp_new.sms"]["body"] == "New message"
+    assert records["exp_new.sms"]["modem"] == "GSM2"
+    assert records["exp_old.sms"]["headers"]["To"] == "0901111111"
+
+
+def test_export_filters(client, auth_headers):
+    _setup_export_folder()
+    resp = client.get("/admin/api/sms/checked/export?since=1500000", headers=auth_headers)
+    assert set(_records(resp)) == {"exp_new.sms"}
+    resp = client.get("/admin/api/sms/checked/export?until=1970-01-20T00:00:00", headers=auth_headers)
+    assert set(_records(resp)) == {"exp_old.sms"}
+    resp = client.get("/admin/api/sms/checked/export?phone=0901111111", headers=auth_headers)
+    assert set(_records(resp)) == {"exp_old.sms"}
+
+
+def test_export_csv(client, auth_headers):
+    _setup_export_folder()
+    resp = client.get("/admin/api/sms/checked/export?format=csv", headers=auth_headers)
+    rows = {r["filename"]: r for r in csv.DictReader(io.StringIO(resp.text))}
+    assert rows["exp_old.sms"]["body"] == "Old message"
+    assert rows["exp_old.sms"]["modem"] == "GSM1"
+
+
+def test_export_tar(client, auth_headers):
+    _setup_export_folder()
+    resp = client.get("/admin/api/sms/checked/export?format=tar", headers=auth_headers)
+    assert resp.headers["content-disposition"] == 'attachment; filename="checked-export.tar.gz"'
+    with tarfile.open(fileobj=io.BytesIO(resp.content), mode="r:gz") as tar:
+        member = tar.extractfile("checked/exp_old.sms")
+        assert member.read() == b"To: 0901111111\nModem: GSM1\n\nOld message"
+
+
+def test_export_tar_keeps_non_utf8_bodies(client, auth_headers):
+    raw = b"To: 0903333333\nAlphabet: UCS2\n\n" + "Xin chào".encode("utf-16-be")
+    with open(os.path.join(SMS_TMP_DIR, "checked", "exp_ucs2.sms"), "wb") as f:
+        f.write(raw)
+    resp = client.get("/admin/api/sms/checked/export?format=tar", headers=auth_headers)
+    with tarfile.open(fileobj=io.BytesIO(resp.content), mode="r:gz") as tar:
+        assert tar.extractfile("checked/exp_ucs2.sms").read() == raw
+
+
+def test_export_rejects_bad_params(client, auth_headers):
+    assert client.get("/admin/api/sms/checked/export?format=xml", headers=auth_headers).status_code == 400
+    assert client.get("/admin/api/sms/checked/export?since=soon", headers=auth_headers).status_code == 400
+    for bad in ("nan", "inf", "-Infinity", "1e400"):
+        assert client.get(f"/admin/api/sms/checked/export?since={bad}", headers=auth_headers).status_code == 400
+    assert client.get("/admin/api/sms/nope/export", headers=auth_headers).status_code == 400
+
+
+def test_export_is_chunked_for_large_folders(tmp_path):
+    from sms_export import CHUNK_SIZE, export_folder
+    for i in range(2000):
+        (tmp_path / f"m{i}.sms").write_text("To: 0901234567\n\n" + "x" * 100)
+    chunks = list(export_folder(tmp_path, "ndjson"))
+    assert len(chunks) > 1
+    assert all(len(c) < CHUNK_SIZE * 2 for c in chunks)
+    assert sum(c.count(b"\n") for c in chunks) == 2000
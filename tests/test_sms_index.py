@@ -0,0 +1,84 @@
+"""Tests for the in-memory spool folder index."""
+import os
+from pathlib import Path
+
+import sms_index
+from sms_index import FolderIndex
+
+
+def _loader(calls):
+    def load(path, stat):
+        calls.append(path.name)
+        return {"filename": path.name, "size": stat.st_size, "modified": stat.st_mtime}
+    return load
+
+
+def _write(folder, name, content="To: 0901234567\n\nHello"):
+    with open(os.path.join(folder, name), "w") as f:
+        f.write(content)
+
+
+def test_index_parses_only_new_or_changed_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(sms_index, "RACY_WINDOW", -1)
+    folder = str(tmp_path)
+    calls = []
+    index = FolderIndex(Path(folder), _loader(calls))
+
+    _write(folder, "a.sms")
+    _write(folder, "b.sms")
+    index.refresh()
+    assert sorted(calls) == ["a.sms", "b.sms"]
+
+    calls.clear()
+    _write(folder, "c.sms")
+    _write(folder, "a.sms", "To: 0901234567\n\nChanged body")
+    index.refresh()
+    assert sorted(calls) == ["a.sms", "c.sms"]
+    assert len(index) == 3
+
+
+def test_index_skips_unchanged_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(sms_index, "RACY_WINDOW", -1)
+    folder = str(tmp_path)
+    calls = []
+    index = FolderIndex(Path(folder), _loader(calls))
+    _write(folder, "a.sms")
+    index.refresh()
+
+    calls.clear()
+    index.refresh()
+    assert calls == []
+
+
+def test_index_drops_removed_and_hidden_files(tmp_path):
+    folder = str(tmp_path)
+    index = FolderIndex(Path(folder), _loader([]))
+    _write(folder, "keep.sms")
+    _write(folder, "gone.sms")
+    _write(folder, ".hidden")
+    index.refresh()
+
+    os.unlink(os.path.join(folder, "gone.sms"))
+    index.refresh()
+    assert [e["filename"] for e in index.entries()] == ["keep.sms"]
+
+
+def test_index_missing_folder_is_empty(tmp_path):
+    index = FolderIndex(tmp_path / "missing", _loader([]))
+    index.refresh()
+    assert index.entries() == []
+
+
+def test_changed_event_carries_previous_entry(tmp_path):
+    folder = str(tmp_path)
+    index = FolderIndex(Path(folder), _loader([]))
+    _write(folder, "a.sms", "short")
+    index.rescan()
+    events = []
+    index.add_listener(events.append)
+
+    _write(folder, "a.sms", "a longer body")
+    index.update("a.sms")
+    assert events[0]["event"] == "changed_file"
+    assert events[0]["previous"]["size"] == 5
+    assert events[0]["file"]["size"] == 13
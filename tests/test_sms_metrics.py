@@ -0,0 +1,46 @@
+"""Tests for the Prometheus metrics registry and endpoint."""
+import hashlib
+
+from sms_metrics import Counter, Gauge, Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("t_seconds", "Test.", ("op",), buckets=(0.1, 1.0))
+    h.observe(0.05, "read")
+    h.observe(0.5, "read")
+    h.observe(5, "read")
+    assert h.samples() == [
+        't_seconds_bucket{op="read",le="0.1"} 1',
+        't_seconds_bucket{op="read",le="1"} 2',
+        't_seconds_bucket{op="read",le="+Inf"} 3',
+        't_seconds_sum{op="read"} 5.55',
+        't_seconds_count{op="read"} 3',
+    ]
+
+
+def test_counter_and_collected_gauge():
+    c = Counter("t_total", "Test.", ("kind",))
+    c.inc("a")
+    c.inc("a", amount=2)
+    assert c.render() == '# HELP t_total Test.\n# TYPE t_total counter\nt_total{kind="a"} 3'
+    g = Gauge("t_files", "Test.", ("folder",), collect=lambda: {("sent",): 4})
+    assert g.samples() == ['t_files{folder="sent"} 4']
+
+
+def test_metrics_endpoint(client):
+    phone, msg = "0909111111", "metered"
+    h = hashlib.md5(f"{phone}&{msg}&test_secret".encode()).hexdigest()
+    client.post("/send-sms", data={"sdt": phone, "noidungtinnhan": msg, "hash": h})
+    resp = client.get("/metrics", headers={"Authorization": "Bearer test_metrics"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    body = resp.text
+    assert 'sms_http_request_duration_seconds_count{method="POST",route="/send-sms",status="2xx"}' in body
+    assert "sms_spool_write_seconds_count" in body
+    assert "# TYPE sms_cache_hits_total counter" in body
+
+
+def test_metrics_endpoint_requires_token(client, auth_headers):
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer nope"}).status_code == 401
+    assert client.get("/metrics", headers=auth_headers).status_code == 200
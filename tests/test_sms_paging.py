@@ -0,0 +1,66 @@
+"""Tests for top-k page selection and keyset cursors."""
+import random
+
+import pytest
+
+from sms_paging import InvalidCursor, decode_cursor, encode_cursor, select_page, sort_key
+
+
+def _entries(n, seed=1):
+    rnd = random.Random(seed)
+    return [{"filename": f"sms_{i:05d}.sms", "modified": float(rnd.randint(0, n // 3)),
+             "size": rnd.randint(10, 500), "modem": rnd.choice(["GSM1", "GSM2", None])}
+            for i in range(n)]
+
+
+@pytest.mark.parametrize("sort_by", ["modified", "name", "size", "modem"])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_select_page_matches_full_sort(sort_by, reverse):
+    entries = _entries(1000)
+    key = sort_key(sort_by, reverse)
+    expected = sorted(entries, key=key, reverse=reverse)
+    for offset in (0, 50, 400, 950):
+        assert select_page(entries, key, reverse, offset, 50) == expected[offset:offset + 50]
+
+
+def test_missing_fields_sort_last_both_directions():
+    entries = _entries(100)
+    for reverse in (False, True):
+        page = select_page(entries, sort_key("modem", reverse), reverse, 0, 100)
+        modems = [e["modem"] for e in page]
+        first_missing = modems.index(None)
+        assert all(m is None for m in modems[first_missing:])
+
+
+def test_cursor_walk_visits_every_entry_once_despite_inserts():
+    entries = _entries(300)
+    key = sort_key("modified", True)
+    seen = []
+    after = None
+    while True:
+        page = select_page(entries, key, True, 0, 40, after)
+        if not page:
+            break
+        seen.extend(e["filename"] for e in page)
+        after = decode_cursor(encode_cursor("modified", "desc", key(page[-1])), "modified", "desc")
+        # A new, newer file arriving mid-walk must not shift later pages.
+        entries.append({"filename": f"late_{len(seen)}.sms", "modified": 1e9, "size": 1})
+    assert sorted(seen) == sorted(e["filename"] for e in entries[:300])
+
+
+def test_cursor_rejected_for_mistyped_key():
+    for sort_by, key in [("modified", ["x", "y"]), ("modified", [1.0]), ("name", [1, "a.sms"]),
+                         ("size", [0, False, "big", "a.sms"]), ("sent", [0, "no", 1.0, "a.sms"]),
+                         ("message_id", [0, True, 5, "a.sms"]), ("modified", [1.0, 2])]:
+        with pytest.raises(InvalidCursor):
+            decode_cursor(encode_cursor(sort_by, "asc", key), sort_by, "asc")
+    assert decode_cursor(encode_cursor("sent", "asc", [1, False, 0, "a.sms"]), "sent", "asc") == (
+        1, False, 0, "a.sms")
+
+
+def test_cursor_rejected_for_other_sort():
+    cursor = encode_cursor("modified", "desc", (1.0, "a.sms"))
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "name", "desc")
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-a-cursor", "modified", "desc")
@@ -0,0 +1,61 @@
+"""Tests for the smstools file parser."""
+from sms_parser import parse_sms, read_sms_header, typed_fields
+
+SENT_FILE = (
+    "To: 0901234567\n"
+    "Modem: GSM1\n"
+    "Sent: 24-02-20 10:15:30\n"
+    "Message_id: 42\n"
+    "Alphabet: ISO\n"
+    "Report: yes\n"
+    "\n"
+    "Hello\nworld\n"
+)
+
+
+def test_parse_sms_headers_and_body():
+    headers, body = parse_sms(SENT_FILE)
+    assert headers["To"] == "0901234567"
+    assert headers["Modem"] == "GSM1"
+    assert body == "Hello\nworld"
+
+
+def test_typed_fields():
+    fields = typed_fields(parse_sms(SENT_FILE)[0])
+    assert fields["sent"] == "2024-02-20T10:15:30"
+    assert fields["message_id"] == 42
+    assert fields["modem"] == "GSM1"
+    assert fields["alphabet"] == "ISO"
+    assert fields["report"] is True
+    assert fields["received"] is None
+    assert fields["fail_reason"] is None
+
+
+def test_typed_fields_keep_unparseable_values():
+    fields = typed_fields({"Sent": "yesterday", "Message_id": "abc", "Fail_reason": "Timeout"})
+    assert fields["sent"] == "yesterday"
+    assert fields["message_id"] == "abc"
+    assert fields["fail_reason"] == "Timeout"
+
+
+def test_read_sms_header_matches_full_parse(tmp_path):
+    path = tmp_path / "a.sms"
+    path.write_text(SENT_FILE)
+    headers, preview = read_sms_header(path)
+    assert headers == parse_sms(SENT_FILE)[0]
+    assert preview == "Hello\nworld"
+
+
+def test_read_sms_header_reads_only_preview_of_long_body(tmp_path):
+    path = tmp_path / "long.sms"
+    body = "đ" * 10000
+    path.write_text("From: 0901234567\n\n   " + body, encoding="utf-8")
+    headers, preview = read_sms_header(path)
+    assert headers == {"From": "0901234567"}
+    assert preview == body[:120]
+
+
+def test_read_sms_header_without_body(tmp_path):
+    path = tmp_path / "nobody.sms"
+    path.write_text("To: 0901234567\n")
+    assert read_sms_header(path) == ({"To": "0901234567"}, "")
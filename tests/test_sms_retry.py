@@ -0,0 +1,136 @@
+"""Tests for automatic retries of failed messages."""
+import os
+import time
+
+import sms_retry
+from sms_index import FolderIndex
+from sms_parser import parse_sms
+from sms_retry import RetryEngine
+from spool_writer import SpoolWriter
+
+
+def _wait(cond, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _setup(tmp_path, **kwargs):
+    for folder in ("failed", "outgoing"):
+        (tmp_path / folder).mkdir(exist_ok=True)
+    index = FolderIndex(tmp_path / "failed", lambda p, st: {"filename": p.name, "modified": st.st_mtime})
+    writer = SpoolWriter(str(tmp_path / "outgoing"))
+    engine = RetryEngine(str(tmp_path / "r.sqlite"),
+                         lambda root, msgs: writer.write_many([m[:2] for m in msgs], headers=[m[2] for m in msgs]),
+                         reasons=("timeout", "modem"), **kwargs)
+    engine.attach(index, "main")
+    return engine, index
+
+
+def _fail(index, name, reason, retry=None):
+    extra = f"X-Retry: {retry}\n" if retry is not None else ""
+    (index.path / name).write_text(f"To: 0901234567\nFail_reason: {reason}\n{extra}\nhello")
+    index.update(name)
+
+
+def _outgoing(tmp_path):
+    return sorted(os.listdir(tmp_path / "outgoing"))
+
+
+def test_transient_failures_are_retried(tmp_path):
+    engine, index = _setup(tmp_path, max_attempts=2, base_delay=0.05, rate=0)
+    _fail(index, "a.sms", "Timeout")
+    _fail(index, "b.sms", "Unknown subscriber")
+    _fail(index, "c.sms", "Modem not answering", retry=2)
+    engine.start()
+    try:
+        assert _wait(lambda: engine.metrics()["retried"] == 1)
+        [name] = _outgoing(tmp_path)
+        headers, body = parse_sms((tmp_path / "outgoing" / name).read_text())
+        assert headers["X-Retry"] == "1" and headers["X-Retry-Of"] == "a.sms" and body == "hello"
+        metrics = engine.metrics()
+        assert (metrics["permanent"], metrics["exhausted"], metrics["pending"]) == (1, 1, 0)
+        assert metrics["reasons"]["Timeout"] == 1
+    finally:
+        engine.close()
+
+
+def test_outage_defers_retries(monkeypatch, tmp_path):
+    monkeypatch.setattr(sms_retry, "OUTAGE_FAILURES", 3)
+    engine, index = _setup(tmp_path, max_attempts=3, base_delay=0.01, rate=0)
+    for i in range(3):
+        _fail(index, f"{i}.sms", "Timeout")
+    engine.start()
+    try:
+        assert _wait(lambda: engine.deferred == 3)
+        metrics = engine.metrics()
+        assert metrics["outage"] == ["main"] and metrics["pending"] == 3
+        assert _outgoing(tmp_path) == []
+    finally:
+        engine.close()
+
+
+def test_pending_retries_survive_restart(tmp_path):
+    engine, index = _setup(tmp_path, max_attempts=3, base_delay=3600, rate=0)
+    _fail(index, "a.sms", "Timeout")
+    engine.start()
+    assert _wait(lambda: engine.metrics()["pending"] == 1)
+    engine.close()
+
+    engine, _ = _setup(tmp_path, max_attempts=3, base_delay=3600, rate=0)
+    assert engine.metrics()["pending"] == 1
+    engine.close()
+
+
+def test_retries_for_a_removed_root_are_parked(tmp_path):
+    engine, index = _setup(tmp_path, max_attempts=3, base_delay=0.05, rate=0)
+    _fail(index, "a.sms", "Timeout")
+    engine._classify([("main", "a.sms")])
+    engine.close()
+
+    # Restarted with the root renamed: "main" is no longer attached.
+    engine = RetryEngine(str(tmp_path / "r.sqlite"), lambda root, msgs: [f"{root}-retry"] * len(msgs),
+                         reasons=("timeout",), base_delay=0.05, rate=0)
+    other = FolderIndex(tmp_path / "failed", lambda p, st: {"filename": p.name, "modified": st.st_mtime})
+    engine.attach(other, "other")
+    engine.start()
+    try:
+        _fail(other, "b.sms", "Timeout")
+        assert _wait(lambda: engine.metrics()["retried"] == 1)
+        assert engine.metrics()["pending"] == 1
+    finally:
+        engine.close()
+
+
+def test_failed_write_for_one_root_keeps_the_others(monkeypatch, tmp_path):
+    monkeypatch.setattr(sms_retry, "ERROR_WAIT", 0.05)
+    writes = []
+
+    def write(root, msgs):
+        writes.append(root)
+        if writes == ["a"]:
+            raise OSError("disk full")
+        return [f"{root}-retry-{i}" for i in range(len(msgs))]
+
+    engine = RetryEngine(str(tmp_path / "r.sqlite"), write, reasons=("timeout",), base_delay=0.05, rate=0)
+    indexes = {}
+    for root in ("a", "b"):
+        (tmp_path / root).mkdir()
+        indexes[root] = FolderIndex(tmp_path / root, lambda p, st: {"filename": p.name, "modified": st.st_mtime})
+        engine.attach(indexes[root], root)
+    _fail(indexes["a"], "1.sms", "Timeout")
+    _fail(indexes["b"], "2.sms", "Timeout")
+    engine._classify([("a", "1.sms"), ("b", "2.sms")])
+    time.sleep(0.1)
+
+    # Both are due in one release: a's write fails, b's still goes out, a's follows.
+    engine._release_due()
+    assert writes == ["a", "b"] and engine.metrics()["retried"] == 1
+    engine.start()
+    try:
+        assert _wait(lambda: engine.metrics()["retried"] == 2)
+    finally:
+        engine.close()
@@ -0,0 +1,91 @@
+"""Tests for scheduled sends."""
+import time
+
+import pytest
+
+import sms_scheduler
+from sms_scheduler import MAX_AHEAD, Scheduler, parse_send_at
+
+
+def _wait(cond, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_releases_in_send_at_order(tmp_path):
+    released = []
+    scheduler = Scheduler(str(tmp_path / "s.sqlite"), released.extend, rate=0)
+    now = time.time()
+    scheduler.schedule([("0902", "second", None, now + 0.2), ("0901", "first", "east", now - 1)])
+    scheduler.start()
+    try:
+        # Rows are dropped just after release() returns.
+        assert _wait(lambda: len(released) == 2 and len(scheduler) == 0)
+        assert released == [("0901", "first", "east"), ("0902", "second", None)]
+        assert scheduler.pending() == []
+    finally:
+        scheduler.close()
+
+
+def test_survives_restart_and_cancel(tmp_path):
+    path = str(tmp_path / "s.sqlite")
+    scheduler = Scheduler(path)
+    later = time.time() + 3600
+    keep, drop = scheduler.schedule([("0901", "keep", None, later), ("0902", "drop", None, later)])
+    scheduler.close()
+
+    scheduler = Scheduler(path)
+    assert len(scheduler) == 2
+    assert scheduler.cancel(drop)
+    assert not scheduler.cancel(drop)
+    assert [item["id"] for item in scheduler.pending()] == [keep]
+    scheduler.close()
+
+
+def test_backlog_drains_at_rate(tmp_path):
+    released = []
+    scheduler = Scheduler(str(tmp_path / "s.sqlite"), released.extend, rate=50, burst=5)
+    scheduler.schedule([("0901", f"m{i}", None, time.time() - 1) for i in range(15)])
+    start = time.time()
+    scheduler.start()
+    try:
+        assert _wait(lambda: len(released) == 15)
+        # 5 from the burst, 10 more at 50/s.
+        assert time.time() - start >= 0.15
+    finally:
+        scheduler.close()
+
+
+def test_failed_release_is_retried(monkeypatch, tmp_path):
+    monkeypatch.setattr(sms_scheduler, "ERROR_WAIT", 0.01)
+    released, calls = [], []
+
+    def release(messages):
+        calls.append(messages)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        released.extend(messages)
+
+    scheduler = Scheduler(str(tmp_path / "s.sqlite"), release, rate=0)
+    scheduler.schedule([("0901", "hi", None, time.time() - 1)])
+    scheduler.start()
+    try:
+        assert _wait(lambda: released == [("0901", "hi", None)])
+        assert len(scheduler) == 0
+    finally:
+        scheduler.close()
+
+
+def test_parse_send_at():
+    now = time.time()
+    assert parse_send_at(None) is None
+    assert parse_send_at(str(now - 60)) is None
+    assert parse_send_at(str(now + 60)) == now + 60
+    assert parse_send_at("2000-01-01T00:00:00") is None
+    for bad in ("soon", "nan", "inf", str(now + MAX_AHEAD + 60), 12345.0):
+        with pytest.raises(ValueError):
+            parse_send_at(bad)
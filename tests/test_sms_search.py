@@ -0,0 +1,73 @@
+"""Tests for the FTS5-backed message search index."""
+import os
+
+from sms_index import FolderIndex
+from sms_parser import parse_sms
+from sms_search import SearchIndex
+
+
+def _entry(path, stat):
+    headers, _ = parse_sms(path.read_text())
+    return {"filename": path.name, "modified": stat.st_mtime, "size": stat.st_size,
+            "phone": headers.get("To", "")}
+
+
+def _load(path):
+    return parse_sms(path.read_text())
+
+
+def _setup(tmp_path):
+    (tmp_path / "sent").mkdir()
+    index = FolderIndex(tmp_path / "sent", _entry)
+    search = SearchIndex(str(tmp_path / "state" / "search.sqlite"), _load)
+    search.attach(index)
+    return index, search
+
+
+def _write(index, name, content):
+    (index.path / name).write_text(content)
+
+
+def test_search_body_phone_and_headers(tmp_path):
+    index, search = _setup(tmp_path)
+    _write(index, "a.sms", "To: 0901234567\nModem: GSM1\n\nYour OTP is 123456")
+    _write(index, "b.sms", "To: 0987654321\nModem: GSM2\n\nHello there")
+    assert search.search("sent", "otp is") == ["a.sms"]
+    assert search.search("sent", "98765") == ["b.sms"]
+    assert search.search("sent", "GSM2") == ["b.sms"]
+    assert search.search("sent", "nothing matches") == []
+
+
+def test_search_follows_changes_and_removals(tmp_path):
+    index, search = _setup(tmp_path)
+    _write(index, "a.sms", "To: 0901234567\n\nfirst version")
+    assert search.search("sent", "first") == ["a.sms"]
+
+    _write(index, "a.sms", "To: 0901234567\n\nsecond version, longer")
+    assert search.search("sent", "first") == []
+    assert search.search("sent", "second") == ["a.sms"]
+
+    os.unlink(index.path / "a.sms")
+    assert search.search("sent", "second") == []
+
+
+def test_reconcile_after_restart_only_reads_changed_files(tmp_path):
+    index, search = _setup(tmp_path)
+    _write(index, "a.sms", "To: 0901234567\n\nkeep me")
+    _write(index, "b.sms", "To: 0901234567\n\ndrop me")
+    search.search("sent", "keep")
+    search.close()
+
+    os.unlink(index.path / "b.sms")
+    loaded = []
+
+    def counting_load(path):
+        loaded.append(path.name)
+        return _load(path)
+
+    fresh_index = FolderIndex(index.path, _entry)
+    fresh = SearchIndex(search.db_path, counting_load)
+    fresh.attach(fresh_index)
+    assert fresh.search("sent", "keep") == ["a.sms"]
+    assert fresh.search("sent", "drop") == []
+    assert loaded == []
@@ -0,0 +1,74 @@
+"""Tests for incrementally maintained delivery statistics."""
+import os
+
+from sms_index import FolderIndex
+from sms_parser import read_sms_header, phone_of, typed_fields
+from sms_stats import StatsCollector
+
+
+def _entry(path, stat):
+    headers, preview = read_sms_header(path)
+    return {"filename": path.name, "modified": stat.st_mtime, "size": stat.st_size,
+            "phone": phone_of(headers), "preview": preview, **typed_fields(headers)}
+
+
+def _setup(tmp_path):
+    indexes = {}
+    for folder in ("sent", "failed"):
+        (tmp_path / folder).mkdir()
+        indexes[folder] = FolderIndex(tmp_path / folder, _entry)
+    return indexes
+
+
+def _write(index, name, content):
+    (index.path / name).write_text(content)
+
+
+def test_seeded_from_existing_files(tmp_path):
+    idx = _setup(tmp_path)
+    _write(idx["sent"], "a.sms", "To: 0901234567\nModem: GSM1\n\nhi")
+    _write(idx["sent"], "b.sms", "To: 0901234567\nModem: GSM1\n\nhi")
+    _write(idx["failed"], "c.sms", "To: 0987654321\nModem: GSM2\nFail_reason: Timeout\n\nhi")
+    stats = StatsCollector()
+    for index in idx.values():
+        stats.attach(index)
+
+    snap = stats.snapshot()
+    assert snap["folders"]["sent"]["count"] == 2
+    assert snap["folders"]["failed"]["count"] == 1
+    assert snap["modems"] == {"GSM1": {"sent": 2, "failed": 0}, "GSM2": {"sent": 0, "failed": 1}}
+    assert snap["prefixes"]["090"] == {"sent": 2, "failed": 0}
+    assert snap["fail_reasons"] == {"Timeout": 1}
+    assert snap["top_destinations"] == [{"phone": "0901234567", "count": 2}]
+    assert snap["failure_rate"]["last_hour"] == round(1 / 3, 4)
+    assert snap["folders"]["sent"]["per_minute"][-1]["count"] == 2
+    assert len(snap["folders"]["sent"]["per_minute"]) == 60
+    assert len(snap["folders"]["sent"]["per_hour"]) == 24
+
+
+def test_follows_changes_without_rescanning(tmp_path):
+    idx = _setup(tmp_path)
+    stats = StatsCollector()
+    for index in idx.values():
+        stats.attach(index)
+
+    _write(idx["failed"], "x.sms", "To: 0901234567\nFail_reason: No credit\n\nhi")
+    idx["failed"].rescan()
+    assert stats.snapshot()["fail_reasons"] == {"No credit": 1}
+
+    os.unlink(idx["failed"].path / "x.sms")
+    idx["failed"].rescan()
+    snap = stats.snapshot()
+    assert snap["fail_reasons"] == {}
+    assert snap["folders"]["failed"]["count"] == 0
+    # Arrivals are history: the file left, but it did arrive this minute.
+    assert snap["folders"]["failed"]["per_minute"][-1]["count"] == 1
+
+
+def test_attach_is_idempotent(tmp_path):
+    idx = _setup(tmp_path)
+    _write(idx["sent"], "a.sms", "To: 0901234567\n\nhi")
+    stats = StatsCollector()
+    stats.attach(idx["sent"])
+    stats.attach(idx["sent"])
+    assert stats.snapshot()["folders"]["sent"]["count"] == 1
@@ -0,0 +1,64 @@
+"""Tests for delivery status tracking."""
+import os
+
+import sms_status
+from sms_index import FolderIndex
+from sms_parser import read_sms_header, phone_of, typed_fields
+from sms_status import StatusTracker
+
+
+def _entry(path, stat):
+    headers, preview = read_sms_header(path)
+    return {"filename": path.name, "modified": stat.st_mtime, "size": stat.st_size,
+            "phone": phone_of(headers), "preview": preview, **typed_fields(headers)}
+
+
+def _setup(tmp_path):
+    tracker = StatusTracker()
+    indexes = {}
+    for folder in sms_status.TRACKED_FOLDERS:
+        (tmp_path / folder).mkdir()
+        indexes[folder] = FolderIndex(tmp_path / folder, _entry)
+        tracker.attach(indexes[folder])
+    return tracker, indexes
+
+
+def _move(indexes, name, src, dst, content=None):
+    os.rename(indexes[src].path / name, indexes[dst].path / name)
+    if content is not None:
+        (indexes[dst].path / name).write_text(content)
+    indexes[dst].update(name)
+    indexes[src].update(name)
+
+
+def test_follows_file_to_failed(tmp_path):
+    tracker, idx = _setup(tmp_path)
+    (idx["outgoing"].path / "m.sms").write_text("To: 0901234567\n\nhi")
+    idx["outgoing"].update("m.sms")
+    assert tracker.status("m.sms")["state"] == "outgoing"
+
+    _move(idx, "m.sms", "outgoing", "checked")
+    _move(idx, "m.sms", "checked", "failed",
+          "To: 0901234567\nModem: GSM1\nFail_reason: Timeout\n\nhi")
+    status = tracker.status("m.sms")
+    assert status["state"] == "failed" and status["final"]
+    assert status["fail_reason"] == "Timeout" and status["modem"] == "GSM1"
+    assert [h["folder"] for h in status["history"]] == ["outgoing", "checked", "failed"]
+    assert tracker.status("other.sms") is None
+
+
+def test_seeded_and_gone_records_are_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(sms_status, "GONE_MAX", 1)
+    (tmp_path / "sent").mkdir()
+    for name in ("a.sms", "b.sms"):
+        (tmp_path / "sent" / name).write_text("To: 0901234567\n\nhi")
+    tracker, idx = StatusTracker(), {"sent": FolderIndex(tmp_path / "sent", _entry)}
+    tracker.attach(idx["sent"])
+    assert tracker.status("a.sms")["state"] == "sent"
+
+    for name in ("a.sms", "b.sms"):
+        os.unlink(tmp_path / "sent" / name)
+        idx["sent"].update(name)
+    # The last file to leave is still answered; older ones are dropped.
+    assert tracker.status("a.sms") is None
+    assert tracker.status("b.sms")["present"] is False
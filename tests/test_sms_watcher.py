@@ -0,0 +1,153 @@
+"""Tests for the shared spool watcher and its fan-out."""
+import asyncio
+import os
+
+import pytest
+
+import sms_watcher
+from sms_index import FolderIndex
+from sms_watcher import SpoolWatcher
+
+
+def _entry(path, stat):
+    return {"filename": path.name, "size": stat.st_size}
+
+
+@pytest.fixture(params=["inotify", "poll"])
+def watcher(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(sms_watcher, "POLL_INTERVAL", 0.05)
+    if request.param == "poll":
+        monkeypatch.setattr(sms_watcher.sys, "platform", "other")
+    (tmp_path / "sent").mkdir()
+    w = SpoolWatcher([FolderIndex(tmp_path / "sent", _entry)])
+    w.start()
+    yield w
+    w.stop()
+
+
+def _write(watcher, name):
+    with open(os.path.join(watcher.indexes["sent"].path, name), "w") as f:
+        f.write("To: 0901234567\n\nHello")
+
+
+def test_event_fanned_out_to_every_subscriber(watcher):
+    async def scenario():
+        subs = [watcher.subscribe(), watcher.subscribe()]
+        _write(watcher, "fanout.sms")
+        return [await sub.get(2) for sub in subs]
+
+    events = asyncio.run(scenario())
+    for event in events:
+        assert event["event"] == "new_file"
+        assert event["file"]["filename"] == "fanout.sms"
+
+
+def test_removed_file_event(watcher):
+    _write(watcher, "to_remove.sms")
+    watcher.indexes["sent"].refresh()
+
+    async def scenario():
+        sub = watcher.subscribe()
+        os.unlink(os.path.join(watcher.indexes["sent"].path, "to_remove.sms"))
+        return await sub.get(2)
+
+    event = asyncio.run(scenario())
+    assert event["event"] == "removed_file"
+    assert event["folder"] == "sent"
+    assert event["filename"] == "to_remove.sms"
+    assert event["previous"]["filename"] == "to_remove.sms"
+
+
+def test_slow_subscriber_is_marked_overflowed(watcher):
+    async def scenario():
+        slow = watcher.subscribe(maxsize=2)
+        fast = watcher.subscribe()
+        for i in range(5):
+            _write(watcher, f"burst_{i}.sms")
+        watcher.indexes["sent"].refresh()
+        await asyncio.sleep(0.2)
+        return slow, fast
+
+    slow, fast = asyncio.run(scenario())
+    assert slow.overflowed
+    assert not fast.overflowed
+    new_files = set()
+    while not fast.queue.empty():
+        event = fast.queue.get_nowait()
+        if event["event"] == "new_file":
+            new_files.add(event["file"]["filename"])
+    assert new_files == {f"burst_{i}.sms" for i in range(5)}
+
+
+def test_unsubscribe(watcher):
+    async def scenario():
+        sub = watcher.subscribe()
+        sub.close()
+
+    asyncio.run(scenario())
+    assert watcher.subscriber_count == 0
+
+
+def test_mtime_only_change_is_seen(watcher):
+    if watcher.backend != "inotify":
+        pytest.skip("poll mode only notices directory changes")
+    _write(watcher, "touched.sms")
+    watcher.indexes["sent"].refresh()
+
+    async def scenario():
+        sub = watcher.subscribe()
+        os.utime(os.path.join(watcher.indexes["sent"].path, "touched.sms"), (1_000_000, 1_000_000))
+        return await sub.get(2)
+
+    event = asyncio.run(scenario())
+    assert event["event"] == "changed_file"
+    assert event["file"]["filename"] == "touched.sms"
+
+
+def test_subscription_merges_roots(tmp_path):
+    watchers = []
+    for name in ("east", "west"):
+        (tmp_path / name / "sent").mkdir(parents=True)
+        w = SpoolWatcher([FolderIndex(tmp_path / name / "sent", _entry)], root=name)
+        w.start()
+        watchers.append(w)
+    try:
+        async def scenario():
+            sub = sms_watcher.subscribe(watchers)
+            for w in watchers:
+                _write(w, f"{w.root}.sms")
+            events = [await sub.get(2), await sub.get(2)]
+            sub.close()
+            return events, [w.subscriber_count for w in watchers]
+
+        events, counts = asyncio.run(scenario())
+        assert sorted((e["root"], e["file"]["filename"]) for e in events) == [
+            ("east", "east.sms"), ("west", "west.sms")]
+        assert counts == [0, 0]
+    finally:
+        for w in watchers:
+            w.stop()
+
+
+def test_failed_cycle_does_not_stop_the_watcher(watcher, monkeypatch):
+    monkeypatch.setattr(sms_watcher, "ERROR_WAIT", 0.01)
+    cycle, failed = watcher._cycle, []
+
+    def flaky():
+        if not failed:
+            failed.append(True)
+            raise OSError("EIO")
+        cycle()
+
+    monkeypatch.setattr(watcher, "_cycle", flaky)
+
+    async def scenario():
+        sub = watcher.subscribe()
+        while not failed:
+            await asyncio.sleep(0.01)
+        _write(watcher, "after_error.sms")
+        return await sub.get(2)
+
+    event = asyncio.run(scenario())
+    assert watcher._thread.is_alive()
+    assert event["file"]["filename"] == "after_error.sms"
@@ -0,0 +1,168 @@
+"""Tests for the webhook outbox and dispatcher, against a local HTTP server."""
+import asyncio
+import hashlib
+import hmac
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import sms_webhooks
+from sms_index import FolderIndex
+from sms_webhooks import WebhookDispatcher
+
+
+class _Receiver:
+    """HTTP endpoint that records posted bodies and fails the first `fail` requests."""
+
+    def __init__(self, fail=0):
+        self.bodies, self.signatures, self.fail = [], [], fail
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if receiver.fail:
+                    receiver.fail -= 1
+                    self.send_response(503)
+                else:
+                    receiver.bodies.append(body)
+                    receiver.signatures.append(self.headers["X-Signature"])
+                    self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def events(self):
+        return [e for body in self.bodies for e in json.loads(body)["events"]]
+
+
+@pytest.fixture
+def receiver():
+    r = _Receiver()
+    yield r
+    r.server.shutdown()
+
+
+def _entry(path, stat):
+    return {"filename": path.name, "modified": stat.st_mtime, "size": stat.st_size}
+
+
+def _index(tmp_path, folder):
+    (tmp_path / folder).mkdir(exist_ok=True)
+    return FolderIndex(tmp_path / folder, _entry)
+
+
+def _deliver(dispatcher, until, timeout=5.0):
+    async def run():
+        task = asyncio.create_task(dispatcher.run())
+        deadline = time.time() + timeout
+        while not until() and time.time() < deadline:
+            await asyncio.sleep(0.02)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    asyncio.run(run())
+
+
+def test_delivers_signed_batches(tmp_path, receiver):
+    incoming, sent = _index(tmp_path, "incoming"), _index(tmp_path, "sent")
+    dispatcher = WebhookDispatcher(str(tmp_path / "w.sqlite"), [(receiver.url, ("incoming",))], "s3cret")
+    dispatcher.attach(incoming, "main")
+    dispatcher.attach(sent, "main")
+    for name in ("a", "b"):
+        (incoming.path / name).write_text("From: 0901234567\n\nhi")
+        incoming.update(name)
+    (sent.path / "c").write_text("To: 0901234567\n\nhi")
+    sent.update("c")
+    assert dispatcher.flush() == 2
+
+    _deliver(dispatcher, lambda: len(dispatcher) == 0)
+    assert [e["file"]["filename"] for e in receiver.events()] == ["a", "b"]
+    assert receiver.events()[0]["folder"] == "incoming" and receiver.events()[0]["root"] == "main"
+    expected = hmac.new(b"s3cret", receiver.bodies[0], hashlib.sha256).hexdigest()
+    assert receiver.signatures[0] == f"sha256={expected}"
+
+
+def test_failed_batch_is_retried(monkeypatch, tmp_path, receiver):
+    monkeypatch.setattr(sms_webhooks, "BACKOFF_BASE", 0.05)
+    monkeypatch.setattr(sms_webhooks, "POLL_INTERVAL", 0.01)
+    receiver.fail = 2
+    incoming = _index(tmp_path, "incoming")
+    dispatcher = WebhookDispatcher(str(tmp_path / "w.sqlite"), [(receiver.url, ("incoming",))], "s")
+    dispatcher.attach(incoming, "main")
+    (incoming.path / "a").write_text("x")
+    incoming.update("a")
+
+    _deliver(dispatcher, lambda: dispatcher.delivered == 1)
+    assert dispatcher.failures == 2
+    assert len(receiver.events()) == 1
+
+
+def test_bad_url_does_not_stop_delivery(monkeypatch, tmp_path, receiver):
+    monkeypatch.setattr(sms_webhooks, "POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(sms_webhooks, "BACKOFF_BASE", 0.05)
+    bad = "http://host:notaport/hook"
+    incoming = _index(tmp_path, "incoming")
+    dispatcher = WebhookDispatcher(str(tmp_path / "w.sqlite"),
+                                   [(bad, ("incoming",)), (receiver.url, ("incoming",))], "s", workers=1)
+    dispatcher.attach(incoming, "main")
+    for name in ("a", "b"):
+        (incoming.path / name).write_text("x")
+        incoming.update(name)
+        _deliver(dispatcher, lambda: dispatcher.delivered >= 1 and dispatcher.failures >= 2)
+        dispatcher.delivered = 0
+
+    # The single worker kept going, and the bad URL was never left claimed.
+    assert [e["file"]["filename"] for e in receiver.events()] == ["a", "b"]
+    assert bad not in dispatcher._busy
+
+
+def test_failed_settle_unclaims_the_url(monkeypatch, tmp_path, receiver):
+    monkeypatch.setattr(sms_webhooks, "POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(sms_webhooks, "ERROR_WAIT", 0.01)
+    incoming = _index(tmp_path, "incoming")
+    dispatcher = WebhookDispatcher(str(tmp_path / "w.sqlite"), [(receiver.url, ("incoming",))], "s")
+    dispatcher.attach(incoming, "main")
+    settle, calls = dispatcher.settle, []
+
+    def flaky_settle(url, rows, ok):
+        calls.append(url)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        settle(url, rows, ok)
+    monkeypatch.setattr(dispatcher, "settle", flaky_settle)
+    (incoming.path / "a").write_text("x")
+    incoming.update("a")
+
+    # The URL was freed after the failed settle, so the batch went out again.
+    _deliver(dispatcher, lambda: dispatcher.delivered == 1)
+    assert len(calls) == 2
+    assert not dispatcher._busy
+
+
+def test_outbox_survives_restart(tmp_path, receiver):
+    path = str(tmp_path / "w.sqlite")
+    hooks = [(receiver.url, ("incoming",))]
+    incoming = _index(tmp_path, "incoming")
+    dispatcher = WebhookDispatcher(path, hooks, "s")
+    dispatcher.attach(incoming, "main")
+    (incoming.path / "queued").write_text("x")
+    incoming.update("queued")
+    dispatcher.flush()
+    dispatcher.close()
+
+    # A file arriving while the gateway is down is caught up on the next attach.
+    time.sleep(0.01)
+    (incoming.path / "offline").write_text("x")
+    dispatcher = WebhookDispatcher(path, hooks, "s")
+    dispatcher.attach(_index(tmp_path, "incoming"), "main")
+    _deliver(dispatcher, lambda: dispatcher.delivered >= 2)
+    assert sorted(e["file"]["filename"] for e in receiver.events()) == ["offline", "queued"]
@@ -0,0 +1,84 @@
+"""Tests for smsd control and log tailing on asyncio subprocesses."""
+import asyncio
+import os
+import sys
+import time
+
+import smsd_control
+from smsd_control import Command, tail
+
+
+def _python(code: str, timeout=None) -> Command:
+    return Command(sys.executable, "-c", code, timeout=timeout)
+
+
+def test_lines_stream_before_exit():
+    async def scenario():
+        command = _python("import time; print('first', flush=True); time.sleep(30)")
+        lines = command.lines()
+        start = time.monotonic()
+        first = await asyncio.wait_for(lines.__anext__(), 5)
+        elapsed = time.monotonic() - start
+        await lines.aclose()
+        return first, elapsed, command.returncode
+
+    first, elapsed, returncode = asyncio.run(scenario())
+    assert first == "first\n"
+    assert elapsed < 5
+    # Closing the stream killed the child.
+    assert returncode == -9
+
+
+def test_timeout_and_exit_code():
+    async def collect(command):
+        return [line async for line in command.lines()]
+
+    slow = _python("import time; time.sleep(30)", timeout=0.2)
+    assert asyncio.run(collect(slow))[-1].endswith("timed out after 0.2s\n")
+    failing = _python("import sys; print('oops'); sys.exit(3)")
+    assert asyncio.run(collect(failing)) == ["oops\n"]
+    assert failing.returncode == 3
+    missing = Command("/nonexistent/smsd")
+    assert asyncio.run(collect(missing))[0].startswith("Error running")
+
+
+def test_tail_drops_oldest_lines_for_slow_reader():
+    async def scenario():
+        chunks = []
+        stream = tail(_python("for i in range(2000): print(i)"), buffer=10)
+        async for chunk in stream:
+            chunks.append(chunk)
+            await asyncio.sleep(0.05)
+        return "".join(chunks)
+
+    text = asyncio.run(scenario())
+    assert "lines dropped" in text
+    assert text.endswith("1999\n")
+
+
+def test_restart_endpoint_streams_progress(client, auth_headers, monkeypatch, tmp_path):
+    script = tmp_path / "sudo"
+    script.write_text("#!/bin/sh\necho \"$2 $3\"\n")
+    os.chmod(script, 0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    resp = client.post("/admin/api/restart-smsd", headers=auth_headers)
+    assert resp.status_code == 200
+    assert "status smstools\n>> Restarting smsd...\nrestart smstools\n>> smsd restarted successfully" in resp.text
+
+
+def test_tail_follows_log_file(tmp_path):
+    log = tmp_path / "smsd.log"
+    log.write_text("".join(f"line {i}\n" for i in range(5)))
+
+    async def scenario():
+        stream = tail(smsd_control.tail_command(str(log), 2))
+        text = ""
+        while not text.endswith("line 4\n"):
+            text += await asyncio.wait_for(stream.__anext__(), 5)
+        with open(log, "a") as f:
+            f.write("line 5\n")
+        text += await asyncio.wait_for(stream.__anext__(), 5)
+        await stream.aclose()
+        return text
+
+    assert asyncio.run(scenario()) == "line 3\nline 4\nline 5\n"
@@ -0,0 +1,41 @@
+"""Tests for placing outgoing messages across spool roots."""
+import spool_roots
+from spool_roots import RootBalancer
+
+
+def _roots(tmp_path, *specs):
+    roots = []
+    for name, weight, capacity, depth in specs:
+        outgoing = tmp_path / name
+        outgoing.mkdir()
+        for i in range(depth):
+            (outgoing / f"q{i}.sms").write_text("To: 0901234567\n\nx")
+        roots.append((name, str(outgoing), weight, capacity))
+    return roots
+
+
+def test_places_on_least_loaded_by_weight(tmp_path):
+    roots = _roots(tmp_path, ("a", 1.0, 0, 2), ("b", 2.0, 0, 2))
+    placed = [r[0] for r in RootBalancer(roots).place(4)]
+    # b has twice the weight: 2/2 < 2/1, then b and a alternate as load evens out.
+    assert placed == ["b", "b", "a", "b"]
+
+
+def test_full_root_is_used_last(tmp_path):
+    roots = _roots(tmp_path, ("a", 10.0, 3, 3), ("b", 1.0, 0, 5))
+    assert [r[0] for r in RootBalancer(roots).place(2)] == ["b", "b"]
+
+
+def test_failure_rate_penalises_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool_roots, "FAILURE_REFRESH", 0)
+    roots = _roots(tmp_path, ("a", 1.0, 0, 2), ("b", 1.0, 0, 3))
+    rates = {"a": 0.5, "b": None}
+    balancer = RootBalancer(roots, failure_rate=rates.get)
+    assert balancer.place(1)[0][0] == "b"
+    assert balancer.loads()["a"]["failure_rate"] == 0.5
+
+
+def test_backlog_counts_as_depth(tmp_path):
+    roots = _roots(tmp_path, ("a", 1.0, 0, 0), ("b", 1.0, 0, 1))
+    balancer = RootBalancer(roots, backlog={"a": 5, "b": 0}.get)
+    assert balancer.place(1)[0][0] == "b"
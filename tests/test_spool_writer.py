@@ -0,0 +1,68 @@
+"""Tests for the atomic outgoing spool writer."""
+import os
+import threading
+
+import pytest
+
+from spool_writer import SpoolWriter
+
+
+def _visible(path):
+    return sorted(f for f in os.listdir(path) if not f.startswith("."))
+
+
+def test_same_phone_same_second_does_not_collide(tmp_path):
+    writer = SpoolWriter(str(tmp_path))
+    names = [writer.write("0901234567", f"msg {i}") for i in range(200)]
+    assert len(set(names)) == 200
+    assert _visible(tmp_path) == sorted(names)
+
+
+def test_written_file_content_and_no_temp_left(tmp_path):
+    writer = SpoolWriter(str(tmp_path), fsync="always")
+    name = writer.write("0901234567", "Xin chào")
+    assert (tmp_path / name).read_text(encoding="utf-8") == "To: 0901234567\n\nXin chào\n"
+    assert os.listdir(tmp_path) == [name]
+
+
+def test_filename_strips_unsafe_phone_characters(tmp_path):
+    name = SpoolWriter(str(tmp_path)).write("../../+84 90-123", "Hi")
+    assert "/" not in name
+    assert name.endswith("_+8490123.sms")
+    assert (tmp_path / name).read_text() == "To: ../../+84 90-123\n\nHi\n"
+
+
+def test_batch_mode_group_commit_from_many_threads(tmp_path):
+    writer = SpoolWriter(str(tmp_path), fsync="batch", fsync_window=0.01)
+    names = []
+    lock = threading.Lock()
+
+    def send(i):
+        name = writer.write("0901234567", f"msg {i}")
+        with lock:
+            names.append(name)
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert _visible(tmp_path) == sorted(names)
+    assert len(os.listdir(tmp_path)) == 20
+
+
+def test_write_many(tmp_path):
+    names = SpoolWriter(str(tmp_path), fsync="batch").write_many(
+        [("0901111111", "a"), ("0902222222", "b")])
+    assert _visible(tmp_path) == sorted(names)
+
+
+def test_write_many_extra_headers(tmp_path):
+    w = SpoolWriter(str(tmp_path))
+    [name] = w.write_many([("0901", "again")], headers=[{"X-Retry": "1"}])
+    assert (tmp_path / name).read_text() == "To: 0901\nX-Retry: 1\n\nagain\n"
+
+
+def test_invalid_fsync_mode(tmp_path):
+    with pytest.raises(ValueError):
+        SpoolWriter(str(tmp_path), fsync="sometimes")